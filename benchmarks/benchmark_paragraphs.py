@@ -0,0 +1,50 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import argparse
+import time
+from WikipediaYoinker import Section
+
+paragraph_template = '<p>A város {index}. századi története: a <a href="/wiki/Tisza" title="Tisza">Tisza</a> áradása után {index},5 ezer lakos maradt.<sup id="cite_ref-{index}" class="reference"><a href="#cite_note-{index}">[{index}]</a></sup></p>\n'
+table_template = '<table class="wikitable"><tbody><tr><th>Év</th><th>Népesség</th></tr><tr><td>{index}00</td><td>{index} 301</td></tr></tbody></table>\n'
+
+def history_section(paragraph_count: int) -> str:
+    """A long history section like Szeged's, paragraphs with links and citations and a table after every tenth."""
+    return "".join(paragraph_template.format(index=index) + (table_template.format(index=index) if index % 10 == 9 else "") for index in range(paragraph_count))
+
+def legacy_paragraphs(raw_section_data: str) -> list[str]:
+    """The previous implementation, cutting off the processed part of the section after every <p>."""
+    paragraphs = []
+    while True:
+        p_start = raw_section_data.find('<p')
+        if p_start == -1:
+            break
+        p_end = raw_section_data.find('</p>', p_start) + len('</p>')
+        paragraphs.append(raw_section_data[p_start:p_end])
+        raw_section_data = raw_section_data[p_end:]
+    return paragraphs
+
+def measure(name: str, function, section: str, repeat: int) -> list[str]:
+    start_time = time.perf_counter()
+    for _ in range(repeat):
+        result = function(section)
+    elapsed_time = time.perf_counter() - start_time
+    print(f"{name:<12}{elapsed_time / repeat * 1000:>10.2f} ms/section{len(section) * repeat / elapsed_time / 1024 / 1024:>10.1f} MiB/s")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of the paragraph extraction on long sections.")
+    parser.add_argument("--paragraphs", type=int, nargs="+", default=[50, 200, 1000, 4000], help="the paragraph counts of the synthetic sections")
+    parser.add_argument("--section", help="a saved .html section to measure instead")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.section:
+        sections = [open(args.section, encoding="utf-8").read()]
+    else:
+        sections = [history_section(count) for count in args.paragraphs]
+    for section in sections:
+        print(f"{len(section) / 1024:.0f} KiB section")
+        legacy = measure("legacy", legacy_paragraphs, section, args.repeat)
+        offsets = measure("offsets", lambda text: list(Section.iter_paragraphs(text)), section, args.repeat)
+        print(f"{'same' if legacy == offsets else 'DIFFERENT'} {len(offsets)} paragraphs")
@@ -0,0 +1,60 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import argparse
+import tempfile
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from database import Database
+
+def write_synthetic_parquet(path: str, row_count: int):
+    """Writes a WikiTableQuestions-like parquet with a small table, a question and the answers in each row."""
+    header = ["Year", "Name", "Score"]
+    table_rows = [["1990", "Alice", "12"], ["1991", "Bob", "7"]]
+    table = pa.table({
+        "id": pa.array([f"nt-{index}" for index in range(row_count)]),
+        "question": pa.array([f"Who scored {index % 20}?" for index in range(row_count)]),
+        "answers": pa.array([["Alice"]] * row_count, pa.list_(pa.string())),
+        "table": pa.array([{"header": header, "rows": table_rows}] * row_count),
+    })
+    pq.write_table(table, path, row_group_size=64 * 1024)
+
+def legacy_dataframe_from_parquet(parquet_path: str) -> list:
+    """The previous implementation, checking the duplicate columns again for every row."""
+    df = pd.read_parquet(parquet_path)
+    rows = []
+    for index, row in df.iterrows():
+        duplicate = len(df.columns) != len(df.columns.str.replace('.1$', '', regex=True).drop_duplicates())
+        if not duplicate:
+            rows.append(row)
+    return rows
+
+def measure(name: str, function, row_count: int):
+    start_time = time.perf_counter()
+    result = function()
+    elapsed_time = time.perf_counter() - start_time
+    print(f"{name:<32}{elapsed_time:>10.2f} s{row_count / elapsed_time:>14.0f} rows/s")
+    return result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of loading a synthetic parquet with Database.dataframe_from_parquet.")
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--legacy-rows", type=int, default=100_000, help="the row count of the slow legacy loader, 0 skips it")
+    args = parser.parse_args()
+
+    database = Database(":memory:")
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "synthetic.parquet")
+        write_synthetic_parquet(path, args.rows)
+        if args.legacy_rows:
+            legacy_path = os.path.join(directory, "legacy.parquet")
+            write_synthetic_parquet(legacy_path, args.legacy_rows)
+            measure("legacy iterrows", lambda: legacy_dataframe_from_parquet(legacy_path), args.legacy_rows)
+        df = measure("dataframe_from_parquet", lambda: database.dataframe_from_parquet(path), args.rows)
+        assert len(df) == args.rows
+        row_count = measure("iter_parquet_rows", lambda: sum(1 for _ in database.iter_parquet_rows(path)), args.rows)
+        assert row_count == args.rows
+        table, question, answers = database.extract_parquet(next(database.iter_parquet_rows(path)))
+        assert list(table.columns) == ["Year", "Name", "Score"] and answers == "Alice"
@@ -0,0 +1,59 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import argparse
+import logging
+import tempfile
+import time
+import pandas as pd
+from database import Database, QuestionWriter
+from WikipediaYoinker import Section, WikiYoinker
+
+def synthetic_sections(section_count: int = 4, row_count: int = 25) -> list[Section]:
+    """The sections of a Wikipedia-like page, every year and population of the tables is mentioned in the paragraph."""
+    sections = []
+    for index in range(section_count):
+        table = pd.DataFrame({'Év': [1900 + row for row in range(row_count)], 'Népesség': [170000 + row for row in range(row_count)]})
+        paragraph = " ".join(f"A város népessége {1900 + row}-ben {170000 + row} fő volt." for row in range(row_count))
+        sections.append(Section.from_parts(f"Szakasz_{index}", paragraph, [table]))
+    return sections
+
+def legacy_process_sections(wikiyoinker: WikiYoinker, sections: list[Section], database: Database, url: str):
+    """The previous implementation with skip_everything: one generate_questions_table call for every matched cell."""
+    for section in sections:
+        for index, table_section in enumerate(section.list_of_tables):
+            for result in wikiyoinker.find_matching_words(section.paragraph, table_section):
+                row, col = result['cell_coordinates']
+                statement = result['matching_sentence'].lower().strip()
+                word = str(table_section.iat[row, col]).lower().strip()
+                db_name = f'{url.split("/")[-1]}_{section}_{index}'
+                database.generate_questions_table(db_name, table_section, [("e", word, False, statement)], if_exists='append')
+
+def measure(name: str, function, page_count: int) -> float:
+    start_time = time.perf_counter()
+    for page in range(page_count):
+        function(f"https://hu.wikipedia.org/wiki/Oldal_{page}")
+    elapsed_time = time.perf_counter() - start_time
+    print(f"{name:<12}{elapsed_time:>10.2f} s{page_count / elapsed_time:>10.1f} pages/s")
+    return page_count / elapsed_time
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark of writing the questions of crawled pages with WikiYoinker.process_sections.")
+    parser.add_argument("--pages", type=int, default=20)
+    parser.add_argument("--sections", type=int, default=4)
+    parser.add_argument("--rows", type=int, default=25)
+    args = parser.parse_args()
+
+    wikiyoinker = WikiYoinker.__new__(WikiYoinker)  # the fill-mask model is not needed to store the statements
+    wikiyoinker.strict = True
+    wikiyoinker.match_phrases = False
+    logger = logging.getLogger("benchmark")
+    sections = synthetic_sections(args.sections, args.rows)
+    with tempfile.TemporaryDirectory() as directory:
+        legacy = Database(os.path.join(directory, "legacy.db"))
+        buffered = Database(os.path.join(directory, "buffered.db"))
+        writer = QuestionWriter(buffered)
+        before = measure("legacy", lambda url: legacy_process_sections(wikiyoinker, sections, legacy, url), args.pages)
+        after = measure("buffered", lambda url: wikiyoinker.process_sections(sections, logger, buffered, url, skip_everything=True, writer=writer), args.pages)
+        same = legacy.get_qa_table().equals(buffered.get_qa_table())
+        print(f"{after / before:.1f}x faster, {legacy.get_database_info()} questions, {'same' if same else 'DIFFERENT'} QA table.")
@@ -2,15 +2,23 @@ import pandas as pd
 import requests
 from bs4 import BeautifulSoup
 import re  # Import regular expressions for citation removal
+import time
+import hashlib
+import json
 from io import StringIO
-from typing import Dict, List, Tuple
-from database import Database
+from lxml import etree
+from pandas.errors import EmptyDataError
+from pandas.io.parsers import TextParser
+from typing import Dict, Iterator, List, Tuple
+from database import Database, QuestionWriter
 from transformers import pipeline
 from mylogger import MyLogger
 from openai_module import *
+from generation_cache import GenerationCache
+from crawler import Crawler
+from page_cache import PageCache
 from report import Report
 from tqdm import tqdm
-from urllib.parse import unquote
 from unidecode import unidecode
 from enum import Enum, auto
 
@@ -37,6 +45,8 @@ hungarian_question_words = ['ki',
  'hány',
  'mennyi',
  'hányszor']
+word_pattern = re.compile(r'\b\w+(?:\.\w+)?\b')  # the words of a sentence a table cell is matched with
+whitespace_pattern = re.compile(r"[\r\n]+|\s{2,}")  # the whitespace pandas.read_html collapses in the table cells
 
 class Section:    
     def __init__(self, section_name: str, raw_section_data: str) -> None:
@@ -51,6 +61,26 @@ class Section:
         self.paragraph: str = self.extract_paragraph(self.raw_section_data)
         self.list_of_tables: list[pd.DataFrame] = self.extract_tables(self.raw_section_data)
         # self.subsections: Section
+
+    @classmethod
+    def from_parts(cls, section_name: str, paragraph: str, list_of_tables: list[pd.DataFrame], raw_section_data: str = "") -> "Section":
+        """Creates a section already split into its paragraph and tables, like SectionParser does.
+
+        Args:
+            section_name (str): The name of the section
+            paragraph (str): The combined paragraph of the section
+            list_of_tables (list[pd.DataFrame]): The tables of the section
+            raw_section_data (str, optional): The raw data of the section, if it is kept. Defaults to "".
+
+        Returns:
+            Section: the section
+        """
+        section = cls.__new__(cls)
+        section.raw_section_data = raw_section_data
+        section.section_name = section_name
+        section.paragraph = paragraph
+        section.list_of_tables = list_of_tables
+        return section
         
     @staticmethod
     def analyse_subsection():
@@ -91,30 +121,40 @@ class Section:
 
         
     @staticmethod
-    def extract_paragraph(raw_section_data: str) -> str:
-        """Extract the paragraphs (non-table string data) from the section and combines those into a large paragraph. 
+    def iter_paragraphs(raw_section_data: str, start: int = 0) -> Iterator[str]:
+        """Yields the <p> tags of the section in order. The search moves an offset through the string instead of cutting off the processed part, so a section is never copied.
 
         Args:
             raw_section_data (str): The h2 section chunk of a html page
+            start (int, optional): The offset to start searching from. Defaults to 0.
 
-        Returns:
-            str: the combined paragraph 
+        Yields:
+            str: the <p> tag content with the tags
         """
-        paragraphs = []
+        position = start
         while True:
-            p_start = raw_section_data.find('<p')
+            p_start = raw_section_data.find('<p', position)
             if p_start == -1:
                 break  # No more <p> tags
 
-            p_end = raw_section_data.find('</p>', p_start) + len('</p>')
-            paragraph = raw_section_data[p_start:p_end]  # Extract the <p> tag content
-            paragraphs.append(paragraph)
+            p_end = raw_section_data.find('</p>', p_start)
+            # An unclosed <p> moves on by len('</p>') - 1 characters, like slicing at find(...) + len('</p>') did
+            p_end = p_end + len('</p>') if p_end != -1 else position + len('</p>') - 1
+            yield raw_section_data[p_start:p_end]  # Extract the <p> tag content
+            position = p_end
+
+    @staticmethod
+    def extract_paragraph(raw_section_data: str) -> str:
+        """Extract the paragraphs (non-table string data) from the section and combines those into a large paragraph. 
 
-            # Remove the processed paragraph from section_content
-            raw_section_data = raw_section_data[p_end:]
+        Args:
+            raw_section_data (str): The h2 section chunk of a html page
 
+        Returns:
+            str: the combined paragraph 
+        """
         # Unite paragraphs into plain text
-        plain_text: str = ' '.join(paragraphs).replace('<p>', '').replace('</p>', '').strip()
+        plain_text: str = ' '.join(Section.iter_paragraphs(raw_section_data)).replace('<p>', '').replace('</p>', '').strip()
 
         plain_text = Section.clean_html(plain_text)
         plain_text = Section.convert_paragraph_to_hungarian_notation(plain_text)
@@ -144,22 +184,320 @@ class Section:
             # If no tables were found in this section, continue
             return []
 
+class TableBuilder:
+    def __init__(self, hidden: bool) -> None:
+        """The rows and cells of one HTML table collected by SectionParser, turned into a DataFrame the same way as pandas.read_html does.
+
+        Args:
+            hidden (bool): The table has display:none style, pandas.read_html skips it.
+        """
+        self.hidden = hidden
+        self.head_rows: list[list[tuple[str, str | None, str | None, list[str]]]] = []
+        self.body_rows: list[list[tuple[str, str | None, str | None, list[str]]]] = []
+        self.root_rows: list[list[tuple[str, str | None, str | None, list[str]]]] = []
+        self.foot_rows: list[list[tuple[str, str | None, str | None, list[str]]]] = []
+        self.row: list[tuple[str, str | None, str | None, list[str]]] | None = None
+        self.cell: list[str] | None = None
+        self.hidden_depth = 0
+        self.has_text = False
+
+    def start_row(self, parent: str):
+        """Starts a row, the parent element decides whether it is a header, body or footer row."""
+        self.row = []
+        rows = {'thead': self.head_rows, 'tbody': self.body_rows, 'tfoot': self.foot_rows}.get(parent, self.root_rows)
+        rows.append(self.row)
+
+    def start_cell(self, tag: str, attrib):
+        """Starts a td or th cell in the current row."""
+        self.cell = []
+        self.row.append((tag, attrib.get('rowspan'), attrib.get('colspan'), self.cell))
+
+    def add_text(self, text: str):
+        """Adds text to the open cell, the text of hidden elements is dropped."""
+        if '\n' not in text or text.strip('\n'):
+            self.has_text = True
+        if self.cell is not None and self.hidden_depth == 0:
+            self.cell.append(text)
+
+    def to_frame(self) -> pd.DataFrame | None:
+        """Builds the DataFrame like pandas.read_html(decimal=",", thousands=" ") with the lxml flavor.
+
+        Raises:
+            ValueError: A rowspan or colspan is not a number, pandas.read_html fails the same way.
+
+        Returns:
+            pd.DataFrame | None: The table, None if it is hidden or empty.
+        """
+        if self.hidden or not self.has_text:
+            return None
+        head_rows = list(self.head_rows)
+        body_rows = self.body_rows + self.root_rows
+        if not head_rows:
+            # the top all-<th> rows of a table without <thead> are the header
+            while body_rows and all(cell[0] == 'th' for cell in body_rows[0]):
+                head_rows.append(body_rows.pop(0))
+        head, remainder = self.expand_spans(head_rows, [], overflow=True)
+        body, remainder = self.expand_spans(body_rows, remainder, overflow=len(self.foot_rows) > 0)
+        foot, _ = self.expand_spans(self.foot_rows, remainder, overflow=False)
+        header = None
+        if head:
+            body = head + body
+            header = 0 if len(head) == 1 else [index for index, row in enumerate(head) if any(text for text in row)]
+        body += foot
+        if body:
+            width = max(len(row) for row in body)
+            body = [row + [''] * (width - len(row)) for row in body]
+        try:
+            with TextParser(body, header=header, index_col=None, skiprows=0, parse_dates=False, thousands=" ", decimal=",", converters=None, na_values=None, keep_default_na=True) as parser:
+                return parser.read()
+        except EmptyDataError:
+            return None
+
+    @staticmethod
+    def expand_spans(rows: list, remainder: list[tuple[int, str, int]], overflow: bool) -> tuple[list[list[str]], list[tuple[int, str, int]]]:
+        """Copies the text of the cells with rowspan or colspan into the covered cells, the same as pandas.read_html.
+
+        Args:
+            rows (list): The rows of (tag, rowspan, colspan, texts) cells.
+            remainder (list[tuple[int, str, int]]): The cells spanning into these rows from the previous rows.
+            overflow (bool): Return the cells spanning below the last row instead of adding rows for them.
+
+        Returns:
+            tuple[list[list[str]], list[tuple[int, str, int]]]: The text rows and the cells spanning below the last row.
+        """
+        all_texts = []
+        for row in rows:
+            texts = []
+            next_remainder = []
+            index = 0
+            for _, rowspan, colspan, cell in row:
+                while remainder and remainder[0][0] <= index:
+                    previous_index, previous_text, previous_rowspan = remainder.pop(0)
+                    texts.append(previous_text)
+                    if previous_rowspan > 1:
+                        next_remainder.append((previous_index, previous_text, previous_rowspan - 1))
+                    index += 1
+                text = whitespace_pattern.sub(' ', ''.join(cell).strip())
+                rowspan = int(rowspan or 1)
+                for _ in range(int(colspan or 1)):
+                    texts.append(text)
+                    if rowspan > 1:
+                        next_remainder.append((index, text, rowspan - 1))
+                    index += 1
+            for previous_index, previous_text, previous_rowspan in remainder:
+                texts.append(previous_text)
+                if previous_rowspan > 1:
+                    next_remainder.append((previous_index, previous_text, previous_rowspan - 1))
+            all_texts.append(texts)
+            remainder = next_remainder
+        if not overflow:
+            while remainder:
+                next_remainder = []
+                texts = []
+                for previous_index, previous_text, previous_rowspan in remainder:
+                    texts.append(previous_text)
+                    if previous_rowspan > 1:
+                        next_remainder.append((previous_index, previous_text, previous_rowspan - 1))
+                all_texts.append(texts)
+                remainder = next_remainder
+        return all_texts, remainder
+
+class SectionParser:
+    def __init__(self) -> None:
+        """lxml parser target splitting the HTML of a page into h2 sections in one streaming pass. Citations are dropped, the paragraphs and the table cells are collected while the page is parsed, so the section HTML is never parsed again by BeautifulSoup and pandas.read_html."""
+        self.sections: list[Section] = []
+        self.stack: list[tuple[str, str | tuple[str, int] | None]] = []
+        self.section_name: str | None = None
+        self.in_section = False
+        self.awaiting_id = False
+        self.in_heading = False
+        self.paragraphs: list[str] = []
+        self.paragraph: list[str] | None = None
+        self.paragraph_depth = 0
+        self.drop_depth = 0
+        self.tables: list[pd.DataFrame | None] = []
+        self.table_stack: list[TableBuilder] = []
+        self.table_error = False
+
+    def start(self, tag: str, attrib):
+        if self.drop_depth:
+            self.drop_depth += 1
+            self.stack.append((tag, 'drop'))
+            return
+        classes = attrib.get('class', '').split()
+        if 'cite-bracket' in classes or (tag == 'sup' and 'reference' in classes):
+            self.drop_depth = 1
+            self.stack.append((tag, 'drop'))
+            return
+        effect = None
+        if tag == 'h2':
+            self.close_section()
+            self.in_section = self.awaiting_id = self.in_heading = True
+            effect = 'heading'
+        if self.awaiting_id and 'id' in attrib:
+            self.section_name = attrib['id']
+            self.awaiting_id = False
+        hidden = 'display:none' in attrib.get('style', '').replace(' ', '')
+        table = self.table_stack[-1] if self.table_stack else None
+        parent = self.stack[-1][0] if self.stack else None
+        if tag == 'table':
+            self.table_stack.append(TableBuilder(hidden))
+            self.tables.append(None)  # the tables are ordered by their start tag, like in pandas.read_html
+            effect = ('table', len(self.tables) - 1)
+        elif table is not None and (hidden or tag == 'style'):
+            for builder in self.table_stack:
+                builder.hidden_depth += 1
+            effect = 'hidden'
+        elif table is not None and tag == 'tr':
+            table.start_row(parent)
+            effect = 'row'
+        elif table is not None and tag in ('td', 'th') and parent in ('tr', 'thead'):
+            if parent == 'thead':
+                table.start_row('thead')  # a <thead> with cells and no <tr> is a row
+            table.start_cell(tag, attrib)
+            effect = 'cell'
+        elif tag == 'br':
+            for builder in self.table_stack:
+                builder.add_text('\n')
+        elif tag == 'p':
+            self.paragraph_depth += 1
+            if self.paragraph_depth == 1:
+                self.paragraph = []
+            effect = 'paragraph'
+        self.stack.append((tag, effect))
+
+    def end(self, tag: str):
+        if not self.stack:
+            return
+        _, effect = self.stack.pop()
+        if effect == 'drop':
+            self.drop_depth -= 1
+        elif effect == 'heading':
+            self.in_heading = False
+        elif isinstance(effect, tuple):
+            builder = self.table_stack.pop()
+            try:
+                table = builder.to_frame()
+                if effect[1] < len(self.tables):
+                    self.tables[effect[1]] = table
+            except ValueError:
+                self.table_error = True  # pandas.read_html fails for the whole section
+        elif effect == 'hidden':
+            for builder in self.table_stack:
+                builder.hidden_depth -= 1
+        elif effect == 'row':
+            self.table_stack[-1].row = None
+        elif effect == 'cell':
+            self.table_stack[-1].cell = None
+        elif effect == 'paragraph':
+            self.paragraph_depth -= 1
+            if self.paragraph_depth == 0:
+                if self.in_section and not self.in_heading:
+                    self.paragraphs.append(''.join(self.paragraph))
+                self.paragraph = None
+
+    def data(self, text: str):
+        if self.drop_depth:
+            return
+        if self.paragraph is not None:
+            self.paragraph.append(text)
+        for builder in self.table_stack:
+            builder.add_text(text)
+
+    def close_section(self):
+        """Stores the section parsed so far and starts collecting the next one."""
+        if self.in_section and self.section_name is not None and self.section_name not in skip_sections:
+            paragraph = Section.convert_paragraph_to_hungarian_notation(' '.join(self.paragraphs).strip())
+            tables = [table for table in self.tables if table is not None]
+            self.sections.append(Section.from_parts(self.section_name, paragraph, [] if self.table_error else tables))
+        self.section_name = None
+        self.paragraphs = []
+        self.tables = []
+        self.table_error = False
+
+    def close(self) -> list[Section]:
+        # the part after the last <h2> is the footer of the page, it is not a section
+        return self.sections
+
+    @staticmethod
+    def parse(html: str) -> list[Section]:
+        """Parses the HTML of a page into sections in one pass.
+
+        Args:
+            html (str): the HTML of the page
+
+        Returns:
+            list[Section]: list of sections in the page
+        """
+        parser = etree.HTMLParser(target=SectionParser())
+        return etree.fromstring(html.replace("–", "-"), parser)
+
+class SentenceIndex:
+    def __init__(self, sentences: list[str]) -> None:
+        """Inverted index of the sentences of a paragraph. Every sentence is lowercased and tokenized once, then a table cell is looked up in the index instead of being compared to every sentence.
+
+        Args:
+            sentences (list[str]): The sentences of the paragraph, in the order the matches are returned
+        """
+        self.sentences = sentences
+        self.by_text: dict[str, list[int]] = {}
+        self.by_token: dict[str, list[int]] = {}
+        self.tokens: list[list[str]] = []
+        for position, sentence in enumerate(sentences):
+            lowered = sentence.lower()
+            self.by_text.setdefault(lowered, []).append(position)
+            tokens = word_pattern.findall(lowered)
+            self.tokens.append(tokens)
+            for token in dict.fromkeys(tokens):
+                self.by_token.setdefault(token, []).append(position)
+
+    def find(self, cell_str: str, match_phrases: bool = False) -> list[str]:
+        """Returns the sentences matching a lowercased cell value: the sentences equal to it, otherwise the sentences containing it as a word.
+
+        Args:
+            cell_str (str): The lowercased and stripped cell value
+            match_phrases (bool, optional): A cell value of several words also matches the sentences containing those words in a row. Defaults to False.
+
+        Returns:
+            list[str]: The matching sentences in sentence order
+        """
+        positions = self.by_text.get(cell_str)
+        if positions is None:
+            positions = self.by_token.get(cell_str)
+        if positions is None and match_phrases:
+            positions = self.find_phrase(word_pattern.findall(cell_str))
+        return [self.sentences[position] for position in positions or []]
+
+    def find_phrase(self, phrase: list[str]) -> list[int]:
+        """Returns the positions of the sentences containing the tokens of the phrase in a row."""
+        if len(phrase) < 2 or any(token not in self.by_token for token in phrase):
+            return []
+        candidates = set(self.by_token[phrase[0]]).intersection(*(self.by_token[token] for token in phrase[1:]))
+        length = len(phrase)
+        return [position for position in sorted(candidates)
+                if any(self.tokens[position][start:start + length] == phrase for start in range(len(self.tokens[position]) - length + 1))]
+
 class WikiYoinker:
-    def __init__(self,  logger: MyLogger, starting_page_name: str = "Szeged", language_code: str = "hu", use_openai: bool = False, strict: bool = True) -> None:
+    def __init__(self,  logger: MyLogger, starting_page_name: str = "Szeged", language_code: str = "hu", use_openai: bool = False, strict: bool = True, generation_cache: GenerationCache | None = None, crawler: Crawler | None = None, match_phrases: bool = False) -> None:
         self.logger = logger
+        self.crawler = crawler if crawler is not None else Crawler()
+        self.generation_cache = generation_cache
         self.use_openai = use_openai
         self.strict = strict
-        self.unmasker = pipeline('fill-mask', model='xlm-roberta-base')
+        self.match_phrases = match_phrases
+        self.unmasker_model = 'xlm-roberta-base'
+        self.unmasker = pipeline('fill-mask', model=self.unmasker_model)
         self.starting_page_title = starting_page_name
         self.language_code = language_code
 
     @staticmethod
-    def url_exists_in_canonicals(existing_canonicals: list[str], title: str, language_code: str = "hu") -> bool:
+    def url_exists_in_canonicals(existing_canonicals: list[str], title: str, language_code: str = "hu", session: requests.Session | None = None) -> bool:
         """Takes the title (like "Szeged") and constructs the full URL by appending it to the base Wikipedia URL. Checks if the full canonical URL exists in the list existing_canonicals.
 
         Args:
             existing_canonicals (list[str]): list of wikipedia titles already processed
             title (str): the wikipedia title to check
+            session (requests.Session | None, optional): the pooled session to reuse, like Crawler.session. Defaults to None.
 
         Returns:
             bool: whether the url exists or not.
@@ -167,7 +505,7 @@ class WikiYoinker:
         base_url = f"https://{language_code}.wikipedia.org/wiki/"
         url = base_url + title
         try:
-            response = requests.get(url, timeout=10)
+            response = (session or requests).get(url, timeout=10)
             response.raise_for_status()
             soup = BeautifulSoup(response.text, 'html.parser')
             canonical_link = soup.find("link", rel="canonical")
@@ -182,9 +520,9 @@ class WikiYoinker:
     def yoink_page(self, url: str) -> tuple[list[pd.DataFrame], list[str]]:
         """This function should get the whole page and separate tables and the page text as return"""
         
-        response = requests.get(url)
-        tables: list[pd.DataFrame] = pd.read_html(StringIO(response.text))
-        soup = BeautifulSoup(response.text, 'html.parser')
+        _, html = self.crawler.fetch_page(url)
+        tables: list[pd.DataFrame] = pd.read_html(StringIO(html))
+        soup = BeautifulSoup(html, 'html.parser')
         content = soup.find_all(['p'])
         text = "\n".join([tag.get_text(strip=False) for tag in content])
         sentences = re.sub(r'\[\d+\]', '', text).strip().replace("\n", " ").replace("  ", " ").split(". ")
@@ -214,37 +552,19 @@ class WikiYoinker:
         Returns:
             list[Section]: list of sections in the url
         """
-        response = requests.get(url)
-        text = response.text.replace("–", "-")
-
-        # Split the response into chunks by <h2> sections
-        sections = text.split('<h2')
-
-        # Dictionary to store tables by section id
-        section_objs: list[Section] = []
-
-        for section in sections[1:-1]:  # Skip the first chunk since it is before the first <h2>
-            section = '<h2' + section  # Prepend <h2> to the section again
-
-            # Find the ID of the <h2> tag, assuming format <h2 id="section_id">
-            id_start = section.find('id="') + len('id="')
-            id_end = section.find('"', id_start)
-            section_id = section[id_start:id_end]  # Extract the id of the <h2> tag
-            
-            # Skip bannde section titles
-            if section_id in skip_sections:
-                continue
+        return self.convert_html_to_section_data(self.crawler.fetch_page(url)[1])
 
-            # Find the end of the <h2> tag
-            end_of_h2 = section.find('</h2>') + len('</h2>')
+    @staticmethod
+    def convert_html_to_section_data(html: str) -> list[Section]:
+        """Splits the HTML of a page into section chunks with section id, in one streaming pass of SectionParser. Used by Crawler.crawl in the parser processes.
 
-            # Extract the part of the section after the <h2> header
-            section_content = section[end_of_h2:]
-            
-            new_section = Section(section_name=section_id, raw_section_data=section_content)
-            section_objs.append(new_section)
+        Args:
+            html (str): the HTML of the page
 
-        return section_objs
+        Returns:
+            list[Section]: list of sections in the page
+        """
+        return SectionParser.parse(html)
 
     @staticmethod
     def get_next_500_page(starting_page: str, language_code = "hu") -> list[str]:
@@ -294,16 +614,16 @@ class WikiYoinker:
 
         page_url = f"https://hu.wikipedia.org/wiki/{next_page_title}"
 
-        request = requests.get(page_url)
+        request = self.crawler.get(page_url)
         return request
 
-    def extract_tables_by_h2(self, url: str) -> Dict[str, List[pd.DataFrame]]:
-        """extract tables for each section. Currently is not working as intended."""
+    def extract_tables_by_h2(self, url: str, html: str | None = None) -> Dict[str, List[pd.DataFrame]]:
+        """extract tables for each section. Currently is not working as intended. An already fetched html of the url is not fetched again."""
         # Fetch the response
-        response = requests.get(url)
+        text = html if html is not None else self.crawler.fetch_page(url)[1]
 
         # Split the response into chunks by <h2> sections
-        sections = response.text.split('<h2')
+        sections = text.split('<h2')
 
         # Dictionary to store tables by section id
         tables_by_section = {}
@@ -335,12 +655,12 @@ class WikiYoinker:
 
         return tables_by_section
 
-    def extract_paragraphs_by_h2(self, url: str) -> Dict[str, str]:
-        # Fetch the response
-        response = requests.get(url)
+    def extract_paragraphs_by_h2(self, url: str, html: str | None = None) -> Dict[str, str]:
+        # Fetch the response, an already fetched html of the url is not fetched again
+        text = html if html is not None else self.crawler.fetch_page(url)[1]
 
         # Split the response into chunks by <h2> sections
-        sections = response.text.split('<h2')
+        sections = text.split('<h2')
 
         # Dictionary to store paragraphs by section id
         paragraphs_by_section = {}
@@ -356,25 +676,8 @@ class WikiYoinker:
             # Find the end of the <h2> tag
             end_of_h2 = section.find('</h2>') + len('</h2>')
 
-            # Extract the part of the section after the <h2> header
-            section_content = section[end_of_h2:]
-
-            # Extract <p> tags
-            paragraphs = []
-            while True:
-                p_start = section_content.find('<p')
-                if p_start == -1:
-                    break  # No more <p> tags
-
-                p_end = section_content.find('</p>', p_start) + len('</p>')
-                paragraph = section_content[p_start:p_end]  # Extract the <p> tag content
-                paragraphs.append(paragraph)
-
-                # Remove the processed paragraph from section_content
-                section_content = section_content[p_end:]
-
-            # Unite paragraphs into plain text
-            plain_text = ' '.join(paragraphs).replace('<p>', '').replace('</p>', '').strip()
+            # Extract the <p> tags after the <h2> header and unite them into plain text
+            plain_text = ' '.join(Section.iter_paragraphs(section, end_of_h2)).replace('<p>', '').replace('</p>', '').strip()
             paragraphs_by_section[section_id] = plain_text  # Store plain text under the section id
 
         return paragraphs_by_section
@@ -389,38 +692,25 @@ class WikiYoinker:
             sentences = re.split(r'(?<=[.!?;,])\s+', paragraph)  # Split paragraph into sentences
             larger_sentences = re.split(r'(?<=[.!?])\s+', paragraph)  # Split paragraph with less stuff to split by: larger sentences
             sentences = list(set(sentences + larger_sentences)) # combine both without duplicates
-        # Create a set of words in the paragraph for exact matching
-        words_in_paragraph = set(re.findall(r'\b\w+(?:\.\w+)?\b', paragraph.lower()))
+        # Tokenize every sentence once, the cells are looked up in the index
+        sentence_index = SentenceIndex(sentences)
 
         # Store results
         results = []
         
-        # TODO
+        # The first position of a cell value gives the order, the last one the coordinates
         cell_dict = {}
-        for i, row in table.iterrows():
+        for i, row in zip(table.index, table.values):
             for j, cell in enumerate(row):
                 cell_str2 = str(cell).strip().lower()
                 cell_dict[cell_str2] = (i, j)
                 
         for cell_str, coordinate in cell_dict.items():
-            if cell_str in [s.lower() for s in sentences]:  
-                for sentence in sentences:
-                    if sentence.lower() == cell_str:
-                        results.append({
-                            'cell_coordinates': coordinate,
-                            'matching_sentence': sentence
-                        })
-
-            else:
-                # Check for any word matches (not complete sentences)
-                if cell_str in words_in_paragraph:
-                    for sentence in sentences:
-                        words_in_sentence = set(re.findall(r'\b\w+(?:\.\w+)?\b', sentence.lower()))
-                        if cell_str in words_in_sentence:
-                            results.append({
-                                'cell_coordinates': coordinate,
-                                'matching_sentence': sentence
-                            })
+            for sentence in sentence_index.find(cell_str, self.match_phrases):
+                results.append({
+                    'cell_coordinates': coordinate,
+                    'matching_sentence': sentence
+                })
 
         return results
     
@@ -454,7 +744,7 @@ class WikiYoinker:
             self.logger.debug(f"No valid solution found: {answer}")
             return masked_question.replace(mask_string, answer[0]['token_str'].lower())[:-1] + "?", False
         else:
-            question, valid = generate_question_from_sentence_openai(statement, word)
+            question, valid = generate_question_from_sentence_openai(statement, word, self.generation_cache)
             return question, valid
     
     def has_question_candidates(self, answers: list[dict]) -> str | None:
@@ -471,7 +761,23 @@ class WikiYoinker:
                 return answer['token_str']
         return None
     
-    def process_sections(self, sections: list[Section], logger, database, url: str, use_only_numbers: bool = False, skip_everything: bool = False):
+    def process_sections(self, sections: list[Section], logger, database, url: str, use_only_numbers: bool = False, skip_everything: bool = False, writer: QuestionWriter | None = None) -> int:
+        """Generates the questions of the sections of a page and writes them into the database. The questions of the page are buffered, every context table is written once and the QA rows in one transaction.
+
+        Args:
+            sections (list[Section]): The sections of the page.
+            logger (MyLogger): The logger of the generated questions.
+            database (Database): The database to write the questions into.
+            url (str): The url of the page, the context table names are made from it.
+            use_only_numbers (bool, optional): Only use the numeric cells as answers. Defaults to False.
+            skip_everything (bool, optional): Store the statements without generating questions. Defaults to False.
+            writer (QuestionWriter | None, optional): The writer shared between the pages, so the question ids are counted in memory. Defaults to None, a new writer for the page.
+
+        Returns:
+            int: The number of written questions.
+        """
+        if writer is None:
+            writer = QuestionWriter(database)
         for section in sections:
             for index, table_section in enumerate(section.list_of_tables):
                 results = self.find_matching_words(section.paragraph, table_section)
@@ -495,7 +801,8 @@ class WikiYoinker:
                         question = "e"
                     replaced_url = url.split("/")[-1].replace("–", "-").encode('ascii', 'replace').decode('ascii')
                     db_name = f'{replaced_url}_{section}_{index}'
-                    database.generate_questions_table(db_name, table_section, [(question, word, valid, statement)], if_exists='append')
+                    writer.add(db_name, table_section, (question, word, valid, statement))
+        return writer.flush()
 
 
     def algorithm_generate_question(self, statement: str, answer: str, algorithm_type: Algorithm = Algorithm.ROBERTA) -> str:
@@ -521,7 +828,7 @@ class WikiYoinker:
 
         match algorithm_type:
             case Algorithm.OPENAI:
-                return generate_question_from_sentence_openai(statement, answer)
+                return generate_question_from_sentence_openai(statement, answer, self.generation_cache)
             case Algorithm.ROBERTA:
                 mask_string = "<mask>"
                 masked_question = statement.replace(answer, mask_string)[:-1] + "?"
@@ -534,49 +841,169 @@ class WikiYoinker:
 
         raise NotImplementedError(f"{algorithm_type} algorithm handling is not implemented.")
 
-    def algorithm_db_rework(self, database: Database, algorithm_type: Algorithm = Algorithm.ROBERTA):
-        """Select an algorithm and a database, then the algorithm fills the database with questions. The questions will be overwritten!
+    @staticmethod
+    def resolve_question_candidates(outputs: list[list[dict]]) -> tuple[list[str | None], list[str]]:
+        """Runs has_question_candidates on the fill-mask outputs of many statements at once.
+
+        Args:
+            outputs (list[list[dict]]): the answers of the ROBERTA model for each statement
+
+        Returns:
+            tuple[list[str | None], list[str]]: the first token string that is a hungarian question word, or None, and the first token string for each statement
+        """
+        candidates = pd.DataFrame([(position, answer['token_str']) for position, answers in enumerate(outputs) for answer in answers], columns=['position', 'token_str'])
+        first_tokens = candidates.groupby('position', sort=True)['token_str'].first()
+        valid_tokens = candidates[candidates['token_str'].str.lower().isin(hungarian_question_words)].groupby('position')['token_str'].first()
+        positions = range(len(outputs))
+        return [valid_tokens.get(position) for position in positions], [first_tokens[position] for position in positions]
+
+    def batch_generate_questions(self, statements: list[str], answers: list[str], batch_size: int = 32) -> list[tuple[str, bool]]:
+        """Generates the questions of many statements with the ROBERTA algorithm like algorithm_generate_question, but the fill-mask pipeline gets the masked statements in batches.
+
+        Args:
+            statements (list[str]): The statements, complete sentences.
+            answers (list[str]): The answer word of each statement.
+            batch_size (int, optional): The number of statements in one forward pass of the model. Defaults to 32.
+
+        Returns:
+            list[tuple[str, bool]]: The question and whether it has a question word, for each statement.
+        """
+        mask_string = "<mask>"
+        results: list[tuple[str, bool] | None] = [None] * len(statements)
+        masked_questions: dict[int, str] = {}
+        for position, (statement, answer) in enumerate(zip(statements, answers)):
+            if len(statement) > 512:
+                self.logger.debug(f"Statement is too long: {statement}")
+                results[position] = ("Statement is too long.", False)
+            elif statement.count(answer) != 1:
+                results[position] = ("Multiple answer word found in the sentence.", True)
+            else:
+                masked_questions[position] = statement.replace(answer, mask_string)[:-1] + "?"
+
+        # A generator is streamed through the pipeline in batches, and a single statement is not unwrapped from the list of outputs
+        prompts = (f"Kérdés: {masked_questions[position]}\nVálasz: {answers[position]}." for position in masked_questions)
+        outputs = list(tqdm(self.unmasker(prompts, batch_size=batch_size), total=len(masked_questions), desc="Unmasking statements"))
+        valid_tokens, first_tokens = self.resolve_question_candidates(outputs)
+        for (position, masked_question), output, valid_token, first_token in zip(masked_questions.items(), outputs, valid_tokens, first_tokens):
+            if valid_token:
+                results[position] = (masked_question.replace(mask_string, valid_token)[:-1] + "?", True)
+            else:
+                self.logger.debug(f"No valid solution found: {output}")
+                results[position] = (masked_question.replace(mask_string, first_token.lower())[:-1] + "?", False)
+        return results
+
+    def model_version(self, algorithm_type: Algorithm) -> str:
+        """Returns the model generating the questions with the algorithm, a change of it makes every question stale.
+
+        Args:
+            algorithm_type (Algorithm): The algorithm used to generate the questions.
+
+        Returns:
+            str: the model name.
+        """
+        match algorithm_type:
+            case Algorithm.OPENAI:
+                return DEFAULT_OPENAI_MODEL  # the model of call_openai
+            case Algorithm.ROBERTA:
+                return self.unmasker_model
+        raise NotImplementedError(f"{algorithm_type} algorithm handling is not implemented.")
+
+    @staticmethod
+    def question_fingerprint(statement: str, answer: str, algorithm_type: Algorithm, model_version: str) -> str:
+        """Returns the content fingerprint of a question: everything its generation depends on.
+
+        Args:
+            statement (str): The statement the question is generated from.
+            answer (str): The answer word of the statement.
+            algorithm_type (Algorithm): The algorithm used to generate the question.
+            model_version (str): The model of the algorithm.
+
+        Returns:
+            str: The SHA-256 hex digest of the inputs.
+        """
+        content = json.dumps([str(statement), str(answer), algorithm_type.name, model_version], ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def algorithm_db_rework(self, database: Database, algorithm_type: Algorithm = Algorithm.ROBERTA, batch_size: int | None = None, force: bool = False) -> float:
+        """Select an algorithm and a database, then the algorithm fills the database with questions. The fingerprint column of the QA table records the inputs of each question, only the rows without a fingerprint or with a changed one are regenerated, so a rework after a new crawl costs time in proportion to the new rows.
 
         Args:
             database (Database): the database path filled with statements and answers with or without questions.
             algorithm_type (Algorithm, optional): The algorithm used to fill the database. Defaults to Algorithm.ROBERTA.
+            batch_size (int | None, optional): The ROBERTA algorithm unmasks the statements in batches of this size, None unmasks them one by one. Defaults to None.
+            force (bool, optional): Regenerate every question, the questions will be overwritten! Defaults to False.
+
+        Returns:
+            float: the number of statements reworked per second.
         """
         qa_table: pd.DataFrame = database.get_qa_table()
-        for index, row in tqdm(qa_table.iterrows(), total=qa_table.shape[0], desc="Algorithm filling questions"):
-            statement = row['original']
-            answer = row['targetValue']
-            question, valid = self.algorithm_generate_question(statement, answer, algorithm_type)
-            qa_table.at[index, 'utterance'] = question
+        model_version = self.model_version(algorithm_type)
+        fingerprints = pd.Series([self.question_fingerprint(statement, answer, algorithm_type, model_version) for statement, answer in zip(qa_table['original'], qa_table['targetValue'])], index=qa_table.index, dtype=object)
+        if force or 'fingerprint' not in qa_table.columns:
+            stale = pd.Series(True, index=qa_table.index)
+        else:
+            stale = qa_table['fingerprint'] != fingerprints
+        stale_rows = qa_table[stale]
+        if stale_rows.empty:
+            self.logger.info(f"0 of {qa_table.shape[0]} statements reworked, every question is up to date")
+            return 0.0
+
+        start_time = time.perf_counter()
+        if batch_size is not None and algorithm_type == Algorithm.ROBERTA:
+            results = self.batch_generate_questions(stale_rows['original'].tolist(), stale_rows['targetValue'].tolist(), batch_size)
+            qa_table.loc[stale, 'utterance'] = [question for question, _ in results]
+        else:
+            for index, row in tqdm(stale_rows.iterrows(), total=stale_rows.shape[0], desc="Algorithm filling questions"):
+                statement = row['original']
+                answer = row['targetValue']
+                question, valid = self.algorithm_generate_question(statement, answer, algorithm_type)
+                qa_table.at[index, 'utterance'] = question
+        elapsed_time = time.perf_counter() - start_time
+        statements_per_second = stale_rows.shape[0] / elapsed_time if elapsed_time else 0.0
+        self.logger.info(f"{stale_rows.shape[0]} of {qa_table.shape[0]} statements reworked, {statements_per_second:.1f} statements/s")
+        qa_table['fingerprint'] = fingerprints
         database.set_qa_table(qa_table)
+        return statements_per_second
 
 def main():
     data_path = "data/generated_hu.db"
     starting_page = "Szeged"
     log_path = 'data/wiki.log'
     batch_count = 4
+    page_cache_path = 'data/page_cache.db'
+    offline = False   # replay the cached pages after a parser change, without any request
     
     database = Database(data_path)
     logger: MyLogger = MyLogger(log_path=log_path, result_path=log_path)    
-    wikiyoinker = WikiYoinker(starting_page_name=starting_page, use_openai=False, strict=True, logger=logger)
+    page_cache = PageCache(page_cache_path, offline=offline)
+    wikiyoinker = WikiYoinker(starting_page_name=starting_page, use_openai=False, strict=True, logger=logger, crawler=Crawler(page_cache=page_cache))
+    writer = QuestionWriter(database)
 
     # Fill Database    
     if False:
         database.empty_database()
-        for x in range(batch_count):
+        if offline:
+            for url, sections in tqdm(wikiyoinker.crawler.crawl(page_cache.cached_urls(), WikiYoinker.convert_html_to_section_data), desc="cached pages"):
+                try:
+                    wikiyoinker.process_sections(sections, logger, database, url, skip_everything=True, writer=writer)
+                except Exception as e:
+                    logger.warning(e)
+        for x in range(batch_count if not offline else 0):
                 pages, starting_page = wikiyoinker.get_next_500_page(starting_page, "hu")
-                for page in tqdm(pages, desc=f"batch no. {x}."):
+                page_urls = [f"https://hu.wikipedia.org/wiki/{page}" for page in pages]
+                for url, sections in tqdm(wikiyoinker.crawler.crawl(page_urls, WikiYoinker.convert_html_to_section_data), total=len(page_urls), desc=f"batch no. {x}."):
                     try:
-                        page_url = f"https://hu.wikipedia.org/wiki/{page}"
-                        req = requests.get(page_url)
-                        url = unquote(req.url)
-                        sections = wikiyoinker.convert_url_to_section_data(url)
-                        wikiyoinker.process_sections(sections, logger, database, url, skip_everything=True)
+                        wikiyoinker.process_sections(sections, logger, database, url, skip_everything=True, writer=writer)
                     except Exception as e:
                         logger.warning(e)
+                for url, error in wikiyoinker.crawler.errors:
+                    logger.warning(f"{url}: {error}")
+                wikiyoinker.crawler.errors.clear()
+        logger.info(f"Page cache: {page_cache}")
     
     
     # Database Modifying
-    wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA)
+    wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA, batch_size=32)
     Report(db_name="generated_hu.db").create_report_from_db()
 
 def h3_separation(section: Section):
@@ -0,0 +1,100 @@
+import hashlib
+import json
+import sqlite3
+from database import quote_identifier
+
+class CheckpointStore:
+    def __init__(self, path: str, table_name: str = "eval_checkpoint", create_schema: bool = True) -> None:
+        """Per-question evaluation results streamed to an SQLite table, so an interrupted run can be resumed and question shards evaluated in separate processes can be merged. A result stores the fingerprint of its question, so a resumed run asks the reworked or renumbered questions again.
+
+        Args:
+            path (str): The path to the SQLite database, usually the database of the QA table.
+            table_name (str, optional): The name of the checkpoint table. Defaults to "eval_checkpoint".
+            create_schema (bool, optional): Create the checkpoint table and switch to WAL mode, False if another process already did. Defaults to True.
+        """
+        self.path = path
+        self.table_name = table_name
+        self.quoted_table_name = quote_identifier(table_name)
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        if create_schema:
+            self.connection.execute("PRAGMA journal_mode=WAL")  # shards in other processes write at the same time
+            self.connection.execute(f"""CREATE TABLE IF NOT EXISTS {self.quoted_table_name} (
+                model TEXT NOT NULL,
+                seed INTEGER NOT NULL,
+                question INTEGER NOT NULL,
+                score REAL NOT NULL,
+                answer TEXT,
+                fingerprint TEXT,
+                PRIMARY KEY (model, seed, question)
+            )""")
+            columns = [column[1] for column in self.connection.execute(f"PRAGMA table_info({self.quoted_table_name})")]
+            if 'fingerprint' not in columns:  # results stored before the fingerprints are never resumed
+                self.connection.execute(f"ALTER TABLE {self.quoted_table_name} ADD COLUMN fingerprint TEXT")
+            self.connection.commit()
+
+    @staticmethod
+    def fingerprint(question: str, context: str, target_value: str) -> str:
+        """Returns the fingerprint of a question: the question, its context table and its answer.
+
+        Args:
+            question (str): The question.
+            context (str): The name of the context table.
+            target_value (str): The answer of the question.
+
+        Returns:
+            str: The SHA-256 hex digest of the question.
+        """
+        content = json.dumps([str(question), str(context), str(target_value)], ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def save(self, model: str, seed: int, question: int, score: float, answer: str, fingerprint: str | None = None):
+        """Stores the result of one question, overwriting the previous result of the same model, seed and question.
+
+        Args:
+            model (str): The model name.
+            seed (int): The seed index.
+            question (int): The question index.
+            score (float): The score of the answer.
+            answer (str): The raw answer of the model.
+            fingerprint (str | None, optional): The fingerprint of the asked question. Defaults to None.
+        """
+        self.connection.execute(f"INSERT OR REPLACE INTO {self.quoted_table_name} (model, seed, question, score, answer, fingerprint) VALUES (?, ?, ?, ?, ?, ?)", (model, seed, question, score, answer, fingerprint))
+        self.connection.commit()
+
+    def load(self, model: str, seed: int, questions: range, fingerprints: dict[int, str] | None = None) -> dict[int, float]:
+        """Returns the scores of the already answered questions.
+
+        Args:
+            model (str): The model name.
+            seed (int): The seed index.
+            questions (range): The question indices to look for.
+            fingerprints (dict[int, str] | None, optional): The fingerprints of the current questions, a result of a different question at the same index is not returned. None returns every result. Defaults to None.
+
+        Returns:
+            dict[int, float]: The score for each answered question index.
+        """
+        cursor = self.connection.execute(f"SELECT question, score, fingerprint FROM {self.quoted_table_name} WHERE model = ? AND seed = ? AND question >= ? AND question < ?", (model, seed, questions.start, questions.stop))
+        return {question: score for question, score, fingerprint in cursor.fetchall() if fingerprints is None or fingerprints.get(question) == fingerprint}
+
+    def results(self, model: str, seeds: range, questions: range) -> list[float]:
+        """Merges the stored scores into the accuracy of each seed, unanswered questions count as wrong.
+
+        Args:
+            model (str): The model name.
+            seeds (range): The seed indices.
+            questions (range): The question indices.
+
+        Returns:
+            list[float]: the results as percentage for each seed
+        """
+        cursor = self.connection.execute(f"SELECT seed, SUM(score) FROM {self.quoted_table_name} WHERE model = ? AND question >= ? AND question < ? GROUP BY seed", (model, questions.start, questions.stop))
+        scores = dict(cursor.fetchall())
+        return [scores.get(seed, 0.0)/len(questions) for seed in seeds]
+
+    def clear(self, model: str):
+        """Deletes the stored results of a model."""
+        self.connection.execute(f"DELETE FROM {self.quoted_table_name} WHERE model = ?", (model,))
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
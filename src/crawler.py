@@ -0,0 +1,163 @@
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from typing import Callable, Iterator
+from urllib.parse import unquote, urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from page_cache import PageCache
+
+class Crawler:
+    def __init__(self, max_workers: int = 8, max_per_host: int = 4, min_interval: float = 0.05, retries: int = 5, backoff: float = 0.5, timeout: float = 10, user_agent: str = "QATesting crawler (table question answering research)", page_cache: PageCache | None = None) -> None:
+        """Fetches pages through one pooled requests.Session with bounded concurrency, per-host politeness limits and retries.
+
+        Args:
+            max_workers (int, optional): The maximum number of requests in flight. Defaults to 8.
+            max_per_host (int, optional): The maximum number of requests in flight to one host. Defaults to 4.
+            min_interval (float, optional): The minimum number of seconds between two requests to one host. Defaults to 0.05.
+            retries (int, optional): The number of retries of a failed request or a 429/5xx response, Retry-After is respected. Defaults to 5.
+            backoff (float, optional): The backoff factor of the exponential retry delay in seconds. Defaults to 0.5.
+            timeout (float, optional): The connect and read timeout of a request in seconds. Defaults to 10.
+            user_agent (str, optional): The User-Agent header, Wikimedia asks for a descriptive one.
+            page_cache (PageCache | None, optional): The on-disk page cache, the pages are fetched, revalidated or replayed through it. Defaults to None.
+        """
+        self.page_cache = page_cache
+        self.max_workers = max_workers
+        self.max_per_host = max_per_host
+        self.min_interval = min_interval
+        self.timeout = timeout
+        self.session = requests.Session()
+        retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET", "HEAD"], respect_retry_after_header=True)
+        adapter = HTTPAdapter(pool_connections=max_workers, pool_maxsize=max_workers, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.session.headers["User-Agent"] = user_agent
+        self.lock = threading.Lock()
+        self.host_slots: dict[str, threading.Semaphore] = {}
+        self.next_request: dict[str, float] = {}
+        self.errors: list[tuple[str, Exception]] = []
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """Fetches a URL through the pooled session, waiting for the politeness limits of its host.
+
+        Args:
+            url (str): The URL to fetch.
+            **kwargs: Passed to requests.Session.get, like params.
+
+        Raises:
+            requests.HTTPError: The response is an error after the retries.
+
+        Returns:
+            requests.Response: The response.
+        """
+        host = urlsplit(url).netloc
+        with self.lock:
+            slot = self.host_slots.setdefault(host, threading.Semaphore(self.max_per_host))
+        with slot:
+            self.wait_turn(host)
+            response = self.session.get(url, timeout=self.timeout, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def fetch_page(self, url: str) -> tuple[str, str]:
+        """Fetches a page through the page cache if there is one.
+
+        Args:
+            url (str): The URL of the page.
+
+        Returns:
+            tuple[str, str]: The unquoted final URL of the page after redirects and its HTML.
+        """
+        if self.page_cache is not None:
+            return self.page_cache.fetch(url, self.get)
+        response = self.get(url)
+        return unquote(response.url), response.text
+
+    def wait_turn(self, host: str):
+        """Sleeps until min_interval has passed since the previous request to the host."""
+        with self.lock:
+            now = time.monotonic()
+            start = max(now, self.next_request.get(host, now))
+            self.next_request[host] = start + self.min_interval
+        if start > now:
+            time.sleep(start - now)
+
+    def fetch_many(self, urls: list[str]) -> Iterator[tuple[str, tuple[str, str] | Exception]]:
+        """Fetches the pages concurrently with fetch_page, at most max_workers at once.
+
+        Args:
+            urls (list[str]): The URLs to fetch.
+
+        Yields:
+            tuple[str, tuple[str, str] | Exception]: The URL and its final URL and HTML, or the error, in the order the requests finish.
+        """
+        urls = iter(urls)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pending: dict[Future, str] = {}
+            for url in urls:
+                pending[executor.submit(self.fetch_page, url)] = url
+                if len(pending) >= 2 * self.max_workers:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    next_url = next(urls, None)
+                    if next_url is not None:
+                        pending[executor.submit(self.fetch_page, next_url)] = next_url
+                    try:
+                        yield url, future.result()
+                    except Exception as error:
+                        yield url, error
+
+    def crawl(self, urls: list[str], parse: Callable[[str], object], parse_workers: int | None = None) -> Iterator[tuple[str, object]]:
+        """Fetches the pages concurrently and parses their HTML in a process pool, so parsing never blocks the downloads. Failed pages are collected in errors.
+
+        Args:
+            urls (list[str]): The URLs of the pages.
+            parse (Callable[[str], object]): Parses the HTML of a page, it must be picklable, like a module level function or a static method.
+            parse_workers (int | None, optional): The number of parser processes, 0 parses in the calling thread and None uses every CPU core. Defaults to None.
+
+        Yields:
+            tuple[str, object]: The unquoted final URL of the page after redirects and its parsed content.
+        """
+        if parse_workers == 0:
+            for url, page in self.fetch_many(urls):
+                if isinstance(page, Exception):
+                    self.errors.append((url, page))
+                    continue
+                final_url, html = page
+                try:
+                    yield final_url, parse(html)
+                except Exception as error:
+                    self.errors.append((url, error))
+            return
+        with ProcessPoolExecutor(max_workers=parse_workers, mp_context=multiprocessing.get_context("spawn")) as parsers:
+            limit = 2 * (parse_workers or os.cpu_count() or 1)
+            pending: dict[Future, str] = {}
+
+            def collect() -> Iterator[tuple[str, object]]:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    url = pending.pop(future)
+                    try:
+                        yield url, future.result()
+                    except Exception as error:
+                        self.errors.append((url, error))
+
+            for url, page in self.fetch_many(urls):
+                if isinstance(page, Exception):
+                    self.errors.append((url, page))
+                    continue
+                final_url, html = page
+                pending[parsers.submit(parse, html)] = final_url
+                if len(pending) >= limit:  # bounded, the downloads wait for the parsers
+                    yield from collect()
+            while pending:
+                yield from collect()
+
+    def close(self):
+        self.session.close()
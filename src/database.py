@@ -1,29 +1,158 @@
 import pandas as pd
 import sqlite3
 import os
+import json
+import pathlib
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from enum import Enum
+from itertools import islice
+from typing import Iterator
+import pyarrow as pa
+import pyarrow.parquet as pq
+from utilities import TableFormat, normalize_chunk, serialize_table
+
+class Storage(Enum):
+    TABLES = 0          # one SQLite table for each context table
+    CONSOLIDATED = 1    # one serialized row for each context table in a shared table
 
 class Database:
-    def __init__(self, path: str = '/home/p_tabtg/llama_project/QATesting/data/database.db', qa_table_name: str = "qa_table") -> None:
+    def __init__(self, path: str = '/home/p_tabtg/llama_project/QATesting/data/database.db', qa_table_name: str = "qa_table", storage: Storage | None = None, context_table_name: str = "context_tables", cached_statements: int = 256) -> None:
+        """The SQLite database of the context tables and the QA table. Every thread reads and writes through its own persistent connection, which caches the prepared statements, and the writes go through the transaction context manager.
+
+        Args:
+            path (str, optional): The path to the SQLite database.
+            qa_table_name (str, optional): The name of the QA table. Defaults to "qa_table".
+            storage (Storage | None, optional): How the context tables are stored, None detects it from the database when reading and writes separate tables. Defaults to None.
+            context_table_name (str, optional): The name of the shared table of the consolidated storage. Defaults to "context_tables".
+            cached_statements (int, optional): The number of prepared statements cached by each connection. Defaults to 256.
+        """
         self.path = path
         self.qa_table_name = qa_table_name
+        self.storage = storage
+        self.context_table_name = context_table_name
+        self.cached_statements = cached_statements
+        self.local = threading.local()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        del state['local']  # the connections stay in their threads
+        return state
+
+    def __setstate__(self, state: dict):
+        self.__dict__.update(state)
+        self.local = threading.local()
+
+    def connect(self) -> sqlite3.Connection:
+        """Returns the persistent connection of the calling thread, it is opened on the first call.
 
-    def dataframe_from_parquet(self, parquet_path: str) -> pd.DataFrame:
-        """Generates dataframe from a parquet.
+        Returns:
+            sqlite3.Connection: The connection of the thread.
+        """
+        connection = getattr(self.local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=60, cached_statements=self.cached_statements)
+            self.local.connection = connection
+            self.local.depth = 0
+        return connection
+
+    def connect_read_only(self) -> sqlite3.Connection:
+        """Returns the read-only connection of the calling thread for untrusted statements, it is opened on the first call. It is separate from the connection of connect, so it never sees or ends the transactions of the thread.
+
+        Returns:
+            sqlite3.Connection: The read-only connection of the thread.
+        """
+        connection = getattr(self.local, 'read_only_connection', None)
+        if connection is None:
+            uri = pathlib.Path(self.path).absolute().as_uri() + "?mode=ro"
+            connection = sqlite3.connect(uri, uri=True, timeout=60, cached_statements=self.cached_statements)
+            connection.execute("PRAGMA query_only=ON")  # attached databases are not writable either
+            self.local.read_only_connection = connection
+        return connection
+
+    def close(self):
+        """Closes the connections of the calling thread, the next call opens new ones."""
+        for name in ['connection', 'read_only_connection']:
+            connection = getattr(self.local, name, None)
+            if connection is not None:
+                connection.close()
+                setattr(self.local, name, None)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Runs the block in one transaction of the thread's connection: it is committed at the end of the block and rolled back on an exception. A transaction opened inside another one joins it.
+
+        Yields:
+            sqlite3.Cursor: A cursor of the connection.
+        """
+        connection = self.connect()
+        cursor = connection.cursor()
+        if self.local.depth > 0:
+            self.local.depth += 1
+            try:
+                yield cursor
+            finally:
+                self.local.depth -= 1
+                cursor.close()
+            return
+        cursor.execute("BEGIN")  # the table creations and drops are part of the transaction too
+        self.local.depth = 1
+        try:
+            yield cursor
+            connection.commit()
+        except BaseException:
+            connection.rollback()
+            raise
+        finally:
+            self.local.depth = 0
+            cursor.close()
+
+    def dataframe_from_parquet(self, parquet_path: str, columns: list[str] | None = None) -> pd.DataFrame:
+        """Generates dataframe from a parquet. Parquets with duplicate columns (pandas renames them to 'name.1') are skipped.
 
         Args:
             parquet_path (str): The path to the parquet.
+            columns (list[str] | None, optional): The columns to read, None reads every column. Defaults to None.
 
         Returns:
-            pandas.Dataframe: returns the parquet as pandas Dataframe.
-        """
-        df = pd.read_parquet(parquet_path)
-        rows = []
-        for index, row in df.iterrows():
-            duplicate = len(df.columns) != len(df.columns.str.replace('.1$', '').drop_duplicates())
-            if not duplicate:
-                rows.append(row)
-        return rows
-    
+            pandas.Dataframe: returns the parquet as pandas Dataframe, empty if it has duplicate columns.
+        """
+        df = pd.read_parquet(parquet_path, columns=columns)
+        if self.has_duplicate_columns(df.columns):
+            return df.iloc[0:0]
+        return df
+
+    def iter_parquet_rows(self, parquet_path: str, batch_size: int = 1024):
+        """Streams the rows of a parquet one record batch at a time, so a large parquet is never loaded at once. The rows work with extract_parquet.
+
+        Args:
+            parquet_path (str): The path to the parquet.
+            batch_size (int, optional): The number of rows read at once. Defaults to 1024.
+
+        Yields:
+            dict: The row as a dictionary of the column values.
+        """
+        parquet_file = pq.ParquetFile(parquet_path)
+        if self.has_duplicate_columns(parquet_file.schema_arrow.names):
+            return
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield from batch.to_pylist()
+
+    @staticmethod
+    def has_duplicate_columns(columns) -> bool:
+        """Checks whether the columns contain a duplicate, also when pandas renamed it with a '.1', '.2', ... suffix.
+
+        Args:
+            columns: The column names.
+
+        Returns:
+            bool: Is there a duplicate column?
+        """
+        columns = pd.Index(columns)
+        return len(columns) != len(columns.astype(str).str.replace(r'\.\d+$', '', regex=True).drop_duplicates())
+
     def wtq_collector(self, wtq_path: str) -> tuple[list, list]:
         """Filling the local sqlite3 database with WTQ tables and the QA Table to answer the questions
 
@@ -33,16 +162,6 @@ class Database:
         Returns:
             tuple[list, list]: _description_
         """  
-        def collect_tables(directory: str) -> list[str]:
-            # Walk through the directory and all subdirectories
-            csv_files = []            
-            for root, _, files in os.walk(directory):
-                for file in files:
-                    if file.endswith(".tsv"):
-                        csv_files.append(os.path.join(root, file))
-            
-            return csv_files
-        
         def upload_tables_to_database(tables: list[str]):
             for table in tables:
                 try:
@@ -51,26 +170,110 @@ class Database:
                     df = pd.read_csv(table.replace(".tsv",".csv"))
                 finally:
                     df_name = ("csv/" + table.split("/")[-2] + "/" + table.split("/")[-1]).replace(".tsv", ".csv")
-                    self.fill_database(df, df_name)
+                    self.fill_context_table(df, df_name)
 
         def upload_questiontables_to_database(directory: str):
             df = pd.read_csv(directory, delimiter="\t")
-            return self.fill_database(df, self.qa_table_name)            
+            df['normalizedValue'] = df['targetValue'].map(self.normalize_target_value)
+            self.fill_database(df, self.qa_table_name)
+            self.upgrade_qa_table()
+            return self.qa_table_name
 
-        csv_files = collect_tables(f'{wtq_path}/csv')
+        csv_files = self.collect_tsv_files(f'{wtq_path}/csv')
         upload_tables_to_database(tables=csv_files)
         upload_questiontables_to_database(f'{wtq_path}/data/training.tsv')
 
-    def extract_parquet(self, row: pd.Series) -> tuple[pd.DataFrame, str, str]:
+    def bulk_wtq_collector(self, wtq_path: str, workers: int | None = None, tables_per_transaction: int = 1000, page_size: int = 8192) -> float:
+        """Filling the local sqlite3 database with WTQ tables and the QA Table like wtq_collector, but the TSV files are parsed in a process pool and written through one connection in chunked transactions.
+
+        Args:
+            wtq_path (str): The path to the WikiTableQuestions folder.
+            workers (int | None, optional): The number of parser processes, None uses every CPU core. Defaults to None.
+            tables_per_transaction (int, optional): The number of tables written in one transaction. Defaults to 1000.
+            page_size (int, optional): The SQLite page size, it is only applied to a new database file. Defaults to 8192.
+
+        Returns:
+            float: The written rows per second.
+        """
+        tables = self.collect_tsv_files(f'{wtq_path}/csv')
+        start_time = time.time()
+        row_count = 0
+        connection = self.connect()
+        try:
+            connection.execute(f"PRAGMA page_size={int(page_size)}")
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=OFF")  # a failed ingest is simply run again
+            connection.execute("PRAGMA temp_store=MEMORY")
+            connection.execute("PRAGMA cache_size=-262144")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                parsed_tables = executor.map(read_wtq_table, tables, chunksize=64)
+                while chunk := list(islice(parsed_tables, tables_per_transaction)):
+                    with self.transaction() as cursor:
+                        for table_name, table in chunk:
+                            row_count += self.write_context_table(cursor, table_name, table)
+            qa_table = pd.read_csv(f'{wtq_path}/data/training.tsv', delimiter="\t")
+            qa_table['normalizedValue'] = qa_table['targetValue'].map(self.normalize_target_value)
+            with self.transaction() as cursor:
+                row_count += self.write_table(cursor, self.qa_table_name, qa_table)
+                self.upgrade_qa_schema(cursor)
+        finally:
+            connection.execute("PRAGMA synchronous=FULL")  # the connection is kept for the other writes
+            connection.execute("PRAGMA cache_size=-2000")
+        rows_per_second = row_count / (time.time() - start_time)
+        print(f"{len(tables)} tables and {row_count} rows written, {rows_per_second:.0f} rows/s.")
+        return rows_per_second
+
+    @staticmethod
+    def collect_tsv_files(directory: str) -> list[str]:
+        """Walk through the directory and all subdirectories and collect the .tsv files.
+
+        Args:
+            directory (str): The directory to walk through.
+
+        Returns:
+            list[str]: The paths of the .tsv files.
+        """
+        csv_files = []
+        for root, _, files in os.walk(directory):
+            for file in files:
+                if file.endswith(".tsv"):
+                    csv_files.append(os.path.join(root, file))
+        return csv_files
+
+    @staticmethod
+    def write_table(cursor: sqlite3.Cursor, table_name: str, table: pd.DataFrame, if_exists: str = 'replace') -> int:
+        """Writes a table through the cursor without committing, so several tables can be written in one transaction. Column types follow pandas.to_sql.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor of the open connection.
+            table_name (str): The table name.
+            table (pd.DataFrame): The table to write.
+            if_exists (str, optional): 'replace' drops the existing table, 'append' inserts into it. Defaults to 'replace'.
+
+        Returns:
+            int: The number of written rows.
+        """
+        table = table.rename(columns={'%': 'Percentage', '': 'Empty'})
+        quoted_name = quote_identifier(table_name)
+        columns = [quote_identifier(column) for column in table.columns]
+        if if_exists == 'replace':
+            cursor.execute(f"DROP TABLE IF EXISTS {quoted_name}")
+        column_definitions = ", ".join(f"{column} {sqlite_type(dtype)}" for column, dtype in zip(columns, table.dtypes))
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {quoted_name} ({column_definitions})")
+        rows = table.astype(object).where(table.notna(), None).itertuples(index=False, name=None)
+        cursor.executemany(f"INSERT INTO {quoted_name} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})", rows)
+        return len(table)
+
+    def extract_parquet(self, row: pd.Series | dict) -> tuple[pd.DataFrame, str, str]:
         """Extract Parquet Data
 
         Args:
-            row (pd.Series): For a row of the parquet data extract the table, the question and the answer. 
+            row (pd.Series | dict): For a row of the parquet data extract the table, the question and the answer. 
 
         Returns:
             tuple[pd.DataFrame, str, str]: Returns the Table, Question, Answer data respectively.
         """
-        row_list = row['table']['rows'].tolist()
+        row_list = list(row['table']['rows'])
         table = pd.DataFrame(row_list, columns=row['table']['header'])        
         return table, row['question'], " ".join(row['answers']) 
 
@@ -82,23 +285,20 @@ class Database:
             table_name (str): The table name.
 
         Raises:
-            pd.errors.DatabaseError: Returns the databaseError for possible problems.
+            sqlite3.Error: Returns the database error for possible problems.
         """
-        conn = sqlite3.connect(self.path)
         try:
             table.rename(columns={'%': 'Percentage'}, inplace=True)
             table.rename(columns={'': 'Empty'}, inplace=True)
-            table.to_sql(table_name, conn, if_exists=if_exists, index=False)
-            conn.commit()
-        except pd.errors.DatabaseError as error:
+            with self.transaction() as cursor:
+                self.write_table(cursor, table_name, table, if_exists=if_exists)
+        except sqlite3.Error as error:
             print(table_name)
             raise error
-        finally:
-            conn.close()
         return table_name
 
     def check_sql_answer(self, llm_answer: str, true_answer: str) -> bool:
-        """Checks SQL answers from the database.
+        """Checks SQL answers from the database. The answer runs on the read-only connection, so it can not change the database. An in-memory or missing database has no read-only connection, every answer is wrong then.
 
         Args:
             llm_answer (str): The model answer.
@@ -107,15 +307,17 @@ class Database:
         Returns:
             bool: Are they equal?
         """
-        connection = sqlite3.connect(self.path)
         try:
-            cursor = connection.cursor()
-            result = cursor.execute(llm_answer)
+            connection = self.connect_read_only()
+        except sqlite3.Error:
+            return False
+        try:
+            return connection.execute(llm_answer).fetchone() == true_answer
         except Exception as e:
-            connection.close()
             return False
-        connection.close()
-        return result.fetchone() == true_answer
+        finally:
+            if connection.in_transaction:  # a BEGIN in the answer must not hold the read lock
+                connection.rollback()
 
     def parquet_table_to_csv(self):
         """Tries to fill the database"""
@@ -135,26 +337,21 @@ class Database:
         Returns:
             pd.DataFrame: The full QA table.
         """
-        connection = sqlite3.connect(self.path)
-        try:
-            cursor = connection.cursor()
-            query = f"SELECT * FROM {self.qa_table_name}"
-            cursor.execute(query)
-            column_names = [description[0] for description in cursor.description]
-            data_table = cursor.fetchall()
-            return pd.DataFrame(data_table, columns=column_names)
-        finally:
-            connection.close()
+        cursor = self.connect().execute(f"SELECT * FROM {quote_identifier(self.qa_table_name)}")
+        column_names = [description[0] for description in cursor.description]
+        data_table = cursor.fetchall()
+        return pd.DataFrame(data_table, columns=column_names).drop(columns='num', errors='ignore')  # the key is derived from the id
 
     def set_qa_table(self, df: pd.DataFrame):
-        try:
-            conn = sqlite3.connect(self.path)
-            df.to_sql(self.qa_table_name, conn, if_exists='replace', index=False)
-            print(f"Successfully saved QA_Table at {self.path}")
-        except Exception as e:
-            raise e
-        finally:
-            conn.close()
+        """Replaces the QA table in one transaction.
+
+        Args:
+            df (pd.DataFrame): The full QA table.
+        """
+        with self.transaction() as cursor:
+            self.write_table(cursor, self.qa_table_name, df.drop(columns='num', errors='ignore'))
+            self.upgrade_qa_schema(cursor)
+        print(f"Successfully saved QA_Table at {self.path}")
 
     def get_question_with_table(self, id: str) -> tuple[pd.DataFrame, str, list[str]]:
         """ From the id, get the table, the question and the answer as return values.
@@ -168,30 +365,264 @@ class Database:
         Returns:
             tuple[pd.DataFrame, str, list[str]]: The table, the question and the answers.
         """
-        connection = sqlite3.connect(self.path)
-        try:
-            cursor = connection.cursor()
-            query = f"SELECT utterance, context, targetValue FROM {self.qa_table_name} where id = 'nt-{id}'"
-            cursor.execute(query)
-            question, data_path, answers = cursor.fetchone()
-            cursor = connection.cursor()
-            query = f"SELECT * FROM `{data_path}`"
-            cursor.execute(query)
-            column_names = [description[0] for description in cursor.description]
-            data_table = cursor.fetchall()
-            df = pd.DataFrame(data_table, columns=column_names)
-        except Exception as e:
-            raise e
-        finally:
-            connection.close()
-        truth = answers.split(',')
+        connection = self.connect()
+        query = f"SELECT utterance, context, targetValue FROM {quote_identifier(self.qa_table_name)} WHERE id = ?"
+        question, data_path, answers = connection.execute(query, (f'nt-{id}',)).fetchone()
+        df = self.read_context_table(connection, data_path)
+        return df, question, self.split_answers(answers)
+
+    def upgrade_qa_schema(self, cursor: sqlite3.Cursor) -> bool:
+        """Upgrades the QA table in place, without committing: the integer primary key num is the N of the nt-N question id, and the id and context columns are indexed. A QA table written before the key existed is rebuilt once, then only the indexes are checked.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor of the open connection.
+
+        Returns:
+            bool: Was the QA table rebuilt?
+        """
+        qa_table_name = quote_identifier(self.qa_table_name)
+        cursor.execute(f"PRAGMA table_info({qa_table_name})")
+        columns = [(name, column_type, primary_key) for _, name, column_type, _, _, primary_key in cursor.fetchall()]
+        if not columns:
+            return False
+        rebuilt = ('num', 'INTEGER', 1) not in columns
+        if rebuilt:
+            kept = [(quote_identifier(name), column_type) for name, column_type, _ in columns if name != 'num']
+            names = ", ".join(name for name, _ in kept)
+            column_definitions = ", ".join(f"{name} {column_type}" for name, column_type in kept)
+            new_name = quote_identifier(f"{self.qa_table_name}_upgrade")
+            cursor.execute(f"DROP TABLE IF EXISTS {new_name}")
+            cursor.execute(f"CREATE TABLE {new_name} (num INTEGER PRIMARY KEY, {column_definitions})")
+            # the N of nt-N, other ids get the next free key
+            number = "CASE WHEN id GLOB 'nt-[0-9]*' AND NOT substr(id, 4) GLOB '*[^0-9]*' THEN CAST(substr(id, 4) AS INTEGER) END"
+            cursor.execute(f"INSERT INTO {new_name} (num, {names}) SELECT {number}, {names} FROM {qa_table_name} ORDER BY rowid")
+            cursor.execute(f"DROP TABLE {qa_table_name}")
+            cursor.execute(f"ALTER TABLE {new_name} RENAME TO {qa_table_name}")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(self.qa_table_name + '_id')} ON {qa_table_name} (id)")
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {quote_identifier(self.qa_table_name + '_context')} ON {qa_table_name} (context)")
+        return rebuilt
+
+    def upgrade_qa_table(self) -> bool:
+        """Upgrades the QA table of the database file in place, see upgrade_qa_schema.
+
+        Returns:
+            bool: Was the QA table rebuilt?
+        """
+        with self.transaction() as cursor:
+            return self.upgrade_qa_schema(cursor)
+
+    def next_question_number(self, cursor: sqlite3.Cursor) -> int:
+        """Allocates the N of the next nt-N question id from the primary key, without scanning the QA table. The QA table is upgraded first if needed.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor of the open connection.
+
+        Returns:
+            int: One more than the largest question number, 0 for a new QA table.
+        """
+        self.upgrade_qa_schema(cursor)
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.qa_table_name,))
+        if cursor.fetchone() is None:
+            return 0
+        cursor.execute(f"SELECT COALESCE(MAX(num) + 1, 0) FROM {quote_identifier(self.qa_table_name)}")
+        return cursor.fetchone()[0]
+
+    def read_context_table(self, connection: sqlite3.Connection, table_name: str) -> pd.DataFrame:
+        """Reads a context table through an already open connection.
+
+        Args:
+            connection (sqlite3.Connection): The open connection to the database.
+            table_name (str): The name of the context table.
+
+        Returns:
+            pd.DataFrame: The context table.
+        """
+        cursor = connection.cursor()
+        if self.detect_storage(cursor) == Storage.CONSOLIDATED:
+            cursor.execute(f"SELECT content FROM {quote_identifier(self.context_table_name)} WHERE table_id = ?", (table_name,))
+            row = cursor.fetchone()
+            if row is None:
+                raise KeyError(f"Context table {table_name} is not in {self.context_table_name}")
+            content = json.loads(row[0])
+            return pd.DataFrame(content['data'], columns=content['columns'])
+        query = f"SELECT * FROM {quote_identifier(table_name)}"
+        cursor.execute(query)
+        column_names = [description[0] for description in cursor.description]
+        data_table = cursor.fetchall()
+        return pd.DataFrame(data_table, columns=column_names)
+
+    def detect_storage(self, cursor: sqlite3.Cursor) -> Storage:
+        """Returns the storage of the context tables, detected from the database if it was not given.
+
+        Args:
+            cursor (sqlite3.Cursor): A cursor of the open connection.
+
+        Returns:
+            Storage: The storage of the context tables.
+        """
+        if self.storage is None:
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.context_table_name,))
+            self.storage = Storage.CONSOLIDATED if cursor.fetchone() is not None else Storage.TABLES
+        return self.storage
+
+    def write_context_table(self, cursor: sqlite3.Cursor, table_name: str, table: pd.DataFrame) -> int:
+        """Writes a context table through the cursor without committing, in the storage of the database.
+
+        Args:
+            cursor (sqlite3.Cursor): The cursor of the open connection.
+            table_name (str): The name of the context table.
+            table (pd.DataFrame): The context table.
+
+        Returns:
+            int: The number of written rows.
+        """
+        if self.detect_storage(cursor) != Storage.CONSOLIDATED:
+            return self.write_table(cursor, table_name, table)
+        table = table.rename(columns={'%': 'Percentage', '': 'Empty'})
+        content = {
+            'columns': [str(column) for column in table.columns],
+            'data': table.astype(object).where(table.notna(), None).values.tolist(),
+        }
+        context_table_name = quote_identifier(self.context_table_name)
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {context_table_name} (table_id TEXT PRIMARY KEY, content TEXT NOT NULL)")
+        cursor.execute(f"INSERT OR REPLACE INTO {context_table_name} (table_id, content) VALUES (?, ?)", (table_name, json.dumps(content, ensure_ascii=False, default=str)))
+        return len(table)
+
+    def fill_context_table(self, table: pd.DataFrame, table_name: str) -> str:
+        """Stores a context table in the storage of the database, replacing the previous table with the same name.
+
+        Args:
+            table (pd.DataFrame): The context table.
+            table_name (str): The name of the context table.
+
+        Returns:
+            str: The name of the context table.
+        """
+        with self.transaction() as cursor:
+            if self.detect_storage(cursor) != Storage.CONSOLIDATED:
+                return self.fill_database(table, table_name, if_exists='replace')
+            self.write_context_table(cursor, table_name, table)
+        return table_name
+
+    def consolidate_tables(self) -> int:
+        """Moves the context tables of the QA table from separate SQLite tables into the shared table of the consolidated storage, in one transaction.
+
+        Returns:
+            int: The number of moved context tables.
+        """
+        with self.transaction() as cursor:
+            cursor.execute(f"SELECT DISTINCT context FROM {quote_identifier(self.qa_table_name)}")
+            contexts = [row[0] for row in cursor.fetchall()]
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+            existing = {row[0] for row in cursor.fetchall()}
+            self.storage = Storage.TABLES
+            tables = {context: self.read_context_table(cursor.connection, context) for context in contexts if context in existing}
+            self.storage = Storage.CONSOLIDATED
+            for context, table in tables.items():
+                self.write_context_table(cursor, context, table)
+                cursor.execute(f"DROP TABLE {quote_identifier(context)}")
+        return len(tables)
+
+    def read_qa_rows(self, connection: sqlite3.Connection) -> dict[str, tuple[str, str, str]]:
+        """Reads the whole QA table at once through an already open connection.
+
+        Args:
+            connection (sqlite3.Connection): The open connection to the database.
+
+        Returns:
+            dict[str, tuple[str, str, str]]: The question, the context table name and the target value for each question id.
+        """
+        cursor = connection.cursor()
+        cursor.execute(f"SELECT id, utterance, context, targetValue FROM {quote_identifier(self.qa_table_name)}")
+        return {id: (question, context, answers) for id, question, context, answers in cursor.fetchall()}
+
+    def read_normalized_answers(self, connection: sqlite3.Connection) -> dict[str, tuple[frozenset[tuple[str, ...]], int]]:
+        """Reads the normalized answers of every question, ready to be compared with utilities.score_normalized.
+
+        Args:
+            connection (sqlite3.Connection): The open connection to the database.
+
+        Returns:
+            dict[str, tuple[frozenset[tuple[str, ...]], int]]: The set of the token tuples of the answers and the number of answers for each question id.
+        """
+        return {id: self.parse_normalized_value(normalized_value) for id, normalized_value in self.read_normalized_values(connection).items()}
+
+    def read_normalized_values(self, connection: sqlite3.Connection) -> dict[str, str]:
+        """Reads the normalizedValue column of the QA table. Databases without the column are normalized on the fly.
+
+        Args:
+            connection (sqlite3.Connection): The open connection to the database.
+
+        Returns:
+            dict[str, str]: The token lists of the answers as a JSON string for each question id.
+        """
+        cursor = connection.cursor()
+        qa_table_name = quote_identifier(self.qa_table_name)
+        cursor.execute(f"PRAGMA table_info({qa_table_name})")
+        if 'normalizedValue' not in [column[1] for column in cursor.fetchall()]:
+            cursor.execute(f"SELECT id, targetValue FROM {qa_table_name}")
+            return {id: self.normalize_target_value(target_value) for id, target_value in cursor.fetchall()}
+        cursor.execute(f"SELECT id, normalizedValue FROM {qa_table_name}")
+        return dict(cursor.fetchall())
+
+    @staticmethod
+    def parse_normalized_value(normalized_value: str) -> tuple[frozenset[tuple[str, ...]], int]:
+        """Parses a normalizedValue of the QA table.
+
+        Args:
+            normalized_value (str): The token lists of the answers as a JSON string.
+
+        Returns:
+            tuple[frozenset[tuple[str, ...]], int]: The set of the token tuples of the answers and the number of answers.
+        """
+        chunks = json.loads(normalized_value)
+        return frozenset(tuple(chunk) for chunk in chunks), len(chunks)
+
+    @staticmethod
+    def normalize_target_value(target_value: str) -> str:
+        """Splits and normalizes the target value at ingest time, so the evaluation doesn't clean the same strings again.
+
+        Args:
+            target_value (str): The target value, answers are separated by ',' or '|'.
+
+        Returns:
+            str: The token lists of the answers as a JSON string.
+        """
+        return json.dumps([list(normalize_chunk(answer)) for answer in Database.split_answers(str(target_value))], ensure_ascii=False)
+
+    def add_normalized_answers(self, refresh: bool = False):
+        """Adds the normalizedValue column to a QA table created before it existed.
+
+        Args:
+            refresh (bool, optional): Normalize every answer again even if the column already exists. Defaults to False.
+        """
+        qa_table_name = quote_identifier(self.qa_table_name)
+        with self.transaction() as cursor:
+            cursor.execute(f"PRAGMA table_info({qa_table_name})")
+            columns = [column[1] for column in cursor.fetchall()]
+            if not columns:  # there is no QA table yet
+                return
+            if 'normalizedValue' not in columns:
+                cursor.execute(f"ALTER TABLE {qa_table_name} ADD COLUMN normalizedValue TEXT")
+            elif not refresh:
+                return
+            cursor.execute(f"SELECT rowid, targetValue FROM {qa_table_name}")
+            cursor.executemany(f"UPDATE {qa_table_name} SET normalizedValue = ? WHERE rowid = ?", [(self.normalize_target_value(target_value), rowid) for rowid, target_value in cursor.fetchall()])
+
+    @staticmethod
+    def split_answers(target_value: str) -> list[str]:
+        """Splits the target value of a question into separate answers.
+
+        Args:
+            target_value (str): The target value, answers are separated by ',' or '|'.
+
+        Returns:
+            list[str]: The answers.
+        """
         answers = []     # '|' needs to be handled as separate answers
-        for truth_chunk in truth:
-            chunks = truth_chunk.split("|")
-            answers += chunks
-        
-        
-        return df, question, answers
+        for truth_chunk in target_value.split(','):
+            answers += truth_chunk.split("|")
+        return answers
     
     def get_database_info(self, ) -> int:
         """Returns the question count from the database.
@@ -199,15 +630,13 @@ class Database:
         Returns:
             int: the question count.
         """
-        connection = sqlite3.connect(self.path)
+        connection = self.connect()
         try:
-            cursor = connection.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{self.qa_table_name}';")
+            cursor = connection.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (self.qa_table_name,))
             table_exists = cursor.fetchone() is not None
             if table_exists:
-                query = f"SELECT COUNT(*) FROM {self.qa_table_name}"
-                cursor.execute(query)
-                record_count = int(cursor.fetchone()[0])
+                query = f"SELECT COUNT(*) FROM {quote_identifier(self.qa_table_name)}"
+                record_count = int(connection.execute(query).fetchone()[0])
             else:
                 record_count = 0                
             return record_count
@@ -217,8 +646,6 @@ class Database:
         except Exception as e:
             print(e)
             raise e
-        finally:
-            connection.close()
     
     def generate_questions_table(self, table_name: str, table: pd.DataFrame, qa_pairs: list[tuple[str, list[str], str, str]], if_exists='replace') -> None:
         """Fills the database with the table name and it's table, with question and aswer pairs belonging to this table 
@@ -229,47 +656,192 @@ class Database:
             qa_pairs (list[tuple[str, str]]): the list of question/answer pairs
         """
         qa = {
+            'num': [],
             'id': [],
             'utterance': [],
             'context': [],
             'targetValue': [],
             'valid': [],
             'original': [],
+            'normalizedValue': [],
         }
         
-        if if_exists == 'replace':
-            self.empty_database()
-        
-        question_count = self.get_database_info()
-        for index, qa_pair in enumerate(qa_pairs):
-            qa['id'].append(f'nt-{question_count + index}')
-            qa['utterance'].append(qa_pair[0])
-            qa['context'].append(table_name)
-            qa['targetValue'].append(qa_pair[1])
-            qa['valid'].append(qa_pair[2])
-            qa['original'].append(qa_pair[3])
-        qa_table = pd.DataFrame(qa)
-                
-        self.fill_database(table, table_name=table_name, if_exists='replace')
-        self.fill_database(qa_table, table_name=self.qa_table_name, if_exists=if_exists)
+        with self.transaction() as cursor:
+            if if_exists == 'replace':
+                self.empty_database()
+
+            question_number = self.next_question_number(cursor)
+            if question_number > 0:
+                self.add_normalized_answers()
+            for index, qa_pair in enumerate(qa_pairs):
+                qa['num'].append(question_number + index)
+                qa['id'].append(f'nt-{question_number + index}')
+                qa['utterance'].append(qa_pair[0])
+                qa['context'].append(table_name)
+                qa['targetValue'].append(qa_pair[1])
+                qa['valid'].append(qa_pair[2])
+                qa['original'].append(qa_pair[3])
+                qa['normalizedValue'].append(self.normalize_target_value(qa_pair[1]))
+            qa_table = pd.DataFrame(qa)
+
+            self.fill_context_table(table, table_name=table_name)
+            self.fill_database(qa_table, table_name=self.qa_table_name, if_exists=if_exists)
+            self.upgrade_qa_schema(cursor)
+
+    def export_arrow(self, directory: str, table_formats: list[TableFormat] | None = None, parquet: bool = False) -> None:
+        """Exports the QA table and its context tables to Arrow IPC files, which loader.ArrowQuestionLoader memory-maps for the evaluation. The context tables are stored already serialized, one column for each table format, so evaluation processes on the same node share the page-cached text with no deserialization.
 
-    def empty_database(self):
-        conn = sqlite3.connect(self.path)
-        cursor = conn.cursor()
+        Args:
+            directory (str): The folder of qa_table.arrow and context_tables.arrow.
+            table_formats (list[TableFormat] | None, optional): The serialization formats of the context tables, None exports CSV. Defaults to None.
+            parquet (bool, optional): Also write the same tables as compressed Parquet files for other tools. Defaults to False.
+        """
+        if table_formats is None:
+            table_formats = [TableFormat.CSV]
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        connection = self.connect()
+        qa_rows = self.read_qa_rows(connection)
+        normalized_values = self.read_normalized_values(connection)
+        contexts = sorted({context for _, context, _ in qa_rows.values()})
+        serialized = {table_format: [] for table_format in table_formats}
+        for context in contexts:
+            table = self.read_context_table(connection, context)
+            for table_format in table_formats:
+                serialized[table_format].append(serialize_table(table, table_format))
+        ids = list(qa_rows)
+        qa_table = pa.table({
+            'id': pa.array(ids, pa.string()),
+            'utterance': pa.array([qa_rows[id][0] for id in ids], pa.string()),
+            'context': pa.array([qa_rows[id][1] for id in ids], pa.string()),
+            'targetValue': pa.array([str(qa_rows[id][2]) for id in ids], pa.string()),
+            'normalizedValue': pa.array([normalized_values[id] for id in ids], pa.string()),
+        })
+        context_tables = pa.table({
+            'table_id': pa.array(contexts, pa.string()),
+            **{table_format.name: pa.array(texts, pa.large_string()) for table_format, texts in serialized.items()},
+        })
+        for name, table in [('qa_table', qa_table), ('context_tables', context_tables)]:
+            with pa.OSFile(os.path.join(directory, f'{name}.arrow'), 'wb') as sink:
+                with pa.ipc.new_file(sink, table.schema) as writer:
+                    writer.write_table(table)
+            if parquet:
+                pq.write_table(table, os.path.join(directory, f'{name}.parquet'))
 
-        # Fetch all table names
-        cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
-        tables = cursor.fetchall()
+    def empty_database(self):
+        with self.transaction() as cursor:
+            # Fetch all table names
+            cursor.execute("SELECT name FROM sqlite_master WHERE type='table';")
+            tables = cursor.fetchall()
 
-        # Drop each table
-        for table in tables:
-            cursor.execute(f'DROP TABLE "{table[0]}";')
-            print(f'Table {table[0]} dropped.')
+            # Drop each table
+            for table in tables:
+                cursor.execute(f"DROP TABLE {quote_identifier(table[0])};")
+                print(f'Table {table[0]} dropped.')
 
-        conn.commit()
-        conn.close()
         print('All tables dropped. Database is now empty.')
         
+class QuestionWriter:
+    def __init__(self, database: Database) -> None:
+        """Buffers the generated questions of a page like Database.generate_questions_table does for one question. On flush every buffered context table is written once, and the QA rows are appended in one transaction. The question ids come from an in-memory counter, read from the database only before the first flush, so one writer must be shared by everything writing questions into the database.
+
+        Args:
+            database (Database): The database to write the questions into.
+        """
+        self.database = database
+        self.next_id: int | None = None
+        self.tables: dict[str, pd.DataFrame] = {}
+        self.qa_pairs: list[tuple[str, tuple[str, str, bool, str]]] = []
+
+    def add(self, table_name: str, table: pd.DataFrame, qa_pair: tuple[str, str, bool, str]):
+        """Buffers a question of a context table, the last buffered version of a table is written.
+
+        Args:
+            table_name (str): The name of the context table.
+            table (pd.DataFrame): The context table.
+            qa_pair (tuple[str, str, bool, str]): The question, the answer, whether the question is valid and the original statement.
+        """
+        self.tables[table_name] = table
+        self.qa_pairs.append((table_name, qa_pair))
+
+    def __len__(self) -> int:
+        return len(self.qa_pairs)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exception_type, *_):
+        if exception_type is None:
+            self.flush()
+
+    def flush(self) -> int:
+        """Writes the buffered context tables and QA rows in one transaction. If it fails nothing is written and the buffer is dropped.
+
+        Returns:
+            int: The number of written QA rows.
+        """
+        if not self.qa_pairs:
+            return 0
+        if self.next_id is None:
+            self.database.add_normalized_answers()
+        try:
+            with self.database.transaction() as cursor:
+                if self.next_id is None:
+                    self.next_id = self.database.next_question_number(cursor)
+                qa_table = self.qa_table()
+                for table_name, table in self.tables.items():
+                    self.database.write_context_table(cursor, table_name, table)
+                self.database.write_table(cursor, self.database.qa_table_name, qa_table, if_exists='append')
+                self.database.upgrade_qa_schema(cursor)  # a new QA table gets the primary key
+            self.next_id += len(qa_table)
+        finally:
+            self.tables.clear()  # a failed page is dropped, not written again with the next one
+            self.qa_pairs.clear()
+        return len(qa_table)
+
+    def qa_table(self) -> pd.DataFrame:
+        """Returns the QA rows of the buffered questions, numbered from next_id."""
+        return pd.DataFrame({
+            'num': range(self.next_id, self.next_id + len(self.qa_pairs)),
+            'id': [f'nt-{self.next_id + index}' for index in range(len(self.qa_pairs))],
+            'utterance': [qa_pair[0] for _, qa_pair in self.qa_pairs],
+            'context': [table_name for table_name, _ in self.qa_pairs],
+            'targetValue': [qa_pair[1] for _, qa_pair in self.qa_pairs],
+            'valid': [qa_pair[2] for _, qa_pair in self.qa_pairs],
+            'original': [qa_pair[3] for _, qa_pair in self.qa_pairs],
+            'normalizedValue': [self.database.normalize_target_value(qa_pair[1]) for _, qa_pair in self.qa_pairs],
+        })
+
+def quote_identifier(name) -> str:
+    """Quotes a table or column name for SQLite, so names with spaces, quotes or keywords (context tables are named after Wikipedia sections) are safe in the statements."""
+    return '"' + str(name).replace('"', '""') + '"'
+
+def sqlite_type(dtype) -> str:
+    """The SQLite column type of a pandas dtype, the same as pandas.to_sql uses."""
+    if pd.api.types.is_bool_dtype(dtype) or pd.api.types.is_integer_dtype(dtype):
+        return "INTEGER"
+    if pd.api.types.is_float_dtype(dtype):
+        return "REAL"
+    if pd.api.types.is_datetime64_any_dtype(dtype):
+        return "TIMESTAMP"
+    return "TEXT"
+
+def read_wtq_table(table: str) -> tuple[str, pd.DataFrame]:
+    """Parses a WTQ table in a worker process of Database.bulk_wtq_collector, falling back to the .csv version of the file.
+
+    Args:
+        table (str): The path to the .tsv file.
+
+    Returns:
+        tuple[str, pd.DataFrame]: The table name in the database and the table.
+    """
+    try:
+        df = pd.read_csv(table, delimiter="\t")
+    except Exception:
+        df = pd.read_csv(table.replace(".tsv", ".csv"))
+    df_name = ("csv/" + table.split("/")[-2] + "/" + table.split("/")[-1]).replace(".tsv", ".csv")
+    return df_name, df
+
 if __name__ == "__main__":
     test_database_path = "data/test_database.db"
     wtq_path = '/home/gabortoth/Dokumentumok/Data/WikiTableQuestions'
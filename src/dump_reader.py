@@ -0,0 +1,347 @@
+import bz2
+import html
+import multiprocessing
+import os
+import queue
+import re
+import threading
+from multiprocessing.connection import Connection, wait
+from typing import Iterator
+import mwxml
+from database import Database, QuestionWriter
+from mylogger import MyLogger
+from WikipediaYoinker import Section, WikiYoinker, skip_sections
+
+_END = None
+
+comment_pattern = re.compile(r'<!--.*?-->', re.DOTALL)
+reference_pattern = re.compile(r'<ref[^>/]*/>|<ref[^>]*>.*?</ref>', re.DOTALL | re.IGNORECASE)
+template_pattern = re.compile(r'\{\{[^{}]*\}\}')
+link_pattern = re.compile(r'\[\[([^\[\]|]*)(?:\|([^\[\]]*))?\]\]')
+external_link_pattern = re.compile(r'\[(?:https?:)?//[^\s\]]+\s*([^\]]*)\]')
+emphasis_pattern = re.compile(r"'{2,5}")
+heading_pattern = re.compile(r'^(={2,6})\s*(.*?)\s*\1\s*$')
+span_pattern = re.compile(r'\b(colspan|rowspan)\s*=\s*"?(\d+)"?', re.IGNORECASE)
+skipped_link_namespaces = ('fájl:', 'kép:', 'file:', 'image:', 'kategória:', 'category:', 'media:')
+
+def clean_wikitext(wikitext: str) -> str:
+    """Removes the comments, references, templates and link markup of wikitext, keeping the displayed text.
+
+    Args:
+        wikitext (str): The wikitext of a page.
+
+    Returns:
+        str: The wikitext without inline markup, tables and headings are kept.
+    """
+    text = comment_pattern.sub('', wikitext)
+    text = reference_pattern.sub('', text)
+    previous = None
+    while previous != text:  # nested templates are removed from the inside out
+        previous = text
+        text = template_pattern.sub('', text)
+
+    def replace_link(match: re.Match) -> str:
+        target, label = match.group(1), match.group(2)
+        if target.strip().lower().startswith(skipped_link_namespaces):
+            return ''
+        return label if label is not None else target
+
+    previous = None
+    while previous != text:  # links in file captions are nested
+        previous = text
+        text = link_pattern.sub(replace_link, text)
+    text = external_link_pattern.sub(r'\1', text)
+    text = emphasis_pattern.sub('', text)
+    return text.replace("–", "-")
+
+def render_cell(cell: str, tag: str) -> str:
+    """Renders a wikitext table cell, the attributes before the first '|' are dropped except the spans."""
+    attributes = ''
+    if '|' in cell:
+        attribute_text, cell = cell.split('|', 1)
+        attributes = ''.join(f' {name.lower()}="{value}"' for name, value in span_pattern.findall(attribute_text))
+    return f'<{tag}{attributes}>{html.escape(cell.strip(), quote=False)}</{tag}>'
+
+def render_table(lines: list[str]) -> str:
+    """Renders the lines of a wikitext table ('{|' to '|}') to an HTML table readable by pandas.read_html.
+
+    Args:
+        lines (list[str]): The lines of the table.
+
+    Returns:
+        str: The HTML table.
+    """
+    rows: list[list[str]] = []
+    for line in lines[1:]:
+        line = line.strip()
+        if line.startswith('|}'):
+            break
+        if line.startswith('|+'):
+            continue
+        if line.startswith('|-'):
+            rows.append([])
+            continue
+        if line.startswith('!'):
+            cells = [render_cell(cell, 'th') for cell in re.split(r'!!|\|\|', line[1:])]
+        elif line.startswith('|'):
+            cells = [render_cell(cell, 'td') for cell in line[1:].split('||')]
+        elif rows and rows[-1]:
+            rows[-1][-1] = rows[-1][-1][:-5] + ' ' + html.escape(line, quote=False) + rows[-1][-1][-5:]  # multi-line cell
+            continue
+        else:
+            continue
+        if not rows:
+            rows.append([])
+        rows[-1].extend(cells)
+    body = ''.join(f'<tr>{"".join(row)}</tr>' for row in rows if row)
+    return f'<table class="wikitable">{body}</table>'
+
+def render_section(lines: list[str]) -> str:
+    """Renders the lines of a section to minimal HTML: paragraphs, tables and subsection headings. Lists are skipped like in the HTML pages, where they are not paragraphs.
+
+    Args:
+        lines (list[str]): The cleaned wikitext lines after the h2 heading.
+
+    Returns:
+        str: The HTML of the section.
+    """
+    parts: list[str] = []
+    paragraph: list[str] = []
+    table: list[str] | None = None
+    depth = 0
+
+    def close_paragraph():
+        if paragraph:
+            parts.append(f'<p>{html.escape(" ".join(paragraph), quote=False)}</p>')
+            paragraph.clear()
+
+    for line in lines:
+        stripped = line.strip()
+        if table is not None:
+            table.append(line)
+            if stripped.startswith('{|'):
+                depth += 1
+            elif stripped.startswith('|}'):
+                depth -= 1
+                if depth == 0:
+                    parts.append(render_table(table))
+                    table = None
+            continue
+        if stripped.startswith('{|'):
+            close_paragraph()
+            table, depth = [line], 1
+            continue
+        heading = heading_pattern.match(stripped)
+        if heading:
+            close_paragraph()
+            parts.append(f'<h{len(heading.group(1))}>{html.escape(heading.group(2), quote=False)}</h{len(heading.group(1))}>')
+        elif not stripped or stripped[0] in '*#:;' or stripped.startswith('__'):
+            close_paragraph()
+        else:
+            paragraph.append(stripped)
+    close_paragraph()
+    return '\n'.join(parts)
+
+def page_to_sections(wikitext: str) -> list[Section]:
+    """Splits the wikitext of a page into h2 sections, like WikiYoinker.convert_url_to_section_data does with the HTML of the page.
+
+    Args:
+        wikitext (str): The wikitext of the page.
+
+    Returns:
+        list[Section]: list of sections in the page
+    """
+    section_objs: list[Section] = []
+    section_id: str | None = None
+    section_lines: list[str] = []
+    for line in clean_wikitext(wikitext).split('\n'):
+        heading = heading_pattern.match(line.strip())
+        if heading and len(heading.group(1)) == 2:
+            if section_id is not None and section_id not in skip_sections:
+                section_objs.append(Section(section_name=section_id, raw_section_data=render_section(section_lines)))
+            section_id = heading.group(2).replace(' ', '_')
+            section_lines = []
+        elif section_id is not None:  # the text before the first h2 is skipped
+            section_lines.append(line)
+    if section_id is not None and section_id not in skip_sections:
+        section_objs.append(Section(section_name=section_id, raw_section_data=render_section(section_lines)))
+    return section_objs
+
+def read_pages(dump_path: str, namespaces: tuple[int, ...] = (0,)) -> Iterator[tuple[str, str]]:
+    """Streams the pages of a pages-articles dump, the .bz2 dump is decompressed on the fly.
+
+    Args:
+        dump_path (str): The path to the .xml or .xml.bz2 dump.
+        namespaces (tuple[int, ...], optional): The namespaces of the pages to read, the articles are in 0. Defaults to (0,).
+
+    Yields:
+        tuple[str, str]: The title and the wikitext of the latest revision of each page.
+    """
+    opener = bz2.open if dump_path.endswith('.bz2') else open
+    with opener(dump_path, 'rt', encoding='utf-8') as file:
+        for page in mwxml.Dump.from_file(file):
+            text = None
+            for revision in page:
+                text = revision.text
+            if page.namespace in namespaces and page.redirect is None and text:
+                yield page.title, text
+
+def parse_pages(pages: multiprocessing.Queue, results: Connection):
+    """Worker process of DumpReader, turning the pages into sections until the end sentinel, which it passes on."""
+    while True:
+        item = pages.get()
+        if item is _END:
+            results.send(_END)
+            return
+        title, text = item
+        try:
+            results.send((title, page_to_sections(text)))
+        except Exception as error:
+            results.send((title, error))
+
+class DumpReader:
+    def __init__(self, dump_path: str, workers: int | None = None, queue_size: int = 64, language_code: str = "hu") -> None:
+        """Offline replacement of the page requests of WikiYoinker: streams a Wikipedia XML dump and yields the sections of each page. A reader thread decompresses the dump, and worker processes render and parse the pages. Every worker has its own bounded page queue and result pipe, so a dead worker can not hold the lock of a shared one, and the memory stays flat at full-dump scale.
+
+        Args:
+            dump_path (str): The path to the pages-articles .xml or .xml.bz2 dump.
+            workers (int | None, optional): The number of parser processes, None uses every CPU core. Defaults to None.
+            queue_size (int, optional): The maximum number of pages waiting for the workers. Defaults to 64.
+            language_code (str, optional): The language of the Wikipedia, used for the page URLs. Defaults to "hu".
+        """
+        self.dump_path = dump_path
+        self.workers = workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.language_code = language_code
+        self.errors: list[tuple[str, Exception]] = []
+        self.processes: list[multiprocessing.Process] = []
+
+    def __iter__(self) -> Iterator[tuple[str, list[Section]]]:
+        """Yields (url, sections) tuples in the order the workers finish the pages. A worker that died (killed for memory, crashed in a parser) counts as finished, it is recorded in errors and the pages it was parsing are lost."""
+        context = multiprocessing.get_context("spawn")
+        page_queues = [context.Queue(maxsize=max(1, self.queue_size // self.workers)) for _ in range(self.workers)]
+        receivers: dict[Connection, multiprocessing.Process] = {}
+        self.processes = []
+        for pages in page_queues:
+            receiver, sender = context.Pipe(duplex=False)
+            process = context.Process(target=parse_pages, args=(pages, sender), daemon=True)
+            process.start()
+            sender.close()  # the worker holds the only write end, so the pipe is closed when it dies
+            receivers[receiver] = process
+            self.processes.append(process)
+        stop = threading.Event()
+        reader = threading.Thread(target=self.read, args=(page_queues, stop), daemon=True)
+        reader.start()
+        try:
+            while receivers:
+                for receiver in wait(list(receivers)):
+                    try:
+                        item = receiver.recv()
+                    except Exception:  # the pipe was closed or cut in the middle of a result
+                        process = receivers.pop(receiver)
+                        receiver.close()
+                        if process.is_alive():  # a result it can not finish
+                            process.terminate()
+                        process.join()
+                        self.errors.append((f"parser process {process.pid}", RuntimeError(f"The parser process died with exit code {process.exitcode}.")))
+                        continue
+                    if item is _END:
+                        receivers.pop(receiver).join()
+                        receiver.close()
+                        continue
+                    title, sections = item
+                    if isinstance(sections, Exception):
+                        self.errors.append((title, sections))
+                        continue
+                    yield f"https://{self.language_code}.wikipedia.org/wiki/{title.replace(' ', '_')}", sections
+        finally:
+            stop.set()
+            for process in self.processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+            reader.join()
+            for receiver in receivers:
+                receiver.close()
+
+    def read(self, page_queues: list[multiprocessing.Queue], stop: threading.Event):
+        """Reader thread feeding the pages of the dump to the workers, then an end sentinel to each worker. A failed read is recorded in errors, the pages read before it are still parsed."""
+        try:
+            for page in read_pages(self.dump_path):
+                if not self.distribute(page_queues, page, stop):
+                    return
+        except Exception as error:
+            self.errors.append((self.dump_path, error))
+        finally:
+            for pages, process in zip(page_queues, self.processes):
+                self.put(pages, _END, stop, process)
+
+    def distribute(self, page_queues: list[multiprocessing.Queue], page: tuple[str, str], stop: threading.Event) -> bool:
+        """Puts a page into the queue of the first live worker with room, waiting while every queue is full.
+
+        Returns:
+            bool: False if the iteration was closed or every worker died in the meantime.
+        """
+        while not stop.is_set():
+            alive = [pages for pages, process in zip(page_queues, self.processes) if process.exitcode is None]
+            if not alive:
+                return False
+            for pages in alive:
+                try:
+                    pages.put_nowait(page)
+                    return True
+                except queue.Full:
+                    continue
+            stop.wait(0.01)
+        return False
+
+    @staticmethod
+    def put(buffer: multiprocessing.Queue, item, stop: threading.Event, process: multiprocessing.Process | None = None) -> bool:
+        """Puts an item into the queue unless the iteration was closed or the process reading the queue died.
+
+        Returns:
+            bool: False if the iteration was closed or the process died in the meantime.
+        """
+        while not stop.is_set() and (process is None or process.exitcode is None):
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+def yoink_dump(wikiyoinker: WikiYoinker, database: Database, dump_path: str, workers: int | None = None, page_limit: int | None = None, skip_everything: bool = False) -> int:
+    """Fills the database from a Wikipedia dump instead of the live pages, every section goes through WikiYoinker.process_sections.
+
+    Args:
+        wikiyoinker (WikiYoinker): The question generator.
+        database (Database): The database to fill.
+        dump_path (str): The path to the pages-articles .xml or .xml.bz2 dump.
+        workers (int | None, optional): The number of parser processes, None uses every CPU core. Defaults to None.
+        page_limit (int | None, optional): Stop after this many pages. Defaults to None.
+        skip_everything (bool, optional): Store the statements without generating questions. Defaults to False.
+
+    Returns:
+        int: The number of processed pages.
+    """
+    page_count = 0
+    writer = QuestionWriter(database)
+    reader = DumpReader(dump_path, workers=workers, language_code=wikiyoinker.language_code)
+    for url, sections in reader:
+        try:
+            wikiyoinker.process_sections(sections, wikiyoinker.logger, database, url, skip_everything=skip_everything, writer=writer)
+        except Exception as e:
+            wikiyoinker.logger.warning(e)
+        page_count += 1
+        if page_limit is not None and page_count >= page_limit:
+            break
+    for title, error in reader.errors:
+        wikiyoinker.logger.warning(f"{title}: {error}")
+    return page_count
+
+if __name__ == "__main__":
+    dump_path = "data/huwiki-latest-pages-articles.xml.bz2"
+    database = Database("data/generated_hu.db")
+    logger: MyLogger = MyLogger(log_path='data/wiki.log', result_path='data/wiki.log')
+    wikiyoinker = WikiYoinker(logger=logger, use_openai=False, strict=True)
+    print(f"{yoink_dump(wikiyoinker, database, dump_path, skip_everything=True)} pages processed.")
@@ -0,0 +1,144 @@
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Callable
+
+class GenerationCache:
+    def __init__(self, path: str = "data/generation_cache.db", max_bytes: int = 1024 * 1024 * 1024, read_only: bool = False, create_schema: bool = True, access_flush_interval: int = 256) -> None:
+        """Content-addressed on-disk cache of model generations. A generation is keyed by the model name, the prompt format, the full prompt and the generation parameters, so re-running the evaluation after a scoring change does not generate again.
+
+        Args:
+            path (str, optional): The path to the SQLite file of the cache. Defaults to "data/generation_cache.db".
+            max_bytes (int, optional): The size limit of the cached generations, the least recently used ones are evicted above it. Defaults to 1 GiB.
+            read_only (bool, optional): Only read the cache for deterministic re-scoring, new generations are not stored. Defaults to False.
+            create_schema (bool, optional): Create the cache table and switch to WAL mode, False if another process already did. Defaults to True.
+            access_flush_interval (int, optional): The number of cache hits whose access times are kept in memory before they are written in one transaction, they are also written with put and close. Defaults to 256.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.read_only = read_only
+        self.access_flush_interval = access_flush_interval
+        self.accessed: dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        if read_only:
+            self.connection = sqlite3.connect(f"file:{path}?mode=ro", uri=True, timeout=60, check_same_thread=False)
+        elif not create_schema:
+            self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        else:
+            directory = os.path.dirname(path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS generations (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                answer TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )""")
+            self.connection.execute("CREATE INDEX IF NOT EXISTS generations_last_access ON generations (last_access)")
+            self.connection.commit()
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+
+    @staticmethod
+    def key(model_name: str, prompt_format: str, prompt: str, parameters: dict) -> str:
+        """Returns the content address of a generation.
+
+        Args:
+            model_name (str): The model name.
+            prompt_format (str): The name of the prompt format.
+            prompt (str): The full prompt text.
+            parameters (dict): The generation parameters, they must be JSON serializable.
+
+        Returns:
+            str: The SHA-256 hex digest of the inputs.
+        """
+        content = json.dumps([model_name, prompt_format, prompt, parameters], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> str | None:
+        """Returns the cached generation, or None if it is not cached."""
+        row = self.connection.execute("SELECT answer FROM generations WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if not self.read_only:
+            self.accessed[key] = time.time()
+            if len(self.accessed) >= self.access_flush_interval:
+                self.flush()
+        return row[0]
+
+    def flush_accesses(self):
+        """Writes the access times of the cache hits kept in memory, without committing."""
+        if self.accessed:
+            self.connection.executemany("UPDATE generations SET last_access = ? WHERE key = ?", [(last_access, key) for key, last_access in self.accessed.items()])
+            self.accessed.clear()
+
+    def flush(self):
+        """Writes the access times of the cache hits kept in memory in one transaction. Does nothing in read-only mode."""
+        if not self.read_only:
+            self.flush_accesses()
+            self.connection.commit()
+
+    def put(self, key: str, answer: str, model_name: str | None = None):
+        """Stores a generation and evicts the least recently used ones above the size limit. Does nothing in read-only mode."""
+        if self.read_only:
+            return
+        size = len(answer.encode("utf-8"))
+        self.connection.execute("INSERT OR REPLACE INTO generations (key, model, answer, size, last_access) VALUES (?, ?, ?, ?, ?)", (key, model_name, answer, size, time.time()))
+        self.flush_accesses()  # in the same transaction, so the eviction sees the recent hits
+        self.connection.commit()
+        self.size += size
+        if self.size > self.max_bytes:
+            self.evict()
+
+    def evict(self):
+        """Deletes the least recently used generations until the cache is below 90% of the size limit."""
+        # other processes may write the same cache, so the size is counted again before evicting
+        self.size = self.connection.execute("SELECT COALESCE(SUM(size), 0) FROM generations").fetchone()[0]
+        target = self.max_bytes * 0.9
+        if self.size <= self.max_bytes:
+            return
+        cursor = self.connection.execute("SELECT key, size FROM generations ORDER BY last_access")
+        evicted = []
+        for key, size in cursor:
+            if self.size <= target:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.connection.executemany("DELETE FROM generations WHERE key = ?", evicted)
+        self.connection.commit()
+
+    def generate(self, model_name: str, prompt_format: str, prompts: list[str], parameters: dict, generate: Callable[[list[str]], list[str]]) -> list[str]:
+        """Returns the cached generations and generates only the missing ones, in one call.
+
+        Args:
+            model_name (str): The model name.
+            prompt_format (str): The name of the prompt format.
+            prompts (list[str]): The full prompt texts.
+            parameters (dict): The generation parameters.
+            generate (Callable[[list[str]], list[str]]): Generates the answers of the prompts missing from the cache.
+
+        Returns:
+            list[str]: The answers in the same order as the prompts.
+        """
+        keys = [self.key(model_name, prompt_format, prompt, parameters) for prompt in prompts]
+        answers = [self.get(key) for key in keys]
+        missing = [index for index, answer in enumerate(answers) if answer is None]
+        if missing:
+            for index, answer in zip(missing, generate([prompts[index] for index in missing])):
+                answers[index] = answer
+                self.put(keys[index], answer, model_name)
+        return answers
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.misses} misses, {self.size / 1024 / 1024:.1f} MiB"
+
+    def close(self):
+        self.flush()
+        self.connection.close()
@@ -0,0 +1,262 @@
+import os
+import queue
+import sqlite3
+import sys
+import threading
+from collections import OrderedDict
+import pyarrow as pa
+from database import Database
+from utilities import TableFormat, serialize_table
+
+_END = object()
+
+class TableCache:
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024) -> None:
+        """LRU cache of serialized context tables, keyed by the context table name and the serialization format. Questions sharing a context, and every seed after the first one, reuse the serialized text.
+
+        Args:
+            max_bytes (int, optional): The memory limit of the cached texts, the least recently used tables are evicted above it. Defaults to 256 MiB.
+        """
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.entries: OrderedDict[tuple[str, TableFormat], str] = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, context: str, table_format: TableFormat) -> str | None:
+        """Returns the cached table text, or None if it is not cached."""
+        with self.lock:
+            key = (context, table_format)
+            table_text = self.entries.get(key)
+            if table_text is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return table_text
+
+    def put(self, context: str, table_format: TableFormat, table_text: str):
+        """Stores the table text and evicts the least recently used tables above the memory limit."""
+        size = sys.getsizeof(table_text)
+        if size > self.max_bytes:
+            return
+        with self.lock:
+            key = (context, table_format)
+            if key in self.entries:
+                self.size -= sys.getsizeof(self.entries.pop(key))
+            self.entries[key] = table_text
+            self.size += size
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= sys.getsizeof(evicted)
+
+    def __str__(self) -> str:
+        total = self.hits + self.misses
+        hit_rate = self.hits / total if total else 0.0
+        return f"{self.hits} hits, {self.misses} misses ({hit_rate:.1%} hit rate), {len(self.entries)} tables, {self.size / 1024 / 1024:.1f} MiB"
+
+class QuestionLoader:
+    def __init__(self, database: Database, indices: list[int], prefetch: int = 32, cache: TableCache | None = None, table_format: TableFormat = TableFormat.CSV) -> None:
+        """Streams the questions of the QA table for the evaluation. The QA table is read once through one persistent connection, and a background thread prepares the next questions while the model is generating.
+
+        Args:
+            database (Database): The database to read the questions from.
+            indices (list[int]): The question indices to load, in the order they are yielded.
+            prefetch (int, optional): The maximum number of prepared questions waiting for the model. Defaults to 32.
+            cache (TableCache | None, optional): The cache of serialized tables, shared between loaders to reuse it across seeds and models. Defaults to None.
+            table_format (TableFormat, optional): The serialization format of the tables. Defaults to TableFormat.CSV.
+        """
+        self.database = database
+        self.indices = list(indices)
+        self.prefetch = prefetch
+        self.cache = cache if cache is not None else TableCache()
+        self.table_format = table_format
+        self.connection: sqlite3.Connection | None = None
+        self.qa_rows: dict[str, tuple[str, str, str]] | None = None
+        self.normalized_answers: dict[str, tuple[frozenset[tuple[str, ...]], int]] | None = None
+        self.lock = threading.Lock()
+
+    def __iter__(self):
+        """Yields (prompt_table_text, question, answers) tuples in the order of the indices."""
+        buffer: queue.Queue = queue.Queue(maxsize=self.prefetch)
+        stop = threading.Event()
+        worker = threading.Thread(target=self.produce, args=(buffer, stop), daemon=True)
+        worker.start()
+        try:
+            while True:
+                item = buffer.get()
+                if item is _END:
+                    break
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop.set()
+            worker.join()
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Closes the persistent connection."""
+        with self.lock:
+            if self.connection is not None:
+                self.connection.close()
+                self.connection = None
+
+    def load_qa_rows(self) -> dict[str, tuple[str, str, str]]:
+        """Reads the whole QA table and its normalized answers through the persistent connection on the first call.
+
+        Returns:
+            dict[str, tuple[str, str, str]]: The question, the context table name and the target value for each question id.
+        """
+        with self.lock:
+            if self.connection is None:
+                self.connection = sqlite3.connect(self.database.path, check_same_thread=False)
+            if self.qa_rows is None:
+                self.qa_rows = self.database.read_qa_rows(self.connection)
+                self.normalized_answers = self.database.read_normalized_answers(self.connection)
+        return self.qa_rows
+
+    def normalized_truth(self, index: int) -> tuple[frozenset[tuple[str, ...]], int]:
+        """Returns the normalized answers of a question, read once from the database for every question.
+
+        Args:
+            index (int): The question index.
+
+        Returns:
+            tuple[frozenset[tuple[str, ...]], int]: The set of the token tuples of the answers and the number of answers.
+        """
+        self.load_qa_rows()
+        return self.normalized_answers[f'nt-{index}']
+
+    def sort_by_context(self):
+        """Orders the indices by context table, so consecutive prompts share the instruction and table prefix."""
+        qa_rows = self.load_qa_rows()
+        self.indices.sort(key=lambda index: qa_rows[f'nt-{index}'][1])
+
+    def produce(self, buffer: queue.Queue, stop: threading.Event):
+        """Background thread filling the buffer with prepared questions.
+
+        Args:
+            buffer (queue.Queue): The bounded buffer read by the iterator.
+            stop (threading.Event): Set when the iterator is closed early.
+        """
+        try:
+            qa_rows = self.load_qa_rows()
+            for index in self.indices:
+                question, context, target_value = qa_rows[f'nt-{index}']
+                table_text = self.cache.get(context, self.table_format)
+                if table_text is None:
+                    table_text = serialize_table(self.database.read_context_table(self.connection, context), self.table_format)
+                    self.cache.put(context, self.table_format, table_text)
+                if not self.put(buffer, (table_text, question, Database.split_answers(target_value)), stop):
+                    return
+            self.put(buffer, _END, stop)
+        except Exception as error:
+            self.put(buffer, error, stop)
+
+    @staticmethod
+    def put(buffer: queue.Queue, item, stop: threading.Event) -> bool:
+        """Puts an item into the buffer unless the iterator was closed.
+
+        Returns:
+            bool: False if the iterator was closed in the meantime.
+        """
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+class ArrowQuestionLoader:
+    def __init__(self, directory: str, indices: list[int], table_format: TableFormat = TableFormat.CSV) -> None:
+        """Streams the questions from the Arrow files written by Database.export_arrow. The files are memory-mapped, so evaluation processes on the same node share one page-cached copy of the corpus, and the serialized tables are read without deserialization. Same interface as QuestionLoader.
+
+        Args:
+            directory (str): The folder of qa_table.arrow and context_tables.arrow.
+            indices (list[int]): The question indices to load, in the order they are yielded.
+            table_format (TableFormat, optional): The serialization format of the tables, it must be one of the exported formats. Defaults to TableFormat.CSV.
+        """
+        self.directory = directory
+        self.indices = list(indices)
+        self.table_format = table_format
+        self.sources: list[pa.MemoryMappedFile] = []
+        self.qa_rows: dict[str, tuple[str, str, str]] | None = None
+        self.normalized_values: dict[str, str] | None = None
+        self.table_rows: dict[str, int] | None = None
+        self.tables: pa.ChunkedArray | None = None
+
+    def __iter__(self):
+        """Yields (prompt_table_text, question, answers) tuples in the order of the indices."""
+        qa_rows = self.load_qa_rows()
+        for index in self.indices:
+            question, context, target_value = qa_rows[f'nt-{index}']
+            yield self.tables[self.table_rows[context]].as_py(), question, Database.split_answers(target_value)
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def close(self):
+        """Releases the memory maps."""
+        self.tables = None
+        for source in self.sources:
+            source.close()
+        self.sources = []
+
+    def read_arrow(self, name: str) -> pa.Table:
+        """Memory-maps an Arrow IPC file of the export, the columns point into the mapped pages."""
+        source = pa.memory_map(os.path.join(self.directory, f'{name}.arrow'), 'r')
+        self.sources.append(source)
+        return pa.ipc.open_file(source).read_all()
+
+    def load_qa_rows(self) -> dict[str, tuple[str, str, str]]:
+        """Maps the Arrow files on the first call.
+
+        Returns:
+            dict[str, tuple[str, str, str]]: The question, the context table name and the target value for each question id.
+        """
+        if self.qa_rows is None:
+            qa_table = self.read_arrow('qa_table')
+            columns = [qa_table.column(name).to_pylist() for name in ['id', 'utterance', 'context', 'targetValue', 'normalizedValue']]
+            self.qa_rows = {id: (question, context, target_value) for id, question, context, target_value, _ in zip(*columns)}
+            self.normalized_values = dict(zip(columns[0], columns[4]))
+        if self.tables is None:
+            context_tables = self.read_arrow('context_tables')
+            if self.table_format.name not in context_tables.column_names:
+                raise KeyError(f"The {self.table_format.name} format of the tables was not exported to {self.directory}")
+            self.table_rows = {table_id: row for row, table_id in enumerate(context_tables.column('table_id').to_pylist())}
+            self.tables = context_tables.column(self.table_format.name)
+        return self.qa_rows
+
+    def normalized_truth(self, index: int) -> tuple[frozenset[tuple[str, ...]], int]:
+        """Returns the normalized answers of a question.
+
+        Args:
+            index (int): The question index.
+
+        Returns:
+            tuple[frozenset[tuple[str, ...]], int]: The set of the token tuples of the answers and the number of answers.
+        """
+        self.load_qa_rows()
+        return Database.parse_normalized_value(self.normalized_values[f'nt-{index}'])
+
+    def sort_by_context(self):
+        """Orders the indices by context table, so consecutive prompts share the instruction and table prefix."""
+        qa_rows = self.load_qa_rows()
+        self.indices.sort(key=lambda index: qa_rows[f'nt-{index}'][1])
@@ -1,5 +1,13 @@
+import os
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pandas as pd
+import torch
 from database import Database
+from loader import ArrowQuestionLoader, QuestionLoader, TableCache
+from checkpoint import CheckpointStore
+from generation_cache import GenerationCache
 from models import ModelLlama, Prompt, ModelTransformer, ModelOpenAI
 from tqdm import tqdm
 from mylogger import MyLogger
@@ -7,64 +15,306 @@ from utilities import *
 from report import Report
 
 class Controller:
-    def __init__(self, model_list_path: str, data_path: str) -> None:
+    def __init__(self, model_list_path: str, data_path: str, table_cache_bytes: int = 256 * 1024 * 1024, table_format: TableFormat = TableFormat.CSV, generation_cache_path: str | None = None, generation_cache_read_only: bool = False, arrow_path: str | None = None, migrate: bool = True) -> None:
+        self.model_list_path: str = model_list_path
+        self.data_path: str = data_path
+        self.generation_cache_path: str | None = generation_cache_path
+        self.generation_cache_read_only: bool = generation_cache_read_only
+        self.generation_cache: GenerationCache | None = GenerationCache(generation_cache_path, read_only=generation_cache_read_only, create_schema=migrate) if generation_cache_path else None
         self.database: Database = Database(path=data_path)
+        if migrate:  # the workers of loop_parallel leave the schema to the main process
+            self.database.upgrade_qa_table()  # databases written before the primary key are upgraded in place
         self.model_details: pd.DataFrame = pd.read_csv(model_list_path, index_col=False)
         self.logger: MyLogger = MyLogger()
+        self.table_cache: TableCache = TableCache(table_cache_bytes)
+        self.table_format: TableFormat = table_format
+        self.checkpoint: CheckpointStore = CheckpointStore(data_path, create_schema=migrate)
+        self.arrow_path: str | None = arrow_path
+
+    def open_loader(self, questions_range: range) -> QuestionLoader | ArrowQuestionLoader:
+        """Opens the question loader, the memory-mapped Arrow export if arrow_path is set, otherwise the SQLite database.
+
+        Args:
+            questions_range (range): the question indices to load
+
+        Returns:
+            QuestionLoader | ArrowQuestionLoader: the loader of the questions
+        """
+        if self.arrow_path is not None:
+            return ArrowQuestionLoader(self.arrow_path, questions_range, table_format=self.table_format)
+        return QuestionLoader(self.database, questions_range, cache=self.table_cache, table_format=self.table_format)
 
     @measure_time
-    def evaluate_model(self, model: ModelLlama, seed_count: int, question_to_ask: int) -> list[float]:
-        """Evaluate a model for each question.
+    def evaluate_model(self, model: ModelLlama, seed_count: int, question_to_ask: int, batch_size: int = 1, order_by_context: bool = False, question_range: range | None = None, seed_offset: int = 0, resume: bool = False, checkpoint_name: str | None = None) -> list[float]:
+        """Evaluate a model for each question. Every answer is streamed to the checkpoint store.
 
         Args:
             model (ModelLlama): the model to evaluate
             seed_count (int): the number of retry the model is allowed to guess
             question_to_ask (int): the total questions to ask
+            batch_size (int, optional): the micro-batch size, above 1 the questions are grouped by prompt length (or by context table with order_by_context) and sent with model.generate_batch. Defaults to 1.
+            order_by_context (bool, optional): ask the questions ordered by context table, so a llama.cpp model reuses the KV-cache of the shared instruction and table prefix. Defaults to False.
+            question_range (range | None, optional): the question indices of a shard, None asks the first question_to_ask questions. Defaults to None.
+            seed_offset (int, optional): the index of the first seed, used by seed shards. Defaults to 0.
+            resume (bool, optional): skip the questions already answered in the checkpoint store. Defaults to False.
+            checkpoint_name (str | None, optional): the model name in the checkpoint store. Defaults to the model name.
 
         Returns:
             list[float]: the results as percentage for each seed
         """
+        questions_range = question_range if question_range is not None else range(question_to_ask)
+        checkpoint_name = checkpoint_name or model.name
+        if batch_size > 1:
+            return self.evaluate_model_batched(model, seed_count, questions_range, batch_size, seed_offset, resume, checkpoint_name, order_by_context)
         results: list[float] = list()
-        for seed_index in range(seed_count):
-            score = 0
-            for data_index in tqdm(range(question_to_ask), unit="questions", desc=f"{model.name} {seed_index}"):
-                table, question, truth = self.database.get_question_with_table(data_index)
-                answer = model.generate_text(data_index, table.to_csv(index=False), question).split(',')
-                # truth.append(translated_answers[data_index]) # FIXME hungarian translate hardcoded
-                success = scoring(truth, answer)
-                score += success
-                self.logger.debug(f"{success}\t{question}\t{truth}\t{answer}")
-            results.append(score/question_to_ask)
+        with self.open_loader(questions_range) as loader:
+            fingerprints = self.question_fingerprints(loader, questions_range)
+            for seed_index in range(seed_offset, seed_offset + seed_count):
+                model.seed = seed_index
+                done = self.checkpoint.load(checkpoint_name, seed_index, questions_range, fingerprints) if resume else {}
+                score = sum(done.values())
+                loader.indices = [data_index for data_index in questions_range if data_index not in done]
+                if order_by_context:
+                    loader.sort_by_context()
+                for data_index, (table, question, truth) in tqdm(zip(loader.indices, loader), total=len(loader), unit="questions", desc=f"{model.name} {seed_index}"):
+                    raw_answer = model.generate_text(data_index, table, question)
+                    answer = raw_answer.split(',')
+                    # truth.append(translated_answers[data_index]) # FIXME hungarian translate hardcoded
+                    success = score_normalized(loader.normalized_truth(data_index), answer)
+                    score += success
+                    self.checkpoint.save(checkpoint_name, seed_index, data_index, success, raw_answer, fingerprints[data_index])
+                    self.logger.debug(f"{success}\t{question}\t{truth}\t{answer}")
+                results.append(score/len(questions_range))
         return results     
 
-    def loop(self, seed_count: int = 1, question_limit: int | None = None, language_en: bool = True):
+    def evaluate_model_batched(self, model: ModelLlama, seed_count: int, questions_range: range, batch_size: int, seed_offset: int = 0, resume: bool = False, checkpoint_name: str | None = None, order_by_context: bool = False) -> list[float]:
+        """Evaluate a model for each question in micro-batches of similar prompt length, or of consecutive questions of the same context tables.
+
+        Args:
+            model (ModelLlama): the model to evaluate
+            seed_count (int): the number of retry the model is allowed to guess
+            questions_range (range): the question indices to ask
+            batch_size (int): the maximum number of questions in a micro-batch
+            seed_offset (int, optional): the index of the first seed. Defaults to 0.
+            resume (bool, optional): skip the questions already answered in the checkpoint store. Defaults to False.
+            checkpoint_name (str | None, optional): the model name in the checkpoint store. Defaults to the model name.
+            order_by_context (bool, optional): batch the questions in context table order instead of by prompt length. Defaults to False.
+
+        Returns:
+            list[float]: the results as percentage for each seed
+        """
+        checkpoint_name = checkpoint_name or model.name
+        tables, questions, truths, normalized_truths = {}, {}, {}, {}
+        with self.open_loader(questions_range) as loader:
+            if order_by_context:
+                loader.sort_by_context()
+            order = list(loader.indices) if order_by_context else None
+            fingerprints = self.question_fingerprints(loader, questions_range)
+            for data_index, (table, question, truth) in zip(loader.indices, loader):
+                tables[data_index] = table
+                questions[data_index] = question
+                truths[data_index] = truth
+                normalized_truths[data_index] = loader.normalized_truth(data_index)
+
+        results: list[float] = list()
+        for seed_index in range(seed_offset, seed_offset + seed_count):
+            model.seed = seed_index
+            done = self.checkpoint.load(checkpoint_name, seed_index, questions_range, fingerprints) if resume else {}
+            score = sum(done.values())
+            prompt_lengths = {data_index: len(tables[data_index]) + len(questions[data_index]) for data_index in questions_range if data_index not in done}
+            with tqdm(total=len(questions_range), initial=len(done), unit="questions", desc=f"{model.name} {seed_index}") as progress:
+                for batch in self.make_batches(prompt_lengths, batch_size, order):
+                    raw_answers = model.generate_batch(batch, [tables[i] for i in batch], [questions[i] for i in batch])
+                    answers = [raw_answer.split(',') for raw_answer in raw_answers]
+                    successes, _ = score_batch([normalized_truths[i] for i in batch], answers)
+                    score += sum(successes)
+                    for data_index, raw_answer, answer, success in zip(batch, raw_answers, answers, successes):
+                        self.checkpoint.save(checkpoint_name, seed_index, data_index, success, raw_answer, fingerprints[data_index])
+                        self.logger.debug(f"{success}\t{questions[data_index]}\t{truths[data_index]}\t{answer}")
+                    progress.update(len(batch))
+            results.append(score/len(questions_range))
+        return results
+
+    @staticmethod
+    def question_fingerprints(loader: QuestionLoader | ArrowQuestionLoader, questions_range: range) -> dict[int, str]:
+        """Returns the checkpoint fingerprints of the questions to ask.
+
+        Args:
+            loader (QuestionLoader | ArrowQuestionLoader): The open loader of the questions.
+            questions_range (range): The question indices.
+
+        Returns:
+            dict[int, str]: The fingerprint of each question index.
+        """
+        qa_rows = loader.load_qa_rows()
+        return {data_index: CheckpointStore.fingerprint(*qa_rows[f'nt-{data_index}']) for data_index in questions_range}
+
+    @staticmethod
+    def make_batches(prompt_lengths: dict[int, int], batch_size: int, order: list[int] | None = None) -> list[list[int]]:
+        """Groups question indices into micro-batches. The indices are sorted by prompt length first, so a batch is padded to a similar length, questions of the same length keep their order.
+
+        Args:
+            prompt_lengths (dict[int, int]): The prompt length of each question index to ask.
+            batch_size (int): The maximum number of questions in a batch.
+            order (list[int] | None, optional): The order to batch the indices in instead of the prompt length, like the context table order. Defaults to None.
+
+        Returns:
+            list[list[int]]: The question indices of each batch.
+        """
+        if order is not None:
+            ordered = [index for index in order if index in prompt_lengths]
+        else:
+            ordered = sorted(prompt_lengths, key=lambda index: prompt_lengths[index])
+        return [ordered[start:start + batch_size] for start in range(0, len(ordered), batch_size)]
+
+    def loop(self, seed_count: int = 1, question_limit: int | None = None, language_en: bool = True, batch_size: int = 1, order_by_context: bool = False, prompt_cache_bytes: int = 0, resume: bool = False):
         """The main loop of the evaluation framework.
 
         Args:
             seed_count (int, optional): The amount of retrying with different seeds for each question. Defaults to 1.
             question_limit (int | None, optional): The maximum number of questions if we want to limit the total amount in the database. Defaults to None.
             language_en (bool, optional): The language of the dataset and the evaluation. It means the evaluator will ask the question in different english. Defaults to True.
+            batch_size (int, optional): The micro-batch size of the evaluation, 1 asks the questions one by one. OpenAI models send a micro-batch as concurrent requests. Defaults to 1.
+            order_by_context (bool, optional): Ask the questions ordered by context table to reuse the llama.cpp KV-cache of the shared prompt prefix. Defaults to False.
+            prompt_cache_bytes (int, optional): The size of the llama.cpp RAM cache of prompt states for gguf models, 0 disables it. Defaults to 0.
+            resume (bool, optional): Continue an interrupted run, the questions already in the checkpoint store are not asked again. Defaults to False.
         """
         question_count_to_ask: int = min(question_limit,self.database.get_database_info()) # get how many total questions to ask
         self.logger.info(f"New loop started with {seed_count} seed count, {question_count_to_ask} total questions and the language is en: {language_en}.")
         for model_detail in self.model_details.iterrows(): # loop through all models to ask questions from all of them
             try:
                 # evaluation
-                if model_detail[1]['Model type'] == "gguf":
-                    model = ModelLlama(url=model_detail[1]['URL'], n_gpu_layers=int(model_detail[1]['Layer offset count']), prompt_format=Prompt(model_detail[1]['Prompt format']))
-                elif model_detail[1]['Model type'] == "openai":
-                    model = ModelOpenAI(url=model_detail[1]['URL'], prompt_format=Prompt(model_detail[1]['Prompt format']))
-                else: 
-                    model = ModelTransformer(url=model_detail[1]['URL'], prompt_format=Prompt(model_detail[1]['Prompt format']))
-                results, elapsed_time = self.evaluate_model(
-                    model,
-                    seed_count,
-                    question_count_to_ask)
-                # logging
-                self.logger.logging_results("Research", question_count_to_ask, language_en, model_detail[1]['Name'], question_count_to_ask/elapsed_time, results)
+                model = self.create_model(model_detail[1], prompt_cache_bytes, cache=self.generation_cache)
+                try:
+                    results, elapsed_time = self.evaluate_model(
+                        model,
+                        seed_count,
+                        question_count_to_ask,
+                        batch_size,
+                        order_by_context,
+                        resume=resume,
+                        checkpoint_name=model_detail[1]['Name'])
+                finally:
+                    model.close()
+                # logging, the speed counts every answered question of every seed
+                self.logger.logging_results("Research", question_count_to_ask, language_en, model_detail[1]['Name'], question_count_to_ask*seed_count/elapsed_time, results)
+                self.logger.info(f"Table cache: {self.table_cache}")
+                if self.generation_cache is not None:
+                    self.generation_cache.flush()
+                    self.logger.info(f"Generation cache: {self.generation_cache}")
             except ValueError as context_size_violation:
                 self.logger.error(context_size_violation)
 
+    def loop_parallel(self, seed_count: int = 1, question_limit: int | None = None, language_en: bool = True, batch_size: int = 1, workers: int = 2, threads_per_worker: int | None = None, memory_budget_gb: float | None = None, worker_memory_gb: float | None = None, seed_shards: int = 1, question_shards: int = 1, resume: bool = False):
+        """The main loop of the evaluation framework, evaluating several models (or seed and question shards of a model) at once in a process pool. Meant for CPU-only nodes.
+
+        Args:
+            seed_count (int, optional): The amount of retrying with different seeds for each question. Defaults to 1.
+            question_limit (int | None, optional): The maximum number of questions if we want to limit the total amount in the database. Defaults to None.
+            language_en (bool, optional): The language of the dataset and the evaluation. Defaults to True.
+            batch_size (int, optional): The micro-batch size of the evaluation, 1 asks the questions one by one. OpenAI models send a micro-batch as concurrent requests. Defaults to 1.
+            workers (int, optional): The maximum number of worker processes. Defaults to 2.
+            threads_per_worker (int | None, optional): The CPU thread budget of a worker, None divides the CPU cores between the workers. Defaults to None.
+            memory_budget_gb (float | None, optional): The total memory budget of the workers, it limits the worker count together with worker_memory_gb. Defaults to None.
+            worker_memory_gb (float | None, optional): The expected memory usage of one worker with a loaded model. Defaults to None.
+            seed_shards (int, optional): The number of shards the seeds of a model are split into, each shard is evaluated by a separate worker. Defaults to 1.
+            question_shards (int, optional): The number of contiguous question ranges a seed shard is split into. Defaults to 1.
+            resume (bool, optional): Continue an interrupted run, the questions already in the checkpoint store are not asked again. Defaults to False.
+        """
+        question_count_to_ask: int = min(question_limit,self.database.get_database_info())
+        if memory_budget_gb is not None and worker_memory_gb is not None:
+            workers = max(1, min(workers, int(memory_budget_gb // worker_memory_gb)))
+        if threads_per_worker is None:
+            threads_per_worker = max(1, (os.cpu_count() or 1) // workers)
+        seed_ranges = [range(seed_count * index // seed_shards, seed_count * (index + 1) // seed_shards) for index in range(seed_shards)]
+        question_ranges = [range(question_count_to_ask * index // question_shards, question_count_to_ask * (index + 1) // question_shards) for index in range(question_shards)]
+        shards = [(seeds, questions) for seeds in seed_ranges for questions in question_ranges if len(seeds) and len(questions)]
+        self.logger.info(f"New parallel loop started with {seed_count} seed count, {question_count_to_ask} total questions in {len(shards)} shards, {workers} workers with {threads_per_worker} threads each and the language is en: {language_en}.")
+
+        iteration_speeds: dict[str, list[float]] = {}
+        context = multiprocessing.get_context("spawn")
+        # a worker process evaluates only one shard, so the memory of the model is released when it is done
+        # replacement workers are spawned during the whole loop, so the thread budget stays in the environment until it ends
+        with thread_environment(threads_per_worker), ProcessPoolExecutor(max_workers=workers, mp_context=context, max_tasks_per_child=1, initializer=limit_threads, initargs=(threads_per_worker,)) as executor:
+            futures = {}
+            for _, model_detail in self.model_details.iterrows():
+                iteration_speeds[model_detail['Name']] = []
+                for seeds, questions in shards:
+                    future = executor.submit(evaluate_worker, self.model_list_path, self.data_path, model_detail.to_dict(), seeds, questions, batch_size, threads_per_worker, resume, self.generation_cache_path, self.generation_cache_read_only, self.arrow_path)
+                    futures[future] = (model_detail['Name'], len(seeds) * len(questions))
+            for future in as_completed(futures):
+                model_name, shard_size = futures[future]
+                try:
+                    _, elapsed_time = future.result()
+                except ValueError as context_size_violation:
+                    self.logger.error(context_size_violation)
+                    iteration_speeds.pop(model_name, None)
+                    continue
+                if model_name not in iteration_speeds:
+                    continue
+                iteration_speeds[model_name].append(shard_size/elapsed_time)
+                if len(iteration_speeds[model_name]) == len(shards):
+                    # only the main process writes the results, the shards are merged from the checkpoint store
+                    results = self.checkpoint.results(model_name, range(seed_count), range(question_count_to_ask))
+                    self.logger.logging_results("Research", question_count_to_ask, language_en, model_name, sum(iteration_speeds.pop(model_name)), results)
+
+    @staticmethod
+    def create_model(model_detail: pd.Series | dict, prompt_cache_bytes: int = 0, n_threads: int | None = None, cache: GenerationCache | None = None) -> ModelLlama | ModelOpenAI | ModelTransformer:
+        """Creates the model described by a row of the model list.
+
+        Args:
+            model_detail (pd.Series | dict): The row of the model list.
+            prompt_cache_bytes (int, optional): The size of the llama.cpp RAM cache of prompt states for gguf models. Defaults to 0.
+            n_threads (int | None, optional): The CPU thread count of gguf models, None lets llama.cpp decide. Defaults to None.
+            cache (GenerationCache | None, optional): The generation cache of the model. Defaults to None.
+
+        Returns:
+            ModelLlama | ModelOpenAI | ModelTransformer: The loaded model.
+        """
+        if model_detail['Model type'] == "gguf":
+            return ModelLlama(url=model_detail['URL'], n_gpu_layers=int(model_detail['Layer offset count']), prompt_format=Prompt(model_detail['Prompt format']), prompt_cache_bytes=prompt_cache_bytes, n_threads=n_threads, cache=cache)
+        elif model_detail['Model type'] == "openai":
+            return ModelOpenAI(url=model_detail['URL'], prompt_format=Prompt(model_detail['Prompt format']), cache=cache)
+        return ModelTransformer(url=model_detail['URL'], prompt_format=Prompt(model_detail['Prompt format']), cache=cache)
+
+@contextmanager
+def thread_environment(threads: int):
+    """Sets the thread budget of the numeric libraries in the environment of the spawned worker processes. OpenMP, MKL and OpenBLAS size their thread pools when they are loaded, which happens while a spawned worker imports this module, before any initializer runs.
+
+    Args:
+        threads (int): The thread count of a worker.
+    """
+    variables = ["OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS"]
+    previous = {variable: os.environ.get(variable) for variable in variables}
+    os.environ.update({variable: str(threads) for variable in variables})
+    try:
+        yield
+    finally:
+        for variable, value in previous.items():
+            if value is None:
+                os.environ.pop(variable, None)
+            else:
+                os.environ[variable] = value
+
+def limit_threads(threads: int):
+    """Worker process initializer limiting the intra-op threads of torch, the numeric libraries get their budget from thread_environment."""
+    torch.set_num_threads(threads)
+
+def evaluate_worker(model_list_path: str, data_path: str, model_detail: dict, seeds: range, questions: range, batch_size: int, threads: int, resume: bool, generation_cache_path: str | None = None, generation_cache_read_only: bool = False, arrow_path: str | None = None) -> tuple[list[float], float]:
+    """Evaluates a shard of a model in a worker process of Controller.loop_parallel, the answers are written to the checkpoint store.
+
+    Returns:
+        tuple[list[float], float]: The results of the shard as percentage for each seed and the elapsed time.
+    """
+    controller = Controller(model_list_path, data_path, generation_cache_path=generation_cache_path, generation_cache_read_only=generation_cache_read_only, arrow_path=arrow_path, migrate=False)
+    model = controller.create_model(model_detail, n_threads=threads, cache=controller.generation_cache)
+    try:
+        return controller.evaluate_model(model, len(seeds), len(questions), batch_size, question_range=questions, seed_offset=seeds.start, resume=resume, checkpoint_name=model_detail['Name'])
+    finally:
+        model.close()
+        if controller.generation_cache is not None:
+            controller.generation_cache.close()  # writes the access times of the cache hits
+
 if __name__ == "__main__":
     controller = Controller(
         model_list_path='/home/p_tabtg/llama_project/QATesting/data/model_list.csv',
@@ -74,5 +324,6 @@ if __name__ == "__main__":
         seed_count=1,
         question_limit=1000,
         language_en=False,
+        batch_size=1,
     )
     Report().main()
@@ -1,5 +1,5 @@
 import urllib.request
-from llama_cpp import Llama
+from llama_cpp import Llama, LlamaRAMCache
 import os
 import pandas as pd
 from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
@@ -9,17 +9,23 @@ from tqdm import tqdm
 from utilities import *
 import transformers
 import openai_module
+from generation_cache import GenerationCache
+from typing import Callable
 
 class Model:
     def __init__(self, url: str = "None/None") -> None:
         self.score: list[int] = list()
         self.model = None
         self.name: str = url.split("/")[-1]
+        self.prompt_format: Prompt = Prompt.DEFAULT
+        self.cache: GenerationCache | None = None
+        self.seed: int = 0
 
-    def generate_text(self, table: str, question: str) -> str:
+    def generate_text(self, index: int, table: str, question: str) -> str:
         """Generating text based on the question and the table.
 
         Args:
+            index (int): The question index for translating purposes.
             table (str): The table as an already formatted string.
             question (str): The question as a string.
 
@@ -28,6 +34,34 @@ class Model:
         """
         prompt = f"{table}\n{question}\nBase model answer."
         return prompt
+
+    def generate_batch(self, indices: list[int], tables: list[str], questions: list[str]) -> list[str]:
+        """Generating text for a micro-batch of questions. Models that can't batch fall back to one generate_text call per question.
+
+        Args:
+            indices (list[int]): The question indices for translating purposes.
+            tables (list[str]): The tables as already formatted strings.
+            questions (list[str]): The questions as strings.
+
+        Returns:
+            list[str]: The model answers in the same order as the questions.
+        """
+        return [self.generate_text(index, table, question) for index, table, question in zip(indices, tables, questions)]
+
+    def generate_cached(self, prompts: list[str], parameters: dict, generate: Callable[[list[str]], list[str]]) -> list[str]:
+        """Generating the answers of full prompts through the generation cache, only the prompts missing from the cache are generated.
+
+        Args:
+            prompts (list[str]): The full prompts.
+            parameters (dict): The generation parameters, part of the cache key together with the seed.
+            generate (Callable[[list[str]], list[str]]): Generates the answers of a list of prompts.
+
+        Returns:
+            list[str]: The model answers in the same order as the prompts.
+        """
+        if self.cache is None:
+            return generate(prompts)
+        return self.cache.generate(self.name, self.prompt_format.name, prompts, {**parameters, "seed": self.seed}, generate)
     
     def generate_question(self, table: str) -> tuple[str, str]:
         """Generates a question from the input table and it's answer part.
@@ -41,6 +75,10 @@ class Model:
         question = "What does the table contain?"
         answer = table
         return question, answer
+
+    def close(self):
+        """Releases the resources of the model that are not freed with it, like open connections."""
+        pass
     
     def __str__(self) -> str:
         return self.name
@@ -49,28 +87,51 @@ class ModelOpenAI(Model):
     def __init__(self,
                  url: str,
                  model_folder_path: str = '/home/p_tabtg/p_tab_llm_scratch/.hfcache/hub',
-                 context_length: int = 32, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True) -> None:
+                 context_length: int = 32, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True, max_in_flight: int = 16, base_url: str | None = None, cache: GenerationCache | None = None) -> None:
         super().__init__()
         self.name = url
         self.model_path = model_folder_path
         self.prompt_format = prompt_format
         self.lang_en = lang_en
+        self.cache = cache
+        self.max_in_flight = max_in_flight
+        self.base_url = base_url
+        # created for the first prompt the cache can't answer, re-scoring from the cache needs no API key
+        self.client: openai_module.AsyncChatClient | None = None
 
     def generate_text(self, index: int, table: str, question: str) -> str:
         prompt = construct_prompt(index, question, table, self.lang_en, self.prompt_format)
-        total_answer = openai_module.call_openai(prompt, model=self.name)
+        total_answer = self.generate_cached([prompt], {}, self.complete_prompts)[0]
         return total_answer
 
+    def generate_batch(self, indices: list[int], tables: list[str], questions: list[str]) -> list[str]:
+        prompts = [construct_prompt(index, question, table, self.lang_en, self.prompt_format) for index, table, question in zip(indices, tables, questions)]
+        return self.generate_cached(prompts, {}, self.complete_prompts)
+
+    def complete_prompts(self, prompts: list[str]) -> list[str]:
+        """Sends the prompts concurrently through the chat client, it is created on the first call."""
+        if self.client is None:
+            self.client = openai_module.AsyncChatClient(model=self.name, max_in_flight=self.max_in_flight, base_url=self.base_url)
+        return self.client.complete_many(prompts)
+
+    def close(self):
+        """Closes the connections and the event loop of the chat client if it was created."""
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
 class ModelTransformer(Model):
     def __init__(self,
                  url: str,
                  model_folder_path: str = '/home/p_tabtg/p_tab_llm_scratch/.hfcache/hub',
-                 context_length: int = 32, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True) -> None:
+                 context_length: int = 32, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True, cache: GenerationCache | None = None) -> None:
         super().__init__()
         self.name = url
         self.model_path = model_folder_path
         self.prompt_format = prompt_format
         self.lang_en = lang_en
+        self.cache = cache
+        self.context_length = context_length
         self.model = transformers.pipeline(
             "text-generation",
             model=self.name,
@@ -79,24 +140,29 @@ class ModelTransformer(Model):
             device_map="auto",
             max_new_tokens = context_length
         )
+        # batched generation needs padding, decoder-only models must be padded on the left
+        if self.model.tokenizer.pad_token is None:
+            self.model.tokenizer.pad_token = self.model.tokenizer.eos_token
+        self.model.tokenizer.padding_side = "left"
         
     def generate_text(self, index: int, table: str, question: str) -> str:
         prompt = construct_prompt(index, question, table, self.lang_en, self.prompt_format)
-        
-        total_answer: str = self.model(prompt)[0]["generated_text"]
-        answer = total_answer[len(prompt):]
-        split_answers = answer.split('"')
-        print("----")
-        print("answer:", answer)
-        print("split_answer:", split_answers)
-        print("first:", split_answers[0])
-        return split_answers[0]
+        return self.generate_cached([prompt], {"max_new_tokens": self.context_length}, self.complete_prompts)[0]
+
+    def generate_batch(self, indices: list[int], tables: list[str], questions: list[str]) -> list[str]:
+        prompts = [construct_prompt(index, question, table, self.lang_en, self.prompt_format) for index, table, question in zip(indices, tables, questions)]
+        return self.generate_cached(prompts, {"max_new_tokens": self.context_length}, self.complete_prompts)
+
+    def complete_prompts(self, prompts: list[str]) -> list[str]:
+        """Runs the pipeline on the prompts as one batch, the answer is the generated text until the first quotation mark."""
+        outputs = self.model(prompts, batch_size=len(prompts))
+        return [output[0]["generated_text"][len(prompt):].split('"')[0] for prompt, output in zip(prompts, outputs)]
 
 class ModelLlama(Model):
     def __init__(self,
                  url: str,
                  model_folder_path: str = 'models/',
-                 context_length: int = 4096, n_gpu_layers=-1, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True) -> None:
+                 context_length: int = 4096, n_gpu_layers=-1, prompt_format: Prompt = Prompt.LLAMA3, lang_en: bool = True, prompt_cache_bytes: int = 0, n_threads: int | None = None, cache: GenerationCache | None = None) -> None:
         super().__init__()
         self.name: str = url.split("/")[-1]
         self.model_path: str = self.download_file(url, model_folder_path, self.name)
@@ -105,9 +171,15 @@ class ModelLlama(Model):
                 model_path=self.model_path,
                 n_ctx=9000,
                 n_gpu_layers=-1,
+                n_threads=n_threads,
             )
+        # llama.cpp keeps the KV-cache of the longest common token prefix with the previous prompt, so only the question is evaluated when
+        # consecutive prompts share the instruction and the table. The RAM cache also restores saved states for prefixes seen earlier.
+        if prompt_cache_bytes > 0:
+            self.model.set_cache(LlamaRAMCache(capacity_bytes=prompt_cache_bytes))
         self.prompt_format: Prompt = prompt_format
         self.lang_en: bool = lang_en
+        self.cache = cache
 
     @staticmethod
     def download_file(url: str, folder_path: str, name: str) -> str:
@@ -130,14 +202,22 @@ class ModelLlama(Model):
         return file_path
 
     def generate_text(self, index: int, table: str, question: str) -> str:
-        with Suppressor():
-            output = self.model(
-                construct_prompt(index, question, table, self.lang_en, self.prompt_format),
-                max_tokens=None,
-                echo=False,
-                stop=stopping_tokens,
-            )
-        return output["choices"][0]["text"].strip()
+        prompt = construct_prompt(index, question, table, self.lang_en, self.prompt_format)
+        return self.generate_cached([prompt], {"max_tokens": None, "stop": stopping_tokens}, self.complete_prompts)[0]
+
+    def complete_prompts(self, prompts: list[str]) -> list[str]:
+        """Completes the prompts one by one, llama.cpp reuses the KV-cache of the prefix shared with the previous prompt."""
+        answers = []
+        for prompt in prompts:
+            with Suppressor():
+                output = self.model(
+                    prompt,
+                    max_tokens=None,
+                    echo=False,
+                    stop=stopping_tokens,
+                )
+            answers.append(output["choices"][0]["text"].strip())
+        return answers
     
     def generate_question(self, table: str, language_en: bool = True) -> tuple[str, str]:
         answer: str = construct_clean_answer(table)
@@ -1,5 +1,6 @@
 import logging
 import os
+import fcntl
 import pandas as pd
 import datetime
 
@@ -75,7 +76,9 @@ class MyLogger(logging.getLoggerClass()):
         }
         
         row = pd.DataFrame([data_to_append], columns=["Date", "Dataset name", "Dataset size", "Dataset language", "Model name", "Iteration speed", "Score"])
-        row.to_csv(self.result_path, mode='a', header=False, index=False, sep=";")  # Append row to the CSV file without writing headers
+        with open(f"{self.result_path}.lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)  # several evaluation processes may append to the same file
+            row.to_csv(self.result_path, mode='a', header=False, index=False, sep=";")  # Append row to the CSV file without writing headers
         self.info(data_to_append)
 
     def make_report(self):
@@ -1,12 +1,29 @@
 import os
-from openai import OpenAI
+import asyncio
+import random
+import threading
+from openai import OpenAI, AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+from generation_cache import GenerationCache
 
-def call_openai(prompt: str, model: str = "gpt-4o-mini") -> str:
+DEFAULT_OPENAI_MODEL = "gpt-4o-mini"
+client: OpenAI | None = None
+
+def get_client() -> OpenAI:
+    """Returns the shared OpenAI client, so every call reuses its pooled HTTP connections."""
+    global client
+    if client is None:
+        client = OpenAI(
+            api_key=os.environ.get("OPENAI_API_KEY"),
+        )
+    return client
+
+def call_openai(prompt: str, model: str = DEFAULT_OPENAI_MODEL, cache: GenerationCache | None = None) -> str:
     """Calls OpenAI API to get answer with a single chat completion input.
 
     Args:
         prompt (str): The user input in string format.
-        model (str, optional): The selected model to call with API. Defaults to "gpt-4o-mini".
+        model (str, optional): The selected model to call with API. Defaults to DEFAULT_OPENAI_MODEL.
+        cache (GenerationCache | None, optional): The generation cache, a cached answer is returned without calling the API. Defaults to None.
 
     Raises:
         TypeError: The return value type must be string.
@@ -14,11 +31,10 @@ def call_openai(prompt: str, model: str = "gpt-4o-mini") -> str:
     Returns:
         str: The answer in string format.
     """
-    client = OpenAI(
-        api_key=os.environ.get("OPENAI_API_KEY"),
-    )
+    if cache is not None:
+        return cache.generate(model, "openai", [prompt], {}, lambda prompts: [call_openai(prompts[0], model)])[0]
 
-    chat_completion = client.chat.completions.create(
+    chat_completion = get_client().chat.completions.create(
         messages=[
             {
                 "role": "user",
@@ -31,14 +47,105 @@ def call_openai(prompt: str, model: str = "gpt-4o-mini") -> str:
     if type(answer) != str:
         raise TypeError(f"The answer is not a string. The answer:\n{answer}") 
     return answer
-        
 
-def generate_question_from_sentence_openai(sentence: str, answer: str) -> tuple[str, bool]:
+class AsyncChatClient:
+    def __init__(self, model: str = DEFAULT_OPENAI_MODEL, max_in_flight: int = 16, max_retries: int = 6, backoff: float = 1.0, max_backoff: float = 60.0, base_url: str | None = None, api_key: str | None = None) -> None:
+        """Chat completion client sending many prompts concurrently through one shared AsyncOpenAI client. The client lives on a background event loop, so its pooled connections are reused across calls.
+
+        Args:
+            model (str, optional): The selected model to call with API. Defaults to DEFAULT_OPENAI_MODEL.
+            max_in_flight (int, optional): The maximum number of requests waiting for a response at once. Defaults to 16.
+            max_retries (int, optional): The number of retries of a rate limited or failed request. Defaults to 6.
+            backoff (float, optional): The first retry delay in seconds, it doubles with every retry. Defaults to 1.0.
+            max_backoff (float, optional): The maximum retry delay in seconds. Defaults to 60.0.
+            base_url (str | None, optional): The API base URL, None uses the OpenAI API. Defaults to None.
+            api_key (str | None, optional): The API key. Defaults to the OPENAI_API_KEY environment variable.
+        """
+        self.model = model
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.client = AsyncOpenAI(
+            api_key=api_key or os.environ.get("OPENAI_API_KEY"),
+            base_url=base_url,
+            max_retries=0,  # retries are handled here to respect the in-flight limit and Retry-After
+        )
+
+    async def complete(self, prompt: str) -> str:
+        """Sends one prompt as a single chat completion input, retrying with exponential backoff when rate limited.
+
+        Args:
+            prompt (str): The user input in string format.
+
+        Raises:
+            TypeError: The return value type must be string.
+
+        Returns:
+            str: The answer in string format.
+        """
+        for attempt in range(self.max_retries + 1):
+            try:
+                async with self.semaphore:
+                    chat_completion = await self.client.chat.completions.create(
+                        messages=[
+                            {
+                                "role": "user",
+                                "content": prompt,
+                            }
+                        ],
+                        model=self.model,
+                    )
+                break
+            except (RateLimitError, APIConnectionError, APITimeoutError, InternalServerError) as error:
+                if attempt == self.max_retries:
+                    raise error
+                await asyncio.sleep(self.retry_delay(error, attempt))
+        answer = chat_completion.choices[0].message.content
+        if type(answer) != str:
+            raise TypeError(f"The answer is not a string. The answer:\n{answer}")
+        return answer
+
+    def retry_delay(self, error: Exception, attempt: int) -> float:
+        """The delay before the next attempt, the Retry-After header of a rate limited response is respected."""
+        response = getattr(error, "response", None)
+        retry_after = response.headers.get("retry-after") if response is not None else None
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.max_backoff)
+            except ValueError:
+                pass
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+
+    def complete_many(self, prompts: list[str]) -> list[str]:
+        """Sends the prompts concurrently and waits for all answers.
+
+        Args:
+            prompts (list[str]): The user inputs in string format.
+
+        Returns:
+            list[str]: The answers in the same order as the prompts.
+        """
+        async def gather() -> list[str]:
+            return await asyncio.gather(*[self.complete(prompt) for prompt in prompts])
+        return asyncio.run_coroutine_threadsafe(gather(), self.loop).result()
+
+    def close(self):
+        """Closes the HTTP connections and stops the event loop."""
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+
+def generate_question_from_sentence_openai(sentence: str, answer: str, cache: GenerationCache | None = None) -> tuple[str, bool]:
     """Generates a question from a sentence and an answer. The function masks the answer in the sentence and makes it 
 
     Args:
         sentence (str): The sentence to transform into a
         answer (str): The answer so the question must  
+        cache (GenerationCache | None, optional): The generation cache to avoid paying for the same question again. Defaults to None.
 
     Raises:
         ValueError: It must return a complete question string.
@@ -48,7 +155,7 @@ def generate_question_from_sentence_openai(sentence: str, answer: str) -> tuple[
     """
     prompt = f"Alakítsd át a szöveget úgy, hogy vedd ki belőle a választ és tedd fel úgy kérdésként, hogy arra a válasz a Válasz legyen! #Példa1\nSzöveg:'a kisebbségek közül szerb, német és cigány nemzetiségűnek vallották magukat a legtöbben.'\nVálasz:'cigány'\nMegoldás:'Mely kisebbség vallotta magát a legtöbben a szerb és német mellett?'\n#Példa2\nMondat:'az éves átlagos hőmérséklet 11.2 °c, a csapadék mennyisége pedig az elmúlt százéves átlag alapján 520 mm.'\nVálasz:'11.2'\nMegoldás:'Mennyi az éves átlagos hőmérséklet?'\n\n#A feladat\nHasonlóan oldd meg a problémát! Csak a kérdést írd ki! Ügyelj arra, hogy a válasz ne maradjon benne a kérdésben! Szöveg:'{sentence}'\nVálasz:'{answer}'\n. Csak a megoldást írd!"
     #gpt-4o
-    question = call_openai(prompt)
+    question = call_openai(prompt, cache=cache)
     if not question.endswith("?"):
         return question, False
         raise ValueError(f"question must be a question. The output looks like this:\n{question}")
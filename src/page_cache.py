@@ -0,0 +1,164 @@
+import gzip
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Callable
+from urllib.parse import unquote
+import requests
+
+canonical_pattern = re.compile(r'<link rel="canonical" href="([^"]+)"')
+revision_pattern = re.compile(r'"wgRevisionId":(\d+)')
+
+class PageCache:
+    def __init__(self, path: str = "data/page_cache.db", offline: bool = False, max_age: float | None = None) -> None:
+        """Compressed, content-addressed on-disk cache of Wikipedia pages. A page is stored once for its canonical title and revision, the requested URLs (redirects included) point to it. Cached pages are revalidated with ETag/Last-Modified, so an unchanged page costs a 304 response, and in offline mode the cached pages are replayed without any request.
+
+        Args:
+            path (str, optional): The path to the SQLite file of the cache. Defaults to "data/page_cache.db".
+            offline (bool, optional): Only replay cached pages, a page missing from the cache raises a KeyError. Defaults to False.
+            max_age (float | None, optional): The number of seconds a cached page is used without revalidation, None revalidates every time. Defaults to None.
+        """
+        self.path = path
+        self.offline = offline
+        self.max_age = max_age
+        self.hits = 0
+        self.revalidated = 0
+        self.misses = 0
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS blobs (
+            sha256 TEXT PRIMARY KEY,
+            content BLOB NOT NULL,
+            size INTEGER NOT NULL
+        )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS pages (
+            title TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            sha256 TEXT NOT NULL,
+            PRIMARY KEY (title, revision)
+        )""")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS urls (
+            url TEXT PRIMARY KEY,
+            final_url TEXT NOT NULL,
+            title TEXT NOT NULL,
+            revision INTEGER NOT NULL,
+            etag TEXT,
+            last_modified TEXT,
+            checked REAL NOT NULL
+        )""")
+        self.connection.commit()
+
+    @staticmethod
+    def page_identity(final_url: str, html: str) -> tuple[str, int]:
+        """Returns the canonical title and the revision of a page, read from the canonical link and the wgRevisionId of the HTML.
+
+        Args:
+            final_url (str): The URL of the page after redirects, used when the HTML has no canonical link.
+            html (str): The HTML of the page.
+
+        Returns:
+            tuple[str, int]: The canonical title and the revision id, 0 if the revision is unknown.
+        """
+        canonical = canonical_pattern.search(html)
+        title = unquote((canonical.group(1) if canonical else final_url).split("/wiki/")[-1])
+        revision = revision_pattern.search(html)
+        return title, int(revision.group(1)) if revision else 0
+
+    def fetch(self, url: str, get: Callable[..., requests.Response]) -> tuple[str, str]:
+        """Returns a page from the cache, revalidated or fetched with get if needed.
+
+        Args:
+            url (str): The URL of the page.
+            get (Callable[..., requests.Response]): Fetches a URL with extra request headers, like Crawler.get.
+
+        Raises:
+            KeyError: The page is not cached in offline mode.
+
+        Returns:
+            tuple[str, str]: The unquoted final URL of the page after redirects and its HTML.
+        """
+        entry = self.lookup(url)
+        if entry is not None:
+            final_url, sha256, etag, last_modified, checked = entry
+            if self.offline or (self.max_age is not None and time.time() - checked < self.max_age):
+                self.hits += 1
+                return final_url, self.load(sha256)
+        elif self.offline:
+            raise KeyError(f"{url} is not in the page cache")
+        headers = {}
+        if entry is not None and etag:
+            headers["If-None-Match"] = etag
+        if entry is not None and last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = get(url, headers=headers)
+        if response.status_code == 304 and entry is not None:
+            with self.lock:
+                self.connection.execute("UPDATE urls SET checked = ? WHERE url = ?", (time.time(), url))
+                self.connection.commit()
+            self.revalidated += 1
+            return final_url, self.load(sha256)
+        self.misses += 1
+        final_url = unquote(response.url)
+        html = response.text
+        self.store(url, final_url, html, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+        return final_url, html
+
+    def lookup(self, url: str) -> tuple[str, str, str | None, str | None, float] | None:
+        """Returns the final URL, the content address, the validators and the last check time of a cached URL, or None."""
+        with self.lock:
+            return self.connection.execute("""SELECT urls.final_url, pages.sha256, urls.etag, urls.last_modified, urls.checked
+                FROM urls JOIN pages ON urls.title = pages.title AND urls.revision = pages.revision
+                WHERE urls.url = ?""", (url,)).fetchone()
+
+    def load(self, sha256: str) -> str:
+        """Returns the decompressed HTML of a content address."""
+        with self.lock:
+            content = self.connection.execute("SELECT content FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()[0]
+        return gzip.decompress(content).decode("utf-8")
+
+    def store(self, url: str, final_url: str, html: str, etag: str | None = None, last_modified: str | None = None):
+        """Stores a fetched page. The compressed HTML is stored once for its content address, the same content of another URL or revision is not stored again.
+
+        Args:
+            url (str): The requested URL.
+            final_url (str): The unquoted final URL after redirects.
+            html (str): The HTML of the page.
+            etag (str | None, optional): The ETag header of the response. Defaults to None.
+            last_modified (str | None, optional): The Last-Modified header of the response. Defaults to None.
+        """
+        content = html.encode("utf-8")
+        sha256 = hashlib.sha256(content).hexdigest()
+        title, revision = self.page_identity(final_url, html)
+        compressed = gzip.compress(content)
+        with self.lock:
+            self.connection.execute("INSERT OR IGNORE INTO blobs (sha256, content, size) VALUES (?, ?, ?)", (sha256, compressed, len(content)))
+            self.connection.execute("INSERT OR REPLACE INTO pages (title, revision, sha256) VALUES (?, ?, ?)", (title, revision, sha256))
+            self.connection.execute("INSERT OR REPLACE INTO urls (url, final_url, title, revision, etag, last_modified, checked) VALUES (?, ?, ?, ?, ?, ?, ?)", (url, final_url, title, revision, etag, last_modified, time.time()))
+            self.connection.commit()
+
+    def load_page(self, title: str, revision: int | None = None) -> str | None:
+        """Returns the HTML of a cached page by canonical title, the latest cached revision if revision is None."""
+        with self.lock:
+            if revision is None:
+                row = self.connection.execute("SELECT sha256 FROM pages WHERE title = ? ORDER BY revision DESC LIMIT 1", (title,)).fetchone()
+            else:
+                row = self.connection.execute("SELECT sha256 FROM pages WHERE title = ? AND revision = ?", (title, revision)).fetchone()
+        return self.load(row[0]) if row is not None else None
+
+    def cached_urls(self) -> list[str]:
+        """Returns the cached URLs in the order they were last fetched, to replay a whole crawl offline."""
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT url FROM urls ORDER BY rowid")]
+
+    def __str__(self) -> str:
+        return f"{self.hits} hits, {self.revalidated} revalidated, {self.misses} misses"
+
+    def close(self):
+        self.connection.close()
@@ -7,6 +7,7 @@ import re
 import io
 import csv
 import random
+import functools
 
 class Suppressor(object):
     def __enter__(self):
@@ -48,6 +49,30 @@ class Prompt(Enum):
     LLAMA2HUN = 1
     LLAMA2 = 2
     LLAMA3 = 3
+
+class TableFormat(Enum):
+    CSV = "csv"
+    TSV = "tsv"
+    JSON = "json"
+
+def serialize_table(table, table_format: TableFormat = TableFormat.CSV) -> str:
+    """Serializes a table into the text that is put into the prompt.
+
+    Args:
+        table (pd.DataFrame): The table to serialize.
+        table_format (TableFormat, optional): The serialization format. Defaults to TableFormat.CSV.
+
+    Returns:
+        str: the table in a string format.
+    """
+    match table_format:
+        case TableFormat.CSV:
+            return table.to_csv(index=False)
+        case TableFormat.TSV:
+            return table.to_csv(index=False, sep="\t")
+        case TableFormat.JSON:
+            return table.to_json(orient="records", force_ascii=False)
+    raise NotImplementedError(f"{table_format} table format is not implemented.")
     
 def construct_clean_answer(table: str) -> str:
     csv_data = io.StringIO(table)
@@ -157,16 +182,56 @@ def get_memory_usage() -> int:
             pass
     return 0
 
+clean_pattern = re.compile(r"[^\w\s]|\xa0")
+
 def clean_string(input_string: str) -> list[str]:
     cleaned_list: list[str] = list()
     if input_string:
-        cleaned_string = input_string
-        cleaned_string = re.sub(r"[^\w\s]", "", cleaned_string).replace("\xa0", "")
-        cleaned_string = cleaned_string.strip()
-        cleaned_string = cleaned_string.lower()
-        cleaned_list = cleaned_string.split()
+        cleaned_list = clean_pattern.sub("", input_string).lower().split()
     return cleaned_list
 
+@functools.lru_cache(maxsize=65536)
+def normalize_chunk(chunk: str) -> tuple[str, ...]:
+    """Cleans and tokenizes an answer chunk into a hashable token tuple. Answer chunks repeat a lot across questions and seeds, so the result is cached."""
+    return tuple(clean_string(chunk))
+
+def normalize_truth(truth: list[str]) -> tuple[frozenset[tuple[str, ...]], int]:
+    """Normalizes the true answers of a question once, so every seed and model can reuse it.
+
+    Args:
+        truth (list[str]): The true answers from the dataset.
+
+    Returns:
+        tuple[frozenset[tuple[str, ...]], int]: The set of the token tuples of the answers and the number of answers.
+    """
+    return frozenset(normalize_chunk(truth_chunk) for truth_chunk in truth), len(truth)
+
+def score_normalized(truth: tuple[frozenset[tuple[str, ...]], int], model_answer: list[str]) -> float:
+    """Scores the model answer against an already normalized truth, same as scoring.
+
+    Args:
+        truth (tuple[frozenset[tuple[str, ...]], int]): The truth normalized with normalize_truth.
+        model_answer (list[str]): The model answer that needs to be analyzed.
+
+    Returns:
+        float: the ratio of the accepted answer chunks and the true answers.
+    """
+    truth_set, truth_count = truth
+    return float(sum(1 for answer_chunk in model_answer if normalize_chunk(answer_chunk) in truth_set))/float(truth_count)
+
+def score_batch(truths: list[tuple[frozenset[tuple[str, ...]], int]], model_answers: list[list[str]]) -> tuple[list[float], float]:
+    """Scores the answers of a whole run at once.
+
+    Args:
+        truths (list[tuple[frozenset[tuple[str, ...]], int]]): The truths normalized with normalize_truth, one for each question.
+        model_answers (list[list[str]]): The model answers split into chunks, one for each question.
+
+    Returns:
+        tuple[list[float], float]: The score of each question and the mean score.
+    """
+    scores = [score_normalized(truth, model_answer) for truth, model_answer in zip(truths, model_answers)]
+    return scores, sum(scores)/len(scores) if scores else 0.0
+
 def scoring(truth: list[str], model_answer: list[str]) -> float:
     """Scoring function to tell how the model performed on this task. The function cleans the strings and tokenizes them. If any of the truth's token is in the model_answer's token then we accept the answer.
 
@@ -177,18 +242,7 @@ def scoring(truth: list[str], model_answer: list[str]) -> float:
     Returns:
         bool: the result whether the model_answer is accepted based on the truth.
     """
-    result: float = 0.0
-    cleaned_truth = []    
-    for truth_chunk in truth:
-        cleaned_truth.append(clean_string(truth_chunk))
-    cleaned_answer = []
-    for answer_chunk in model_answer:
-        cleaned_answer.append(clean_string(answer_chunk))
-    
-    for answer in cleaned_answer:
-        if answer in cleaned_truth:
-            result += 1.0
-    return float(result)/float(len(cleaned_truth))
+    return score_normalized(normalize_truth(truth), model_answer)
 
 stopping_tokens = ["<|", "<</", "[/INST]", "[INST]", "</s>", "\n", ". ", "</", "<|im_end|>", "|<", '"', '" ', '"\n']
 # translated_questions: list[str] = read_data()
@@ -0,0 +1,57 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import sqlite3
+import tempfile
+import unittest
+from checkpoint import CheckpointStore
+
+class TestCheckpointStore(unittest.TestCase):
+    def test_resume_and_merge_shards(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.db")
+            first_shard = CheckpointStore(path)
+            second_shard = CheckpointStore(path)
+            for question in range(0, 5):
+                first_shard.save("model", 0, question, 1.0, "answer")
+            for question in range(5, 8):
+                second_shard.save("model", 0, question, 0.5, "answer")
+
+            self.assertEqual(set(first_shard.load("model", 0, range(0, 10))), set(range(8)))
+            self.assertEqual(first_shard.load("model", 1, range(0, 10)), {})
+            self.assertEqual(first_shard.results("model", range(2), range(10)), [0.65, 0.0])
+
+            first_shard.save("model", 0, 0, 0.0, "overwritten")
+            self.assertEqual(second_shard.results("model", range(1), range(5)), [0.8])
+            first_shard.close()
+            second_shard.close()
+
+    def test_changed_questions_are_not_resumed(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "checkpoint.db")
+            connection = sqlite3.connect(path)
+            connection.execute("CREATE TABLE eval_checkpoint (model TEXT NOT NULL, seed INTEGER NOT NULL, question INTEGER NOT NULL, score REAL NOT NULL, answer TEXT, PRIMARY KEY (model, seed, question))")
+            connection.execute("INSERT INTO eval_checkpoint VALUES ('model', 0, 0, 1.0, 'old')")
+            connection.commit()
+            connection.close()
+            store = CheckpointStore(path)
+            fingerprints = {0: CheckpointStore.fingerprint("Hány lakosa van?", "Szeged_0", "160000"), 1: CheckpointStore.fingerprint("Mikor?", "Szeged_0", "1990")}
+            self.assertEqual(store.load("model", 0, range(2)), {0: 1.0})
+            self.assertEqual(store.load("model", 0, range(2), fingerprints), {})  # the old result has no fingerprint
+            store.save("model", 0, 0, 1.0, "answer", fingerprints[0])
+            store.save("model", 0, 1, 0.5, "answer", CheckpointStore.fingerprint("Mikor?", "Szeged_0", "1991"))
+            self.assertEqual(store.load("model", 0, range(2), fingerprints), {0: 1.0})
+            self.assertEqual(CheckpointStore.fingerprint("Mikor?", "Szeged_0", 1990), fingerprints[1])
+            store.close()
+
+    def test_quoted_table_name(self):
+        with tempfile.TemporaryDirectory() as directory:
+            store = CheckpointStore(os.path.join(directory, "checkpoint.db"), table_name='eval "checkpoint"')
+            store.save("model", 0, 0, 1.0, "answer")
+            self.assertEqual(store.results("model", range(1), range(1)), [1.0])
+            store.clear("model")
+            self.assertEqual(store.load("model", 0, range(1)), {})
+            store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,132 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import unittest
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from crawler import Crawler
+from page_cache import PageCache
+from WikipediaYoinker import WikiYoinker
+
+saved_page = """<html><head><title>Példaváros</title>
+<link rel="canonical" href="https://hu.wikipedia.org/wiki/P%C3%A9ldav%C3%A1ros"/>
+<script>RLCONF={"wgRevisionId":27000001};</script></head><body>
+<p>Bevezető.</p>
+<h2 id="Népesség">Népesség</h2>
+<p>A város népessége 1990-ben 12345 fő volt.<sup class="reference"><span class="cite-bracket">[</span>1<span class="cite-bracket">]</span></sup></p>
+<table class="wikitable"><tr><th>Év</th><th>Népesség</th></tr><tr><td>1990</td><td>12345</td></tr></table>
+<h2 id="Források">Források</h2>
+<p>Forrás.</p>
+</body></html>"""
+
+class SavedWikipedia(BaseHTTPRequestHandler):
+    """Serves the saved page for every /wiki/ path, the first request of /wiki/Hiba answers 503. A request with the ETag of the page answers 304."""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    failures = {"/wiki/Hiba": 1}
+    statuses: list[int] = []
+
+    def do_GET(self):
+        cls = type(self)
+        with cls.lock:
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+            failing = cls.failures.get(self.path, 0) > 0
+            if failing:
+                cls.failures[self.path] -= 1
+        time.sleep(0.05)
+        with cls.lock:
+            cls.in_flight -= 1
+        if failing:
+            self.send_page(503, "")
+        elif self.path.startswith("/wiki/Nincs"):
+            self.send_page(404, "")
+        elif self.headers.get("If-None-Match") == '"27000001"':
+            self.send_page(304, "")
+        else:
+            self.send_page(200, saved_page)
+
+    def send_page(self, status: int, page: str):
+        payload = page.encode()
+        type(self).statuses.append(status)
+        self.send_response(status)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        self.send_header("ETag", '"27000001"')
+        self.send_header("Content-Length", str(len(payload)))
+        if status == 503:
+            self.send_header("Retry-After", "0")
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *_):
+        pass
+
+class LocalWikipediaTestCase(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), SavedWikipedia)
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}/wiki/"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+class TestCrawler(LocalWikipediaTestCase):
+    def test_crawl_sections(self):
+        crawler = Crawler(max_workers=4, max_per_host=2, min_interval=0.01, backoff=0)
+        urls = [f"{self.base_url}Oldal_{index}" for index in range(8)] + [f"{self.base_url}Hiba", f"{self.base_url}Nincs"]
+        results = dict(crawler.crawl(urls, WikiYoinker.convert_html_to_section_data, parse_workers=2))
+        self.assertEqual(sorted(results), sorted(urls[:9]))
+        self.assertEqual([url for url, _ in crawler.errors], [f"{self.base_url}Nincs"])
+        expected = WikiYoinker.convert_html_to_section_data(saved_page)
+        for sections in results.values():
+            self.assertEqual([str(section) for section in sections], [str(section) for section in expected])
+            self.assertEqual(sections[0].paragraph, expected[0].paragraph)
+            self.assertTrue(sections[0].list_of_tables[0].equals(expected[0].list_of_tables[0]))
+        self.assertLessEqual(SavedWikipedia.max_in_flight, 2)
+        crawler.close()
+
+    def test_min_interval(self):
+        crawler = Crawler(max_workers=4, max_per_host=4, min_interval=0.1)
+        start_time = time.monotonic()
+        responses = list(crawler.fetch_many([f"{self.base_url}Oldal_{index}" for index in range(5)]))
+        self.assertGreaterEqual(time.monotonic() - start_time, 0.4)
+        self.assertTrue(all(html == saved_page for _, (_, html) in responses))
+        crawler.close()
+
+class TestPageCache(LocalWikipediaTestCase):
+    def test_revalidation_and_offline_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "page_cache.db")
+            urls = [f"{self.base_url}Oldal_{index}" for index in range(3)]
+            page_cache = PageCache(path)
+            crawler = Crawler(min_interval=0, page_cache=page_cache)
+            SavedWikipedia.statuses.clear()
+            for _ in range(2):
+                pages = dict(crawler.fetch_many(urls))
+                self.assertTrue(all(html == saved_page for _, html in pages.values()))
+            self.assertCountEqual(SavedWikipedia.statuses, [200] * 3 + [304] * 3)
+            self.assertEqual((page_cache.misses, page_cache.revalidated), (3, 3))
+            self.assertEqual(page_cache.load_page("Példaváros", 27000001), saved_page)
+            # three URLs of the same revision are stored once
+            self.assertEqual(page_cache.connection.execute("SELECT COUNT(*) FROM blobs").fetchone()[0], 1)
+            crawler.close()
+            page_cache.close()
+
+            offline_cache = PageCache(path, offline=True)
+            offline_crawler = Crawler(page_cache=offline_cache)
+            SavedWikipedia.statuses.clear()
+            results = dict(offline_crawler.crawl(offline_cache.cached_urls() + [f"{self.base_url}Uj"], WikiYoinker.convert_html_to_section_data, parse_workers=0))
+            self.assertEqual(sorted(results), sorted(urls))
+            self.assertEqual(SavedWikipedia.statuses, [])
+            self.assertIsInstance(offline_crawler.errors[0][1], KeyError)
+            offline_cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
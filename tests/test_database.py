@@ -1,9 +1,15 @@
 import sys
 import os
+import pickle
+import threading
 sys.path.append(f"{os.getcwd()}/src")
 import unittest
+import shutil
+import sqlite3
+import tempfile
 import pandas as pd
-from database import Database
+from database import Database, QuestionWriter, Storage
+from utilities import normalize_truth
 
 class TestDatabase(unittest.TestCase):
     test_database_path = "data/test_database.db"
@@ -47,5 +53,293 @@ class TestDatabase(unittest.TestCase):
         qa_table = pd.DataFrame(qa)
         raise NotImplementedError()
 
+class TestNormalizedAnswers(unittest.TestCase):
+    def test_add_normalized_answers(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated_hu.db")
+            shutil.copy("generated_hu.db", path)
+            database = Database(path)
+            database.add_normalized_answers()
+            connection = sqlite3.connect(path)
+            try:
+                normalized_answers = database.read_normalized_answers(connection)
+            finally:
+                connection.close()
+            for x in range(database.get_database_info()):
+                _, _, answers = database.get_question_with_table(x)
+                self.assertEqual(normalized_answers[f'nt-{x}'], normalize_truth(answers))
+
+    def test_normalize_target_value(self):
+        self.assertEqual(Database.normalize_target_value("Szeged|44\xa0502 fő, 1990."), '[["szeged"], ["44502", "fő"], ["1990"]]')
+
+class TestBulkWtqCollector(unittest.TestCase):
+    def test_same_as_wtq_collector(self):
+        with tempfile.TemporaryDirectory() as directory:
+            os.makedirs(os.path.join(directory, "csv", "200-csv"))
+            os.makedirs(os.path.join(directory, "data"))
+            for x in range(5):
+                table = pd.DataFrame({'Year': [1990 + x, 1991 + x], '%': [0.5, None], 'Name': ['Alice', 'Bob']})
+                table.to_csv(os.path.join(directory, "csv", "200-csv", f"{x}.tsv"), sep="\t", index=False)
+            qa_table = pd.DataFrame({'id': ['nt-0', 'nt-1'], 'utterance': ['q0', 'q1'], 'context': ['csv/200-csv/0.csv', 'csv/200-csv/3.csv'], 'targetValue': ['1990', 'Alice|Bob']})
+            qa_table.to_csv(os.path.join(directory, "data", "training.tsv"), sep="\t", index=False)
+            expected = Database(os.path.join(directory, "expected.db"))
+            expected.wtq_collector(directory)
+            bulk = Database(os.path.join(directory, "bulk.db"))
+            bulk.bulk_wtq_collector(directory, workers=2, tables_per_transaction=2)
+            for x in range(2):
+                expected_table, expected_question, expected_answers = expected.get_question_with_table(x)
+                table, question, answers = bulk.get_question_with_table(x)
+                pd.testing.assert_frame_equal(table, expected_table)
+                self.assertEqual(question, expected_question)
+                self.assertEqual(answers, expected_answers)
+
+class TestConsolidatedStorage(unittest.TestCase):
+    def test_consolidate_tables(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated_hu.db")
+            shutil.copy("generated_hu.db", path)
+            Database(path).consolidate_tables()
+            expected = Database("generated_hu.db")
+            consolidated = Database(path)
+            for x in range(expected.get_database_info()):
+                expected_table, expected_question, expected_answers = expected.get_question_with_table(x)
+                table, question, answers = consolidated.get_question_with_table(x)
+                pd.testing.assert_frame_equal(table, expected_table)
+                self.assertEqual(question, expected_question)
+                self.assertEqual(answers, expected_answers)
+            self.assertEqual(consolidated.storage, Storage.CONSOLIDATED)
+
+    def test_generate_questions_table(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "consolidated.db"), storage=Storage.CONSOLIDATED)
+            table = pd.DataFrame({'Name': ['Alice', 'Bob'], 'Age': [25, 30], '%': [0.5, None]})
+            database.generate_questions_table('People_0', table, [('How old is Alice?', '25', True, '')])
+            database.generate_questions_table('People_1', table, [('Who is 30?', 'Bob', True, '')], if_exists='append')
+            connection = sqlite3.connect(database.path)
+            try:
+                names = [row[0] for row in connection.execute("SELECT name FROM sqlite_master WHERE type='table'")]
+            finally:
+                connection.close()
+            self.assertCountEqual(names, ['context_tables', 'qa_table'])
+            stored_table, question, answers = Database(database.path).get_question_with_table(1)
+            pd.testing.assert_frame_equal(stored_table, table.rename(columns={'%': 'Percentage'}))
+            self.assertEqual((question, answers), ('Who is 30?', ['Bob']))
+
+    def test_append_with_detected_storage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated_hu.db")
+            shutil.copy("generated_hu.db", path)
+            Database(path).consolidate_tables()
+            database = Database(path)  # the storage is detected, like in WikiYoinker.main
+            table = pd.DataFrame({'Name': ['Alice', 'Bob'], 'Age': ['25', '30']})
+            database.generate_questions_table('People_0', table, [('Who is 30?', 'Bob', True, '')], if_exists='append')
+            with QuestionWriter(Database(path)) as writer:
+                writer.add('People_1', table, ('How old is Alice?', '25', True, ''))
+            connection = sqlite3.connect(path)
+            try:
+                self.assertIsNone(connection.execute("SELECT name FROM sqlite_master WHERE name LIKE 'People%'").fetchone())
+            finally:
+                connection.close()
+            reader = Database(path)
+            count = reader.get_database_info()
+            for x, expected in [(count - 2, ('Who is 30?', ['Bob'])), (count - 1, ('How old is Alice?', ['25']))]:
+                stored_table, question, answers = reader.get_question_with_table(x)
+                pd.testing.assert_frame_equal(stored_table, table)
+                self.assertEqual((question, answers), expected)
+
+class TestQuestionWriter(unittest.TestCase):
+    def test_same_as_generate_questions_table(self):
+        table = pd.DataFrame({'Name': ['Alice', 'Bob'], 'Age': [25, 30], '%': [0.5, None]})
+        other_table = pd.DataFrame({'City': ['Szeged'], 'Population': [160000]})
+        questions = [('People_0', table, ('How old is Alice?', '25', True, 'Alice is 25.')), ('People_0', table, ('Who is 30?', 'Bob', False, 'Bob is 30.')), ('City_0', other_table, ('e', 'Szeged', False, 'Szeged is a city.'))]
+        with tempfile.TemporaryDirectory() as directory:
+            for storage in [None, Storage.CONSOLIDATED]:
+                expected = Database(os.path.join(directory, f"expected_{storage}.db"), storage=storage)
+                written = Database(os.path.join(directory, f"written_{storage}.db"), storage=storage)
+                for database in [expected, written]:
+                    shutil.copyfile("generated_hu.db", database.path)
+                    if storage == Storage.CONSOLIDATED:
+                        database.consolidate_tables()
+                for table_name, context_table, qa_pair in questions:
+                    expected.generate_questions_table(table_name, context_table.copy(), [qa_pair], if_exists='append')
+                writer = QuestionWriter(written)
+                for table_name, context_table, qa_pair in questions[:2]:
+                    writer.add(table_name, context_table, qa_pair)
+                self.assertEqual(writer.flush(), 2)
+                with writer:
+                    writer.add(*questions[2])
+                self.assertEqual(writer.next_id, 57)
+                pd.testing.assert_frame_equal(written.get_qa_table(), expected.get_qa_table())
+                for x in range(54, 57):
+                    expected_table, expected_question, expected_answers = expected.get_question_with_table(x)
+                    table_read, question, answers = written.get_question_with_table(x)
+                    pd.testing.assert_frame_equal(table_read, expected_table)
+                    self.assertEqual((question, answers), (expected_question, expected_answers))
+
+    def test_failed_flush_writes_nothing(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "generated_hu.db"))
+            shutil.copyfile("generated_hu.db", database.path)
+            writer = QuestionWriter(database)
+            writer.add('People_0', pd.DataFrame({'Name': ['Alice']}), ('Who?', 'Alice', True, 'Alice.'))
+            writer.add('Duplicate_0', pd.DataFrame([[1, 2]], columns=['a', 'a']), ('Which?', '1', True, '1.'))
+            with self.assertRaises(sqlite3.OperationalError):
+                writer.flush()
+            self.assertEqual(len(writer), 0)
+            self.assertEqual(database.get_database_info(), 54)
+            connection = sqlite3.connect(database.path)
+            try:
+                self.assertIsNone(connection.execute("SELECT name FROM sqlite_master WHERE name = 'People_0'").fetchone())
+            finally:
+                connection.close()
+
+class TestQaSchema(unittest.TestCase):
+    def test_upgrade_in_place(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "generated_hu.db")
+            shutil.copyfile("generated_hu.db", path)
+            expected = Database("generated_hu.db")
+            database = Database(path)
+            self.assertTrue(database.upgrade_qa_table())
+            self.assertFalse(database.upgrade_qa_table())
+            connection = sqlite3.connect(path)
+            try:
+                self.assertIn((0, 'num', 'INTEGER', 0, None, 1), connection.execute("PRAGMA table_info(qa_table)").fetchall())
+                self.assertEqual(connection.execute("SELECT COUNT(*) FROM qa_table WHERE id != 'nt-' || num").fetchone()[0], 0)
+                plan = " ".join(row[-1] for row in connection.execute("EXPLAIN QUERY PLAN SELECT utterance FROM qa_table WHERE id = 'nt-7'"))
+                self.assertIn("qa_table_id", plan)
+                plan = " ".join(row[-1] for row in connection.execute("EXPLAIN QUERY PLAN SELECT id FROM qa_table WHERE context = 'x'"))
+                self.assertIn("qa_table_context", plan)
+            finally:
+                connection.close()
+            pd.testing.assert_frame_equal(database.get_qa_table(), expected.get_qa_table())
+            for x in range(expected.get_database_info()):
+                expected_table, expected_question, expected_answers = expected.get_question_with_table(x)
+                table, question, answers = database.get_question_with_table(x)
+                pd.testing.assert_frame_equal(table, expected_table)
+                self.assertEqual((question, answers), (expected_question, expected_answers))
+
+    def test_allocation_after_deleted_rows(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "generated_hu.db"))
+            shutil.copyfile("generated_hu.db", database.path)
+            qa_table = database.get_qa_table()
+            database.set_qa_table(qa_table[qa_table['id'] != 'nt-10'])
+            self.assertFalse(database.upgrade_qa_table())
+            table = pd.DataFrame({'Name': ['Alice'], 'Age': [25]})
+            database.generate_questions_table('People_0', table, [('How old is Alice?', '25', True, 'Alice is 25.')], if_exists='append')
+            writer = QuestionWriter(database)
+            with writer:
+                writer.add('People_0', table, ('Who is 25?', 'Alice', True, 'Alice is 25.'))
+            self.assertEqual(database.get_qa_table()['id'].tolist()[-3:], ['nt-53', 'nt-54', 'nt-55'])
+            self.assertEqual(database.get_question_with_table(55)[1], 'Who is 25?')
+            with self.assertRaises(TypeError):
+                database.get_question_with_table(10)
+
+    def test_new_database(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "new.db"))
+            self.assertFalse(database.upgrade_qa_table())
+            writer = QuestionWriter(database)
+            with writer:
+                writer.add('People_0', pd.DataFrame({'Name': ['Alice']}), ('Who?', 'Alice', True, 'Alice.'))
+            self.assertEqual(writer.next_id, 1)
+            self.assertFalse(database.upgrade_qa_table())
+            self.assertEqual(database.get_question_with_table(0)[1], 'Who?')
+
+class TestTransactions(unittest.TestCase):
+    def test_quoted_table_name(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "quoted.db"))
+            table = pd.DataFrame({'Év': ['1990', '2000'], 'Népesség "fő"': ['170000', '160000']})
+            table_name = 'Szeged_"Belváros"_0; DROP TABLE qa_table'
+            database.generate_questions_table(table_name, table, [('Hány lakos volt 2000-ben?', '160000', True, 'A város népessége 2000-ben 160000 fő volt.')])
+            database.generate_questions_table('Szeged_[Rókus]_1', table, [('Mikor volt 170000 lakos?', '1990', True, 'A város népessége 1990-ben 170000 fő volt.')], if_exists='append')
+            self.assertEqual(database.get_database_info(), 2)
+            context, question, answers = database.get_question_with_table(0)
+            pd.testing.assert_frame_equal(context, table)
+            self.assertEqual((question, answers), ('Hány lakos volt 2000-ben?', ['160000']))
+            self.assertEqual(database.get_qa_table()['context'].tolist(), [table_name, 'Szeged_[Rókus]_1'])
+
+    def test_rollback_and_nesting(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "transactions.db"))
+            database.fill_database(pd.DataFrame({'a': [1]}), 'kept')
+            with self.assertRaises(ZeroDivisionError):
+                with database.transaction() as cursor:
+                    cursor.execute("INSERT INTO kept (a) VALUES (2)")
+                    with database.transaction() as inner:  # joins the outer transaction
+                        inner.execute("CREATE TABLE dropped (a INTEGER)")
+                    self.assertTrue(database.connect().in_transaction)
+                    1 / 0
+            self.assertFalse(database.connect().in_transaction)
+            self.assertEqual(database.connect().execute("SELECT a FROM kept").fetchall(), [(1,)])
+            self.assertIsNone(database.connect().execute("SELECT name FROM sqlite_master WHERE name = 'dropped'").fetchone())
+            self.assertEqual(database.connect().execute("SELECT COUNT(*) FROM kept").fetchone()[0], 1)
+
+    def test_check_sql_answer_is_read_only(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "answers.db"))
+            database.fill_database(pd.DataFrame({'a': [1]}), 'kept')
+            self.assertTrue(database.check_sql_answer("SELECT a FROM kept", (1,)))
+            for answer in ["DELETE FROM kept RETURNING a", "COMMIT; DROP TABLE kept", "DROP TABLE kept", "CREATE TABLE answer (a)", "BEGIN"]:
+                with database.transaction() as cursor:
+                    cursor.execute("INSERT INTO kept (a) VALUES (2)")
+                    self.assertFalse(database.check_sql_answer(answer, (1,)))
+                    self.assertTrue(database.connect().in_transaction)  # the caller's transaction is untouched
+                with database.transaction() as cursor:
+                    cursor.execute("DELETE FROM kept WHERE a = 2")
+            self.assertEqual(database.connect().execute("SELECT a FROM kept").fetchall(), [(1,)])
+            self.assertEqual([row[0] for row in database.connect().execute("SELECT name FROM sqlite_master")], ['kept'])
+
+    def test_check_sql_answer_without_database_file(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.assertFalse(Database(os.path.join(directory, "missing.db")).check_sql_answer("SELECT 1", (1,)))
+        database = Database(":memory:")
+        database.fill_database(pd.DataFrame({'a': [1]}), 'kept')
+        self.assertFalse(database.check_sql_answer("SELECT a FROM kept", (1,)))
+
+    def test_connection_per_thread(self):
+        with tempfile.TemporaryDirectory() as directory:
+            database = Database(os.path.join(directory, "threads.db"))
+            shutil.copyfile("generated_hu.db", database.path)
+            self.assertIs(database.connect(), database.connect())
+            connections = []
+            thread = threading.Thread(target=lambda: connections.append((database.connect(), database.get_question_with_table(3))))
+            thread.start()
+            thread.join()
+            self.assertIsNot(connections[0][0], database.connect())
+            self.assertEqual(connections[0][1][1:], database.get_question_with_table(3)[1:])
+            copy = pickle.loads(pickle.dumps(database))
+            self.assertIsNot(copy.connect(), database.connect())
+            self.assertEqual(copy.get_database_info(), 54)
+            database.close()
+            self.assertEqual(database.get_database_info(), 54)
+
+class TestParquet(unittest.TestCase):
+    def test_dataframe_from_parquet(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, "table.parquet")
+            rows = [{'question': f'q{x}', 'answers': ['a', 'b'], 'table': {'header': ['Name', 'Age'], 'rows': [['Alice', '25']]}} for x in range(5)]
+            pd.DataFrame(rows).to_parquet(path)
+            database = Database(os.path.join(directory, "unused.db"))
+            df = database.dataframe_from_parquet(path)
+            self.assertEqual(len(df), 5)
+            streamed = list(database.iter_parquet_rows(path, batch_size=2))
+            self.assertEqual(len(streamed), 5)
+            for (_, row), streamed_row in zip(df.iterrows(), streamed):
+                table, question, answers = database.extract_parquet(row)
+                streamed_table, streamed_question, streamed_answers = database.extract_parquet(streamed_row)
+                pd.testing.assert_frame_equal(table, streamed_table)
+                self.assertEqual((question, answers), (streamed_question, streamed_answers))
+
+    def test_duplicate_columns(self):
+        self.assertTrue(Database.has_duplicate_columns(['Name', 'Name.1']))
+        self.assertFalse(Database.has_duplicate_columns(['Name', 'Age']))
+        self.assertTrue(Database.has_duplicate_columns(['Name', 'Age', 'Name.2']))
+        self.assertFalse(Database.has_duplicate_columns(['Q', 'Q1']))
+        self.assertFalse(Database.has_duplicate_columns(['20', '2011']))
+        self.assertFalse(Database.has_duplicate_columns(['Kor', 'Kor 1']))
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,78 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import sqlite3
+import tempfile
+import unittest
+from generation_cache import GenerationCache
+
+class TestGenerationCache(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, "generation_cache.db")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_only_missing_prompts_are_generated(self):
+        cache = GenerationCache(self.path)
+        generated = []
+        def generate(prompts: list[str]) -> list[str]:
+            generated.extend(prompts)
+            return [prompt.upper() for prompt in prompts]
+
+        self.assertEqual(cache.generate("model", "LLAMA3", ["a", "b"], {"max_tokens": 32}, generate), ["A", "B"])
+        self.assertEqual(cache.generate("model", "LLAMA3", ["b", "c"], {"max_tokens": 32}, generate), ["B", "C"])
+        self.assertEqual(generated, ["a", "b", "c"])
+        # every part of the key counts
+        cache.generate("model", "LLAMA3", ["a"], {"max_tokens": 64}, generate)
+        cache.generate("model", "LLAMA2", ["a"], {"max_tokens": 32}, generate)
+        cache.generate("other", "LLAMA3", ["a"], {"max_tokens": 32}, generate)
+        self.assertEqual(generated, ["a", "b", "c", "a", "a", "a"])
+        cache.close()
+
+    def test_read_only(self):
+        GenerationCache(self.path).put(GenerationCache.key("model", "LLAMA3", "a", {}), "A")
+        cache = GenerationCache(self.path, read_only=True)
+        self.assertEqual(cache.generate("model", "LLAMA3", ["a", "b"], {}, lambda prompts: ["new"] * len(prompts)), ["A", "new"])
+        self.assertIsNone(cache.get(GenerationCache.key("model", "LLAMA3", "b", {})))
+        cache.close()
+
+    def test_eviction(self):
+        cache = GenerationCache(self.path, max_bytes=1000)
+        for index in range(20):
+            cache.put(str(index), "x" * 100)
+        self.assertLessEqual(cache.size, 1000)
+        self.assertIsNotNone(cache.get("19"))
+        self.assertIsNone(cache.get("0"))
+        cache.close()
+
+    def test_access_times_are_written_in_batches(self):
+        cache = GenerationCache(self.path, access_flush_interval=3)
+        for key in ["a", "b", "c", "d"]:
+            cache.put(key, key.upper())
+        connection = sqlite3.connect(self.path)
+        def last_access(key: str) -> float:
+            return connection.execute("SELECT last_access FROM generations WHERE key = ?", (key,)).fetchone()[0]
+        stored = {key: last_access(key) for key in ["a", "b", "c", "d"]}
+        cache.get("a")
+        cache.get("b")
+        self.assertEqual((last_access("a"), last_access("b")), (stored["a"], stored["b"]))  # kept in memory
+        cache.get("a")
+        cache.get("c")  # the third hit key writes them
+        self.assertGreater(last_access("a"), stored["a"])
+        self.assertGreater(last_access("c"), stored["c"])
+        cache.get("d")
+        cache.close()
+        self.assertGreater(last_access("d"), stored["d"])
+        connection.close()
+
+    def test_read_only_hits_are_not_written(self):
+        GenerationCache(self.path).put("a", "A")
+        cache = GenerationCache(self.path, read_only=True, access_flush_interval=1)
+        self.assertEqual(cache.get("a"), "A")
+        self.assertEqual(cache.accessed, {})
+        cache.close()
+
+if __name__ == '__main__':
+    unittest.main()
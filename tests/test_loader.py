@@ -0,0 +1,87 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import unittest
+import tempfile
+from database import Database
+from loader import ArrowQuestionLoader, QuestionLoader, TableCache
+from utilities import TableFormat
+
+class TestQuestionLoader(unittest.TestCase):
+    data_path = "generated_hu.db"
+
+    def test_same_as_database(self):
+        database = Database(self.data_path)
+        with QuestionLoader(database, range(10), prefetch=2) as loader:
+            for data_index, (table, question, answers) in zip(loader.indices, loader):
+                expected_table, expected_question, expected_answers = database.get_question_with_table(data_index)
+                self.assertEqual(table, expected_table.to_csv(index=False))
+                self.assertEqual(question, expected_question)
+                self.assertEqual(answers, expected_answers)
+
+    def test_reiterate_after_break(self):
+        with QuestionLoader(Database(self.data_path), range(10), prefetch=2) as loader:
+            for _ in loader:
+                break
+            self.assertEqual(len(list(loader)), 10)
+
+    def test_sort_by_context(self):
+        with QuestionLoader(Database(self.data_path), range(20)) as loader:
+            loader.sort_by_context()
+            contexts = [loader.qa_rows[f'nt-{index}'][1] for index in loader.indices]
+            self.assertEqual(contexts, sorted(contexts))
+            self.assertEqual(sorted(loader.indices), list(range(20)))
+
+class TestTableCache(unittest.TestCase):
+    def test_hits_across_seeds(self):
+        cache = TableCache()
+        database = Database("generated_hu.db")
+        for _ in range(2):
+            with QuestionLoader(database, range(10), cache=cache) as loader:
+                list(loader)
+        contexts = {loader.qa_rows[f'nt-{index}'][1] for index in range(10)}
+        self.assertEqual(cache.misses, len(contexts))
+        self.assertEqual(cache.hits, 20 - len(contexts))
+
+    def test_format_is_part_of_the_key(self):
+        cache = TableCache()
+        cache.put("table", TableFormat.CSV, "a,b")
+        self.assertIsNone(cache.get("table", TableFormat.TSV))
+        self.assertEqual(cache.get("table", TableFormat.CSV), "a,b")
+
+    def test_memory_limit_evicts_least_recently_used(self):
+        cache = TableCache(max_bytes=3 * sys.getsizeof("x" * 100))
+        for name in ["a", "b", "c"]:
+            cache.put(name, TableFormat.CSV, name * 100)
+        cache.get("a", TableFormat.CSV)
+        cache.put("d", TableFormat.CSV, "d" * 100)
+        self.assertIsNone(cache.get("b", TableFormat.CSV))
+        self.assertIsNotNone(cache.get("a", TableFormat.CSV))
+        self.assertLessEqual(cache.size, cache.max_bytes)
+
+class TestArrowQuestionLoader(unittest.TestCase):
+    data_path = "generated_hu.db"
+
+    def test_same_as_question_loader(self):
+        database = Database(self.data_path)
+        with tempfile.TemporaryDirectory() as directory:
+            database.export_arrow(directory, table_formats=[TableFormat.CSV, TableFormat.JSON], parquet=True)
+            self.assertTrue(os.path.exists(os.path.join(directory, "context_tables.parquet")))
+            for table_format in [TableFormat.CSV, TableFormat.JSON]:
+                with QuestionLoader(database, range(20), table_format=table_format) as expected, ArrowQuestionLoader(directory, range(20), table_format=table_format) as loader:
+                    expected.sort_by_context()
+                    loader.sort_by_context()
+                    self.assertEqual(loader.indices, expected.indices)
+                    self.assertEqual(list(loader), list(expected))
+                    for index in loader.indices:
+                        self.assertEqual(loader.normalized_truth(index), expected.normalized_truth(index))
+
+    def test_missing_table_format(self):
+        with tempfile.TemporaryDirectory() as directory:
+            Database(self.data_path).export_arrow(directory)
+            with ArrowQuestionLoader(directory, range(2), table_format=TableFormat.TSV) as loader:
+                with self.assertRaises(KeyError):
+                    list(loader)
+
+if __name__ == '__main__':
+    unittest.main()
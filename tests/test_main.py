@@ -0,0 +1,111 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import multiprocessing
+import shutil
+import sqlite3
+import tempfile
+import unittest
+from concurrent.futures import ProcessPoolExecutor
+from checkpoint import CheckpointStore
+from database import Database
+from generation_cache import GenerationCache
+from loader import TableCache
+from main import Controller, thread_environment
+from mylogger import MyLogger
+from utilities import TableFormat
+
+class FakeModel:
+    """A model answering every question wrong, recording the micro-batches it was asked."""
+    def __init__(self) -> None:
+        self.name = 'fake'
+        self.seed = 0
+        self.batches: list[list[int]] = []
+
+    def generate_batch(self, indices: list[int], tables: list[str], questions: list[str]) -> list[str]:
+        self.batches.append(list(indices))
+        return ['nem tudom'] * len(indices)
+
+class TestMakeBatches(unittest.TestCase):
+    def test_ties_and_uneven_tail(self):
+        prompt_lengths = {5: 10, 2: 3, 7: 10, 1: 3, 9: 1}
+        self.assertEqual(Controller.make_batches(prompt_lengths, 2), [[9, 2], [1, 5], [7]])
+        self.assertEqual(Controller.make_batches(prompt_lengths, 3), [[9, 2, 1], [5, 7]])
+        self.assertEqual(Controller.make_batches(prompt_lengths, 8), [[9, 2, 1, 5, 7]])
+        self.assertEqual(Controller.make_batches({}, 4), [])
+
+    def test_given_order(self):
+        prompt_lengths = {5: 10, 2: 3, 7: 10, 1: 3, 9: 1}
+        self.assertEqual(Controller.make_batches(prompt_lengths, 2, order=[7, 1, 3, 5, 2, 9]), [[7, 1], [5, 2], [9]])
+
+class TestBatchedEvaluation(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        path = os.path.join(self.directory.name, 'generated_hu.db')
+        shutil.copyfile('generated_hu.db', path)
+        self.controller = Controller.__new__(Controller)  # no model list is needed
+        self.controller.database = Database(path)
+        self.controller.logger = MyLogger(log_path=os.path.join(self.directory.name, 'logs.log'), result_path=os.path.join(self.directory.name, 'result.csv'))
+        self.controller.table_cache = TableCache()
+        self.controller.table_format = TableFormat.CSV
+        self.controller.checkpoint = CheckpointStore(path)
+        self.controller.arrow_path = None
+
+    def tearDown(self):
+        self.controller.checkpoint.close()
+        self.directory.cleanup()
+
+    def test_resume(self):
+        with self.controller.open_loader(range(10)) as loader:
+            fingerprints = Controller.question_fingerprints(loader, range(10))
+        for index in [0, 3, 4]:
+            self.controller.checkpoint.save('fake', 0, index, 1.0, 'x', fingerprints[index])
+        self.controller.checkpoint.save('fake', 0, 5, 1.0, 'x')  # stored before the fingerprints
+        self.controller.checkpoint.save('fake', 0, 6, 1.0, 'x', fingerprints[7])  # another question was at this index
+        model = FakeModel()
+        results, _ = self.controller.evaluate_model(model, 1, 10, batch_size=4, resume=True)
+        self.assertEqual(results, [0.3])
+        self.assertEqual(sorted(index for batch in model.batches for index in batch), [1, 2, 5, 6, 7, 8, 9])
+        self.assertTrue(all(len(batch) <= 4 for batch in model.batches))
+        self.assertEqual(self.controller.checkpoint.load('fake', 0, range(10)), {index: 1.0 if index in [0, 3, 4] else 0.0 for index in range(10)})
+
+    def test_order_by_context(self):
+        model = FakeModel()
+        self.controller.evaluate_model(model, 1, 20, batch_size=3, order_by_context=True)
+        contexts = self.controller.database.get_qa_table()['context']
+        asked = [contexts[index] for batch in model.batches for index in batch]
+        self.assertEqual(asked, sorted(asked))
+        self.assertEqual(len(asked), 20)
+
+class TestWorkers(unittest.TestCase):
+    def test_thread_environment(self):
+        previous = os.environ.get("OMP_NUM_THREADS")
+        with thread_environment(3):
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as executor:
+                self.assertEqual(executor.submit(os.getenv, "MKL_NUM_THREADS").result(), "3")
+            self.assertEqual(os.environ["OMP_NUM_THREADS"], "3")
+        self.assertEqual(os.environ.get("OMP_NUM_THREADS"), previous)
+
+    def test_worker_skips_migrations(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'generated_hu.db')
+            shutil.copyfile('generated_hu.db', path)
+            model_list_path = os.path.join(directory, 'model_list.csv')
+            with open(model_list_path, 'w') as model_list:
+                model_list.write('Name,Model type,URL,Layer offset count,Prompt format\n')
+            GenerationCache(os.path.join(directory, 'cache.db')).close()  # created by the main process
+            worker = Controller(model_list_path, path, generation_cache_path=os.path.join(directory, 'cache.db'), migrate=False)
+            connection = sqlite3.connect(path)
+            try:
+                self.assertNotIn('num', [column[1] for column in connection.execute("PRAGMA table_info(qa_table)")])
+                self.assertIsNone(connection.execute("SELECT name FROM sqlite_master WHERE name = 'eval_checkpoint'").fetchone())
+                Controller(model_list_path, path, generation_cache_path=os.path.join(directory, 'cache.db'))
+                self.assertIn('num', [column[1] for column in connection.execute("PRAGMA table_info(qa_table)")])
+                self.assertIsNotNone(connection.execute("SELECT name FROM sqlite_master WHERE name = 'eval_checkpoint'").fetchone())
+            finally:
+                connection.close()
+            worker.checkpoint.save('model', 0, 0, 1.0, 'answer')  # the worker writes into the schema of the main process
+            self.assertEqual(worker.checkpoint.load('model', 0, range(1)), {0: 1.0})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,14 @@ import sys
 import os
 sys.path.append(f"{os.getcwd()}/src")
 import unittest
+import json
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 from openai_module import *
+from models import ModelOpenAI
 
 class TestCleanString(unittest.TestCase):
     def test_call_openai(self):
@@ -20,5 +27,105 @@ class TestCleanString(unittest.TestCase):
             question = generate_question_from_sentence_openai(sentence, answer)
             self.assertIsNotNone(question)
             
+class MockChatCompletions(BaseHTTPRequestHandler):
+    """Mimics the chat completions endpoint, the first requests are rate limited."""
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    rate_limited = 0
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        cls = type(self)
+        with cls.lock:
+            if cls.rate_limited > 0:
+                cls.rate_limited -= 1
+                self.send_json(429, {"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}, {"Retry-After": "0"})
+                return
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        time.sleep(0.05)
+        with cls.lock:
+            cls.in_flight -= 1
+        self.send_json(200, {
+            "id": "chatcmpl-0",
+            "object": "chat.completion",
+            "created": 0,
+            "model": body["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": body["messages"][0]["content"].upper()}}],
+        })
+
+    def send_json(self, status: int, data: dict, headers: dict = {}):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *_):
+        pass
+
+class TestAsyncChatClient(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockChatCompletions)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.client = AsyncChatClient(max_in_flight=4, backoff=0.01, base_url=f"http://127.0.0.1:{self.server.server_port}/v1", api_key="test")
+
+    def tearDown(self):
+        self.client.close()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_concurrency_limit(self):
+        MockChatCompletions.max_in_flight = 0
+        prompts = [f"question {index}" for index in range(20)]
+        answers = self.client.complete_many(prompts)
+        self.assertEqual(answers, [prompt.upper() for prompt in prompts])
+        self.assertLessEqual(MockChatCompletions.max_in_flight, 4)
+        self.assertGreater(MockChatCompletions.max_in_flight, 1)
+
+    def test_rate_limit_retry(self):
+        MockChatCompletions.rate_limited = 3
+        self.assertEqual(self.client.complete_many(["a", "b"]), ["A", "B"])
+        self.assertEqual(MockChatCompletions.rate_limited, 0)
+
+class TestModelOpenAI(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), MockChatCompletions)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.directory = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.directory.name, "generation_cache.db")
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.directory.cleanup()
+
+    def model(self, cache: GenerationCache) -> ModelOpenAI:
+        return ModelOpenAI("gpt-test", base_url=f"http://127.0.0.1:{self.server.server_port}/v1", cache=cache)
+
+    def test_client_only_for_cache_misses(self):
+        tables, questions = ["Név,Kor\nAnna,25", "Név,Kor\nBéla,30"], ["Hány éves Anna?", "Hány éves Béla?"]
+        with mock.patch.dict(os.environ, {"OPENAI_API_KEY": "test"}):
+            model = self.model(GenerationCache(self.cache_path))
+            self.assertIsNone(model.client)
+            answers = model.generate_batch([0, 1], tables, questions)
+            thread = model.client.thread
+            model.close()
+            self.assertIsNone(model.client)
+            self.assertFalse(thread.is_alive())
+            model.cache.close()
+        with mock.patch.dict(os.environ):
+            os.environ.pop("OPENAI_API_KEY", None)
+            model = self.model(GenerationCache(self.cache_path, read_only=True))  # re-scoring needs no API key
+            self.assertEqual(model.generate_batch([0, 1], tables, questions), answers)
+            self.assertEqual(model.generate_text(1, tables[1], questions[1]), answers[1])
+            self.assertIsNone(model.client)
+            model.close()
+            model.cache.close()
+
 if __name__ == '__main__':
     unittest.main()
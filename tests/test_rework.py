@@ -0,0 +1,103 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import shutil
+import tempfile
+import unittest
+import zlib
+from database import Database
+from mylogger import MyLogger
+from openai_module import DEFAULT_OPENAI_MODEL
+from WikipediaYoinker import Algorithm, WikiYoinker
+
+tokens = ['város', 'Hány', 'piros', 'mikor', 'Szeged', 'ki', 'a']
+
+class FakeUnmasker:
+    """A fill-mask pipeline answering five tokens picked by the checksum of the prompt, like the pipeline it unwraps a single prompt."""
+    def __init__(self) -> None:
+        self.batch_sizes: list[int] = []
+        self.prompt_count = 0
+
+    def answer(self, prompt: str) -> list[dict]:
+        self.prompt_count += 1
+        seed = zlib.crc32(prompt.encode('utf-8'))
+        return [{'token_str': tokens[(seed + rank * 3) % len(tokens)] if seed % 3 else 'város', 'score': 0.5 / (rank + 1)} for rank in range(5)]
+
+    def __call__(self, inputs, batch_size: int = 1):
+        if isinstance(inputs, str):
+            return self.answer(inputs)
+        self.batch_sizes.append(batch_size)
+        return (self.answer(prompt) for prompt in inputs)
+
+class TestBatchedRework(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.logger = MyLogger(log_path=os.path.join(self.directory.name, 'wiki.log'), result_path=os.path.join(self.directory.name, 'result.log'))
+        self.wikiyoinker = WikiYoinker.__new__(WikiYoinker)
+        self.wikiyoinker.logger = self.logger
+        self.wikiyoinker.unmasker = FakeUnmasker()
+        self.wikiyoinker.unmasker_model = 'xlm-roberta-base'
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def copy_database(self, name: str) -> Database:
+        path = os.path.join(self.directory.name, name)
+        shutil.copyfile('generated_hu.db', path)
+        return Database(path)
+
+    def test_same_questions_as_one_by_one(self):
+        one_by_one = self.copy_database('one_by_one.db')
+        batched = self.copy_database('batched.db')
+        self.wikiyoinker.algorithm_db_rework(one_by_one, Algorithm.ROBERTA)
+        self.assertGreater(self.wikiyoinker.algorithm_db_rework(batched, Algorithm.ROBERTA, batch_size=8), 0)
+        self.assertEqual(self.wikiyoinker.unmasker.batch_sizes, [8])
+        expected = one_by_one.get_qa_table()
+        reworked = batched.get_qa_table()
+        self.assertTrue(reworked.equals(expected))
+        self.assertGreater(reworked['utterance'].str.endswith('?').sum(), 0)
+
+    def test_single_and_skipped_statements(self):
+        statements = ['A labda piros.', 'Szeged Szeged város.', 'x' * 513 + '.']
+        answers = ['piros', 'Szeged', 'x']
+        results = self.wikiyoinker.batch_generate_questions(statements, answers, batch_size=4)
+        expected = [self.wikiyoinker.algorithm_generate_question(statement, answer) for statement, answer in zip(statements, answers)]
+        self.assertEqual(results, expected)
+        self.assertEqual(results[1], ("Multiple answer word found in the sentence.", True))
+        self.assertEqual(self.wikiyoinker.batch_generate_questions(statements[1:], answers[1:]), expected[1:])
+
+    def test_incremental_rework(self):
+        database = self.copy_database('incremental.db')
+        unmasker = self.wikiyoinker.unmasker
+        self.wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA, batch_size=8)
+        self.assertEqual(unmasker.prompt_count, 54)
+        reworked = database.get_qa_table()
+        self.assertEqual(reworked['fingerprint'].nunique(), len(reworked[['original', 'targetValue']].drop_duplicates()))
+
+        self.assertEqual(self.wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA, batch_size=8), 0.0)
+        self.assertEqual(unmasker.prompt_count, 54)
+        self.assertTrue(database.get_qa_table().equals(reworked))
+
+        database.generate_questions_table('new_table', reworked.iloc[:2, :3], [('kérdés?', 'piros', True, 'A labda piros.'), ('kérdés?', 'Szeged', True, 'Szeged város.')], if_exists='append')
+        changed = database.get_qa_table()
+        changed.loc[0, 'targetValue'] = 'legtöbben'
+        database.set_qa_table(changed)
+        self.wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA)
+        self.assertEqual(unmasker.prompt_count, 57)
+        updated = database.get_qa_table()
+        self.assertEqual(updated['fingerprint'].isna().sum(), 0)
+        self.assertTrue(updated.iloc[1:54].equals(changed.assign(fingerprint=updated['fingerprint']).iloc[1:54]))
+        self.assertNotEqual(updated.loc[54, 'utterance'], 'kérdés?')
+
+        self.wikiyoinker.unmasker_model = 'xlm-roberta-large'
+        self.wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA, batch_size=8)
+        self.assertEqual(unmasker.prompt_count, 57 + 56)
+        self.wikiyoinker.algorithm_db_rework(database, Algorithm.ROBERTA, batch_size=8, force=True)
+        self.assertEqual(unmasker.prompt_count, 57 + 2 * 56)
+
+    def test_model_version(self):
+        self.assertEqual(self.wikiyoinker.model_version(Algorithm.OPENAI), DEFAULT_OPENAI_MODEL)
+        self.assertEqual(self.wikiyoinker.model_version(Algorithm.ROBERTA), 'xlm-roberta-base')
+
+if __name__ == '__main__':
+    unittest.main()
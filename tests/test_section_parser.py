@@ -0,0 +1,154 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import unittest
+import warnings
+import re
+import pandas as pd
+from WikipediaYoinker import Section, SectionParser, SentenceIndex, WikiYoinker, skip_sections
+
+saved_page = """
+<!DOCTYPE html><html><head><title>Példa</title><link rel="canonical" href="https://hu.wikipedia.org/wiki/P"/></head><body>
+<div class="mw-body"><p>Bevezető szöveg 1,5 értékkel.</p>
+<div class="mw-heading mw-heading2"><h2 id="Történet">Történet</h2><span class="mw-editsection">[szerkesztés]</span></div>
+<p>A várost <b>1241</b>-ben a tatárok pusztították el.<sup id="cite_ref-1" class="reference"><a href="#cite_note-1"><span class="cite-bracket">[</span>1<span class="cite-bracket">]</span></a></sup> Lakossága 12,5 ezer fő &amp; több.</p>
+<p>Második   bekezdés
+több sorban.</p>
+<table class="wikitable"><tbody><tr><th>Év</th><th>Népesség</th><th>Arány</th></tr>
+<tr><td>1990</td><td>175 301</td><td>1,5</td></tr>
+<tr><td rowspan="2">2000</td><td>168 273<sup class="reference">[2]</sup></td><td>2,25</td></tr>
+<tr><td colspan="2">nincs<br>adat</td></tr>
+<tr><td>2010</td><td><span style="display:none">rejtett</span>170 052</td><td><style>.x{}</style>3</td></tr>
+</tbody></table>
+<h3 id="Alfejezet">Alfejezet</h3>
+<p>Alfejezet szövege, 3,14 értékkel.</p>
+<div class="mw-heading mw-heading2"><h2 id="Földrajz">Földrajz</h2></div>
+<table class="wikitable"><thead><tr><th colspan="2">Terület</th></tr><tr><th>Név</th><th>km²</th></tr></thead>
+<tbody><tr><td>Belváros</td><td>12,3</td></tr><tr><td>Újszeged</td><td>7,4</td></tr></tbody></table>
+<table><tr><td>Külső<table><tr><td>Belső</td></tr></table></td><td>x</td></tr></table>
+<p></p>
+<div class="mw-heading mw-heading2"><h2 id="Kapcsolódó_szócikkek">Kapcsolódó szócikkek</h2></div>
+<p>Skip.</p>
+<div class="mw-heading mw-heading2"><h2 id="Üres">Üres</h2></div>
+<ul><li>Lista</li></ul>
+<div class="mw-heading mw-heading2"><h2 id="Jegyzetek">Jegyzetek</h2></div>
+<p>Lábléc.</p>
+</div></body></html>
+"""
+
+def legacy_sections(page: str) -> list[Section]:
+    """The sections of the previous string splitting parser."""
+    section_objs = []
+    for section in page.replace("–", "-").split('<h2')[1:-1]:
+        section = '<h2' + section
+        id_start = section.find('id="') + len('id="')
+        section_id = section[id_start:section.find('"', id_start)]
+        if section_id not in skip_sections:
+            section_objs.append(Section(section_name=section_id, raw_section_data=section[section.find('</h2>') + len('</h2>'):]))
+    return section_objs
+
+def legacy_paragraphs(section_content: str) -> list[str]:
+    """The <p> tags found by the previous loop, cutting off the processed part of the section."""
+    paragraphs = []
+    while True:
+        p_start = section_content.find('<p')
+        if p_start == -1:
+            return paragraphs
+        p_end = section_content.find('</p>', p_start) + len('</p>')
+        paragraphs.append(section_content[p_start:p_end])
+        section_content = section_content[p_end:]
+
+def legacy_matching_words(sentences: list[str], paragraph: str, table: pd.DataFrame) -> list[dict]:
+    """The matches of the previous find_matching_words, comparing every cell to every sentence."""
+    words_in_paragraph = set(re.findall(r'\b\w+(?:\.\w+)?\b', paragraph.lower()))
+    cell_dict = {}
+    for i, row in table.iterrows():
+        for j, cell in enumerate(row):
+            cell_dict[str(cell).strip().lower()] = (i, j)
+    results = []
+    for cell_str, coordinate in cell_dict.items():
+        if cell_str in [s.lower() for s in sentences]:
+            results += [{'cell_coordinates': coordinate, 'matching_sentence': s} for s in sentences if s.lower() == cell_str]
+        elif cell_str in words_in_paragraph:
+            results += [{'cell_coordinates': coordinate, 'matching_sentence': s} for s in sentences if cell_str in set(re.findall(r'\b\w+(?:\.\w+)?\b', s.lower()))]
+    return results
+
+def matcher(strict: bool = True, match_phrases: bool = False) -> WikiYoinker:
+    """A WikiYoinker with only the matching options, without loading the fill-mask model."""
+    wikiyoinker = WikiYoinker.__new__(WikiYoinker)
+    wikiyoinker.strict = strict
+    wikiyoinker.match_phrases = match_phrases
+    return wikiyoinker
+
+class TestSectionParser(unittest.TestCase):
+    def test_same_as_legacy_sections(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            expected = legacy_sections(saved_page)
+        sections = WikiYoinker.convert_html_to_section_data(saved_page)
+        self.assertEqual([str(section) for section in sections], ['Történet', 'Földrajz', 'Üres'])
+        self.assertEqual([str(section) for section in sections], [str(section) for section in expected])
+        for section, expected_section in zip(sections, expected):
+            self.assertEqual(section.paragraph, expected_section.paragraph.replace('&amp;', '&'))
+            self.assertEqual(len(section.list_of_tables), len(expected_section.list_of_tables))
+            for table, expected_table in zip(section.list_of_tables, expected_section.list_of_tables):
+                self.assertTrue(table.equals(expected_table))
+
+    def test_differences_from_legacy(self):
+        cases = [
+            # the legacy '<p' search also matched <pre>, the preformatted text is not a paragraph
+            ('<p>Első.</p><pre>kód sor</pre><p>Második.</p>', 'Első. kód sorMásodik.', 'Első. Második.'),
+            # a <table> closes the open <p> in HTML, the cells stay in the table and the text after it is outside the paragraph
+            ('<p>Intro <table><tr><td>x</td></tr></table> after</p>', 'Intro x after', 'Intro'),
+            # unclosed <p> tags are closed by the next one and joined with a space after their own trailing space
+            ('<p>Egy <p>Kettő <p>Három', 'Egy Kettő Három', 'Egy  Kettő  Három'),
+        ]
+        for body, legacy_paragraph, paragraph in cases:
+            page = f'<html><body><h2 id="A">A</h2>{body}<h2 id="Jegyzetek">J</h2><p>x</p></body></html>'
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore")
+                self.assertEqual(legacy_sections(page)[0].paragraph, legacy_paragraph)
+            self.assertEqual(SectionParser.parse(page)[0].paragraph, paragraph)
+
+    def test_citations_and_hidden_cells(self):
+        section = SectionParser.parse(saved_page)[0]
+        self.assertNotIn('[1]', section.paragraph)
+        self.assertIn('12.5 ezer fő', section.paragraph)
+        table = section.list_of_tables[0]
+        self.assertEqual(table.iat[3, 1], '170052')
+        self.assertEqual(table.iat[2, 1], 'nincs adat')
+
+    def test_iter_paragraphs(self):
+        contents = [saved_page, '', 'no paragraph', '<p>a</p><pre>b</pre><p class="x">c</p>', '<p>unclosed <p>twice', 'ab<p>x', '<p>a</p> <p>b', '<p</p></p><p>']
+        for content in contents:
+            self.assertEqual(list(Section.iter_paragraphs(content)), legacy_paragraphs(content))
+            for start in range(min(len(content), 12)):
+                self.assertEqual(list(Section.iter_paragraphs(content, start)), legacy_paragraphs(content[start:]))
+
+class TestFindMatchingWords(unittest.TestCase):
+    paragraph = "Szeged népessége 1990-ben 175301 fő volt. A Tisza mellett fekszik, Csongrád megyében. Szeged! A 2,5 km hosszú híd 1883-ban épült. Szeged! Nagy Imre szobra 12.5 méter."
+    table = pd.DataFrame([[1990, 175301, 'Szeged'], [2000, 'szeged!', 'Tisza'], [1883, 'Nagy Imre', '12.5'], [2010, 'Szeged', 'nincs']], index=[3, 5, 7, 9], columns=['Év', 'Érték', 'Név'])
+
+    def test_same_as_legacy(self):
+        sentences = re.split(r'(?<=[.!?])\s+', self.paragraph)
+        results = matcher().find_matching_words(self.paragraph, self.table)
+        self.assertEqual(results, legacy_matching_words(sentences, self.paragraph, self.table))
+        self.assertEqual(len(results), 10)
+        sentences = list(set(re.split(r'(?<=[.!?;,])\s+', self.paragraph) + sentences))
+        self.assertEqual(matcher(strict=False).find_matching_words(self.paragraph, self.table), legacy_matching_words(sentences, self.paragraph, self.table))
+        section = SectionParser.parse(saved_page)[0]
+        sentences = re.split(r'(?<=[.!?])\s+', section.paragraph)
+        for table in section.list_of_tables:
+            self.assertEqual(matcher().find_matching_words(section.paragraph, table), legacy_matching_words(sentences, section.paragraph, table))
+
+    def test_match_phrases(self):
+        results = matcher(match_phrases=True).find_matching_words(self.paragraph, self.table)
+        self.assertIn({'cell_coordinates': (7, 1), 'matching_sentence': 'Nagy Imre szobra 12.5 méter.'}, results)
+        self.assertNotIn('Nagy Imre', [str(self.table.loc[row].iloc[col]) for row, col in (result['cell_coordinates'] for result in matcher().find_matching_words(self.paragraph, self.table))])
+        index = SentenceIndex(['A Tisza mellett.', 'Mellett a Tisza.'])
+        self.assertEqual(index.find('a tisza', match_phrases=True), ['A Tisza mellett.', 'Mellett a Tisza.'])
+        self.assertEqual(index.find('tisza mellett', match_phrases=True), ['A Tisza mellett.'])
+        self.assertEqual(index.find('tisza mellett'), [])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -2,7 +2,7 @@ import sys
 import os
 sys.path.append(f"{os.getcwd()}/src")
 import unittest
-from utilities import clean_string
+from utilities import clean_string, scoring, normalize_truth, score_batch
 
 class TestCleanString(unittest.TestCase):
 
@@ -16,5 +16,15 @@ class TestCleanString(unittest.TestCase):
         for raw_string, expected_string in input_list:
             self.assertEqual(clean_string(raw_string), expected_string)
 
+class TestScoring(unittest.TestCase):
+
+    def test_score_batch_matches_scoring(self):
+        truths = [["1990"], ["szerb", "német"], ["44\xa0502 fő"], ["Szeged|Budapest"]]
+        answers = [["1990."], ["Német", "szerb", "cigány"], ["44502 fő"], ["Szeged"]]
+        scores, mean = score_batch([normalize_truth(truth) for truth in truths], answers)
+        self.assertEqual(scores, [scoring(truth, answer) for truth, answer in zip(truths, answers)])
+        self.assertEqual(scores, [1.0, 1.0, 1.0, 0.0])
+        self.assertEqual(mean, 0.75)
+
 if __name__ == '__main__':
     unittest.main()
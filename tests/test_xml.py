@@ -1,5 +1,15 @@
+import sys
+import os
+sys.path.append(f"{os.getcwd()}/src")
+import unittest
+import bz2
+import signal
+import threading
+import tempfile
+from xml.sax.saxutils import escape
 import mwxml
 import json
+from dump_reader import DumpReader, page_to_sections, read_pages
 
 def save_json_to_file(json_data, file_path):
     """
@@ -30,6 +40,107 @@ def get_page_content_as_json(dump_file_path, target_title) -> str:
                 return revision.text
     return None
 
+dump_template = """<mediawiki xmlns="http://www.mediawiki.org/xml/export-0.10/" version="0.10" xml:lang="hu">
+  <siteinfo>
+    <sitename>Wikipédia</sitename>
+    <dbname>huwiki</dbname>
+    <namespaces>
+      <namespace key="0" case="first-letter" />
+      <namespace key="10" case="first-letter">Sablon</namespace>
+    </namespaces>
+  </siteinfo>
+{pages}
+</mediawiki>
+"""
+
+page_template = """  <page>
+    <title>{title}</title>
+    <ns>{namespace}</ns>
+    <id>{id}</id>{redirect}
+    <revision>
+      <id>{id}00</id>
+      <timestamp>2024-10-20T00:00:00Z</timestamp>
+      <contributor><username>Teszt</username><id>1</id></contributor>
+      <model>wikitext</model>
+      <format>text/x-wiki</format>
+      <text bytes="{size}" xml:space="preserve">{text}</text>
+      <sha1>abc</sha1>
+    </revision>
+  </page>"""
+
+city_wikitext = """{{Település infobox|név=Példa}}
+'''Példaváros''' egy város.
+
+== Népesség ==
+A város népessége 1990-ben 12345 fő volt.<ref>KSH</ref> A [[Tisza|folyó]] mellett fekszik.
+
+{| class="wikitable"
+! Év !! Népesség
+|-
+| 1990 || 12345
+|-
+| style="text-align:right" | 2000 || 13000
+|}
+
+== Kapcsolódó szócikkek ==
+* [[Szeged]]
+"""
+
+def write_dump(path: str, pages: list[tuple[str, int, str, bool]]):
+    """Writes a small bz2 compressed pages-articles dump with (title, namespace, wikitext, redirect) pages."""
+    rendered = []
+    for index, (title, namespace, text, redirect) in enumerate(pages):
+        redirect_tag = '\n    <redirect title="Példaváros 0" />' if redirect else ''
+        rendered.append(page_template.format(title=title, namespace=namespace, id=index + 1, redirect=redirect_tag, size=len(text), text=escape(text)))
+    with bz2.open(path, 'wt', encoding='utf-8') as file:
+        file.write(dump_template.format(pages='\n'.join(rendered)))
+
+class TestDumpReader(unittest.TestCase):
+    def test_page_to_sections(self):
+        sections = page_to_sections(city_wikitext)
+        self.assertEqual([str(section) for section in sections], ['Népesség'])
+        self.assertEqual(sections[0].paragraph, 'A város népessége 1990-ben 12345 fő volt. A folyó mellett fekszik.')
+        table = sections[0].list_of_tables[0]
+        self.assertEqual(list(table.columns), ['Év', 'Népesség'])
+        self.assertEqual(table.values.tolist(), [[1990, 12345], [2000, 13000]])
+
+    def test_read_dump(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'huwiki-pages-articles.xml.bz2')
+            pages = [(f'Példaváros {index}', 0, city_wikitext, False) for index in range(6)]
+            pages += [('Példa átirányítás', 0, '#ÁTIRÁNYÍTÁS [[Példaváros 0]]', True), ('Sablon:Példa', 10, 'sablon', False)]
+            write_dump(path, pages)
+            self.assertEqual(len(list(read_pages(path))), 6)
+            results = dict(DumpReader(path, workers=2, queue_size=2))
+            self.assertEqual(sorted(results), sorted(f'https://hu.wikipedia.org/wiki/Példaváros_{index}' for index in range(6)))
+            for sections in results.values():
+                self.assertEqual(len(sections[0].list_of_tables), 1)
+
+    def test_dead_worker(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'huwiki-pages-articles.xml.bz2')
+            write_dump(path, [(f'Példaváros {index}', 0, city_wikitext, False) for index in range(6)])
+            reader = DumpReader(path, workers=2, queue_size=2)
+            urls = []
+            def iterate():
+                for url, _ in reader:
+                    if not urls:
+                        reader.processes[0].kill()
+                    urls.append(url)
+            thread = threading.Thread(target=iterate, daemon=True)
+            thread.start()
+            thread.join(timeout=60)
+            self.assertFalse(thread.is_alive())
+            self.assertGreaterEqual(len(urls), 1)
+            self.assertEqual(len(reader.errors), 1)
+            self.assertIn(f"{-signal.SIGKILL}", str(reader.errors[0][1]))
+
+    def test_read_error(self):
+        with tempfile.TemporaryDirectory() as directory:
+            reader = DumpReader(os.path.join(directory, 'missing.xml'), workers=1)
+            self.assertEqual(list(reader), [])
+            self.assertIsInstance(reader.errors[0][1], FileNotFoundError)
+
 if __name__ == "__main__":
     # Usage example
     dump_file_path = "/home/gabortoth/Letöltések/huwiki-20241020-pages-articles.xml"